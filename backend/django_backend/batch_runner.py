@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+离线批量分析：读取 JSONL 问题文件，经有界线程池并发执行检索和生成，结果逐条追加写入 JSONL
+
+输入每行一个 JSON 对象：
+    {"id": "INC-1024", "query": "订单服务大量 DB_CONNECTION_LOST 是什么原因", "context": "可选的补充说明"}
+id 缺省时使用行号（line-N），query 也可写作 question。
+
+输出每行对应一个问题，包含回答（不含推理过程，--keep-reasoning 时另存于 reasoning 字段）、
+对话类型、检索条数以及检索/生成/总耗时；
+每条结果写入后立即 fsync，进程崩溃后用相同参数重新运行即可跳过已成功的问题继续处理，
+失败的问题（error 非空）会在下次运行时重试。
+
+检索可以由多个线程并行执行，大模型调用另由 --llm-concurrency 限制同时发往 Ollama 的请求数
+（一般与 Ollama 的 OLLAMA_NUM_PARALLEL 一致）。
+
+用法（在 backend/django_backend 目录下）:
+    python batch_runner.py incidents.jsonl -o results.jsonl --workers 4 --llm-concurrency 1
+    python batch_runner.py incidents.jsonl -o results.jsonl --report report.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+def read_requests(path: str) -> Iterator[Dict]:
+    """逐行读取问题，跳过空行；格式错误的行记录日志后跳过"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                logger.error(f"第 {line_no} 行不是合法的 JSON，已跳过: {e}")
+                continue
+            query = (item.get("query") or item.get("question") or "").strip()
+            if not query:
+                logger.error(f"第 {line_no} 行缺少 query，已跳过")
+                continue
+            yield {
+                "id": str(item.get("id") or f"line-{line_no}"),
+                "query": query,
+                "context": item.get("context") or "",
+            }
+
+
+def completed_ids(path: str) -> Set[str]:
+    """
+    读取已有的输出文件，返回已成功处理的问题 id
+    崩溃时写了一半的末行会被截掉，避免后续追加的结果与之拼在同一行
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+            data = data[:data.rfind(b"\n") + 1]
+            logger.warning(f"输出文件末行不完整，已截断: {path}")
+
+    done = set()
+    for line in data.decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if not record.get("error"):
+            done.add(record["id"])
+    return done
+
+
+class ResultWriter:
+    """多线程共用的结果文件，每条记录写入后 fsync"""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class BatchRunner:
+    def __init__(self, system, llm_concurrency: int = 1, top_k: int = 5, keep_reasoning: bool = False):
+        self.system = system
+        self.top_k = top_k
+        self.keep_reasoning = keep_reasoning
+        self._llm_slots = threading.BoundedSemaphore(max(1, llm_concurrency))
+
+    def analyze(self, item: Dict) -> Dict:
+        """处理单个问题：检索不受限制，大模型调用需取得并发名额"""
+        record = {"id": item["id"], "query": item["query"], "response": None, "error": None}
+        started = time.perf_counter()
+        try:
+            # 与在线对话共用同一套准备流程（精确统计、检索、构建 Prompt），补充说明作为对话历史放进 Prompt
+            context = {"context": item["context"], "history": item["context"], "logs": []}
+            prompt, conversation_type = self.system.prepare_response(item["query"], context, top_k=self.top_k)
+            retrieved = queued = time.perf_counter()
+            if prompt is None:
+                record["response"] = context["answer"]  # 统计类问题由日志表直接回答，不占用大模型名额
+            else:
+                with self._llm_slots:
+                    queued = time.perf_counter()
+                    record["response"] = self.system.complete_response(prompt, conversation_type, context)
+            finished = time.perf_counter()
+            if self.keep_reasoning:
+                record["reasoning"] = context["reasoning"]
+
+            record.update({
+                "conversation_type": conversation_type.value,
+                "logs": len(context["logs"]),
+                "retrieval_seconds": round(retrieved - started, 3),
+                "llm_wait_seconds": round(queued - retrieved, 3),
+                "generation_seconds": round(finished - queued, 3),
+            })
+        except Exception as e:
+            logger.exception(f"问题 {item['id']} 处理失败")
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["latency_seconds"] = round(time.perf_counter() - started, 3)
+        record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        return record
+
+    def run(self, items: Iterator[Dict], writer: ResultWriter, workers: int) -> List[Dict]:
+        """
+        有界线程池执行，同时在途的问题不超过 workers 的两倍，输入文件很大时也不会一次性全部提交
+        返回本次处理的全部结果记录
+        """
+        records = []
+        max_pending = max(1, workers) * 2
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+            pending = set()
+            for item in items:
+                if len(pending) >= max_pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    records += self._collect(finished, writer, len(records))
+                pending.add(pool.submit(self.analyze, item))
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                records += self._collect(finished, writer, len(records))
+        return records
+
+    @staticmethod
+    def _collect(futures, writer: ResultWriter, done_before: int) -> List[Dict]:
+        records = []
+        for future in futures:
+            record = future.result()
+            writer.write(record)
+            records.append(record)
+            status = "失败" if record["error"] else "完成"
+            logger.info(f"[{done_before + len(records)}] {record['id']} {status}，耗时 {record['latency_seconds']:.2f} 秒")
+        return records
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(records: List[Dict], skipped: int, wall_seconds: float) -> Dict:
+    """吞吐量和各阶段延迟分位数，只统计成功的问题"""
+    ok = [r for r in records if not r["error"]]
+    summary = {
+        "processed": len(records),
+        "succeeded": len(ok),
+        "failed": len(records) - len(ok),
+        "skipped": skipped,
+        "wall_seconds": round(wall_seconds, 2),
+        "throughput_per_minute": round(len(records) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+    }
+    for field in ("latency_seconds", "retrieval_seconds", "llm_wait_seconds", "generation_seconds"):
+        samples = [r[field] for r in ok]
+        summary[field.replace("_seconds", "")] = {
+            "p50": percentile(samples, 50),
+            "p95": percentile(samples, 95),
+            "p99": percentile(samples, 99),
+            "max": max(samples, default=0.0),
+        }
+    return summary
+
+
+def print_summary(summary: Dict) -> None:
+    print(f"处理 {summary['processed']} 条（成功 {summary['succeeded']}，失败 {summary['failed']}），"
+          f"跳过已完成 {summary['skipped']} 条")
+    print(f"总耗时 {summary['wall_seconds']:.1f} 秒，吞吐 {summary['throughput_per_minute']:.1f} 条/分钟")
+    print(f"{'阶段':<12}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for stage in ("latency", "retrieval", "llm_wait", "generation"):
+        s = summary[stage]
+        print(f"{stage:<12}{s['p50']:>9.2f}{s['p95']:>9.2f}{s['p99']:>9.2f}{s['max']:>9.2f}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="问题文件（JSONL）")
+    parser.add_argument("-o", "--output", required=True, help="结果文件（JSONL），已存在时续跑")
+    parser.add_argument("--workers", type=int, default=4, help="并发处理的问题数")
+    parser.add_argument("--llm-concurrency", type=int, default=1, help="同时发往 Ollama 的生成请求数")
+    parser.add_argument("--top-k", type=int, default=5, help="每个问题检索的日志条数")
+    parser.add_argument("--report", help="把统计结果另存为 JSON")
+    parser.add_argument("--keep-reasoning", action="store_true", help="在结果中保留模型的推理过程（<think> 块）")
+    parser.add_argument("--log-path", default=os.environ.get("LOG_DATA_PATH", "./data/log"))
+    parser.add_argument("--vector-store-path", default=os.environ.get("VECTOR_STORE_PATH", "./data/vector_stores"))
+    parser.add_argument("--llm", default="deepseek-r1:7b")
+    parser.add_argument("--fast-llm", default="", help="概念解释、一般问答使用的快速模型，默认全部使用 --llm")
+    parser.add_argument("--embedding-model", default="bge-large:latest")
+    args = parser.parse_args(argv)
+
+    done = completed_ids(args.output)
+    skipped = 0
+
+    def pending_items():
+        nonlocal skipped
+        for item in read_requests(args.input):
+            if item["id"] in done:
+                skipped += 1
+                continue
+            yield item
+
+    from topklogsystem import TopKLogSystem
+
+    system = TopKLogSystem(
+        log_path=args.log_path,
+        llm=args.llm,
+        embedding_model=args.embedding_model,
+        vector_store_path=args.vector_store_path,
+        fast_llm=args.fast_llm,
+    )
+    runner = BatchRunner(system, llm_concurrency=args.llm_concurrency, top_k=args.top_k,
+                         keep_reasoning=args.keep_reasoning)
+
+    writer = ResultWriter(args.output)
+    started = time.perf_counter()
+    try:
+        records = runner.run(pending_items(), writer, args.workers)
+    finally:
+        writer.close()
+
+    summary = summarize(records, skipped, time.perf_counter() - started)
+    print_summary(summary)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+"""
+/api/chat 端到端压测：逐级提高并发用户数，输出各服务器配置下的扩展曲线
+
+每个虚拟用户通过 /api/login 获取 API Key，使用独立会话连续进行多轮 /api/chat 对话。
+每个并发级别统计吞吐量、延迟分位数、错误率（区分 429、SQLite 锁错误、其他 5xx、
+客户端超时）以及服务器进程（含 worker 子进程）的 RSS。
+
+服务器在临时数据库和临时工作目录中启动，大模型和嵌入模型默认使用离线替身
+（IDA_LLM_BACKEND=fake / IDA_EMBEDDING_BACKEND=hashing），支持的服务器配置：
+
+- runserver: manage.py runserver --noreload（Django 开发服务器，每请求一线程）
+- wsgi-threads: 固定大小线程池的 WSGI 服务器（--server-threads）
+- uvicorn: ASGI，uvicorn --workers（--server-workers）
+
+用法（在 backend/django_backend 目录下）:
+    python benchmarks/chat_load.py --servers runserver wsgi-threads uvicorn --concurrency 1 4 16 --turns 5
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "PaymentService 出现 DB_CONNECTION_LOST，是什么原因？",
+    "这个问题会影响哪些下游服务？",
+    "应该怎么预防类似的问题？",
+    "INVALID_TOKEN 错误频繁出现怎么办",
+    "能再详细解释一下原因吗？",
+    "库存为负的告警需要怎么处理",
+]
+
+
+# ---------------------------------------------------------------- 服务器管理
+
+def serve_wsgi_threads(port: int, threads: int):
+    """固定线程池的 WSGI 服务器（由子进程调用）"""
+    from concurrent.futures import ThreadPoolExecutor
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'deepseek_project.settings')
+    from django.core.wsgi import get_wsgi_application
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class PooledWSGIServer(WSGIServer):
+        request_queue_size = 1024
+        pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = make_server('127.0.0.1', port, get_wsgi_application(),
+                         server_class=PooledWSGIServer, handler_class=QuietHandler)
+    server.serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _server_command(name: str, port: int, args) -> list:
+    manage = os.path.join(BACKEND_DIR, 'manage.py')
+    if name == 'runserver':
+        return [sys.executable, manage, 'runserver', f'127.0.0.1:{port}', '--noreload']
+    if name == 'wsgi-threads':
+        return [sys.executable, os.path.abspath(__file__), '--serve-wsgi',
+                '--port', str(port), '--server-threads', str(args.server_threads)]
+    if name == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'deepseek_project.asgi:application',
+                '--app-dir', BACKEND_DIR, '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(args.server_workers), '--no-access-log', '--log-level', 'warning']
+    raise ValueError(f"未知的服务器配置: {name}")
+
+
+def _server_env(workdir: str, args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'DJANGO_SETTINGS_MODULE': 'deepseek_project.settings',
+        'SQLITE_PATH': os.path.join(workdir, 'load.sqlite3'),
+        'VECTOR_STORE_PATH': os.path.join(workdir, 'vector_stores'),
+        'PYTHONUNBUFFERED': '1',
+    })
+    if not args.real_models:
+        env.setdefault('IDA_LLM_BACKEND', 'fake')
+        env.setdefault('IDA_EMBEDDING_BACKEND', 'hashing')
+        env.setdefault('IDA_FAKE_LLM_TOKENS_PER_SECOND', str(args.llm_tps))
+        env.setdefault('IDA_FAKE_LLM_PREFILL_MS', str(args.llm_prefill_ms))
+        env.setdefault('IDA_FAKE_LLM_MAX_TOKENS', str(args.llm_max_tokens))
+    return env
+
+
+def _prepare_workdir(workdir: str, env: dict):
+    """迁移临时数据库（索引也写入 workdir，见 VECTOR_STORE_PATH）"""
+    subprocess.run([sys.executable, os.path.join(BACKEND_DIR, 'manage.py'), 'migrate', '--verbosity', '0'],
+                   env=env, cwd=workdir, check=True)
+
+
+def _wait_ready(port: int, proc, timeout: float = 600.0, consecutive: int = 1):
+    """轮询就绪探针直到索引加载完成；多 worker 时要求连续多次就绪，尽量覆盖每个 worker"""
+    import requests
+
+    deadline = time.time() + timeout
+    ready_count = 0
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务器提前退出，返回码 {proc.returncode}")
+        try:
+            ready = requests.get(f'http://127.0.0.1:{port}/api/health/ready', timeout=5).status_code == 200
+        except requests.RequestException:
+            ready = False
+        ready_count = ready_count + 1 if ready else 0
+        if ready_count >= consecutive:
+            return
+        time.sleep(0.2 if ready else 0.5)
+    raise RuntimeError("等待服务器就绪超时")
+
+
+def _process_tree(pid: int) -> list:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _rss_bytes(pid: int) -> int:
+    """服务器主进程与全部子进程的 RSS 之和（读取 /proc）"""
+    total = 0
+    for child in _process_tree(pid):
+        try:
+            with open(f'/proc/{child}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.samples.append(_rss_bytes(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        self.join()
+        samples = self.samples or [0]
+        return {'rss_peak_mb': round(max(samples) / 2 ** 20, 1),
+                'rss_mean_mb': round(sum(samples) / len(samples) / 2 ** 20, 1)}
+
+
+# ---------------------------------------------------------------- 负载生成
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _classify(status: int, body: str) -> str:
+    if status == 200:
+        return 'ok'
+    if status == 429:
+        return 'rate_limited'
+    if 'database is locked' in body or 'database table is locked' in body:
+        return 'sqlite_locked'
+    if status >= 500:
+        return 'server_error'
+    return f'http_{status}'
+
+
+def _virtual_user(base_url: str, user_id: str, turns: int, timeout: float, record):
+    import requests
+
+    http = requests.Session()
+    try:
+        login = http.post(f'{base_url}/api/login', json={'username': user_id, 'password': 'secret'},
+                          timeout=timeout)
+        if login.status_code != 200:
+            record('login', None, _classify(login.status_code, login.text))
+            return
+        http.headers['Authorization'] = f"Bearer {login.json()['api_key']}"
+    except requests.RequestException:
+        record('login', None, 'client_timeout')
+        return
+
+    for turn in range(turns):
+        question = f"{QUESTIONS[turn % len(QUESTIONS)]}（{user_id}-{turn}）"
+        started = time.perf_counter()
+        try:
+            response = http.post(f'{base_url}/api/chat', timeout=timeout,
+                                 json={'session_id': f'{user_id}-session', 'user_input': question})
+            outcome = _classify(response.status_code, response.text)
+            detail = response.text if outcome != 'ok' else None
+        except requests.RequestException as e:
+            outcome, detail = 'client_timeout', str(e)
+        record('chat', (time.perf_counter() - started) * 1000, outcome, detail)
+
+
+def run_level(base_url: str, server_pid: int, concurrency: int, args) -> dict:
+    run_id = uuid.uuid4().hex[:6]
+    latencies, outcomes, error_samples = [], {}, {}
+    lock = threading.Lock()
+
+    def record(kind, latency_ms, outcome, detail=None):
+        with lock:
+            key = outcome if kind == 'chat' else f'login_{outcome}'
+            outcomes[key] = outcomes.get(key, 0) + 1
+            if kind == 'chat' and outcome == 'ok':
+                latencies.append(latency_ms)
+            elif detail and key not in error_samples:
+                # 每类错误保留一条响应摘要，便于定位（DEBUG 页面取异常标题）
+                match = re.search(r'<title>(.*?)</title>', detail, re.S)
+                error_samples[key] = (match.group(1) if match else detail)[:300].strip()
+
+    users = [threading.Thread(target=_virtual_user,
+                              args=(base_url, f'load-{concurrency}-{i}-{run_id}', args.turns, args.timeout, record))
+             for i in range(concurrency)]
+    sampler = RssSampler(server_pid)
+    sampler.start()
+    started = time.perf_counter()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - started
+
+    total = sum(v for k, v in outcomes.items() if not k.startswith('login_'))
+    failed = total - outcomes.get('ok', 0)
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'elapsed_seconds': round(elapsed, 2),
+        'throughput_rps': round(outcomes.get('ok', 0) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {f'p{q}': round(percentile(latencies, q), 1) for q in (50, 90, 95, 99)},
+        'error_rate': round(failed / total, 4) if total else 0.0,
+        'outcomes': outcomes,
+        'error_samples': error_samples,
+        **sampler.stop(),
+    }
+
+
+def bench_server(name: str, args) -> dict:
+    import requests
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = _server_env(workdir, args)
+        _prepare_workdir(workdir, env)
+        port = _free_port()
+        log = open(os.path.join(workdir, 'server.log'), 'w')
+        proc = subprocess.Popen(_server_command(name, port, args), env=env, cwd=workdir,
+                                stdout=log, stderr=subprocess.STDOUT)
+        try:
+            _wait_ready(port, proc, consecutive=args.server_workers * 2 if name == 'uvicorn' else 1)
+            base_url = f'http://127.0.0.1:{port}'
+            # 预热：先完成一轮对话（建立数据库连接、填充缓存），多 worker 时尽量覆盖每个 worker，不计入结果
+            warmups = [threading.Thread(target=_virtual_user,
+                                        args=(base_url, f'warmup-{i}-{uuid.uuid4().hex[:6]}', 1, args.timeout,
+                                              lambda *a: None))
+                       for i in range(args.server_workers if name == 'uvicorn' else 1)]
+            for warmup in warmups:
+                warmup.start()
+            for warmup in warmups:
+                warmup.join()
+            baseline_rss = round(_rss_bytes(proc.pid) / 2 ** 20, 1)
+
+            levels = []
+            for concurrency in args.concurrency:
+                level = run_level(base_url, proc.pid, concurrency, args)
+                levels.append(level)
+                print(f"  [{name}] 并发 {concurrency:>3}: {level['throughput_rps']} req/s, "
+                      f"p95 {level['latency_ms']['p95']} ms, 错误率 {level['error_rate']:.1%}", flush=True)
+                if args.stop_error_rate and level['error_rate'] >= args.stop_error_rate:
+                    print(f"  [{name}] 错误率超过 {args.stop_error_rate:.0%}，停止加压")
+                    break
+
+            try:
+                metrics = requests.get(f'{base_url}/api/metrics', timeout=5).text
+            except requests.RequestException:
+                metrics = ''
+            return {'server': name, 'rss_idle_mb': baseline_rss, 'levels': levels,
+                    'stage_metrics': [line for line in metrics.splitlines()
+                                      if line.startswith('ida_stage_duration_seconds_sum')]}
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+            log.close()
+
+
+def print_report(results: list):
+    print(f"\n{'server':<14}{'conc':>6}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+          f"{'err%':>8}{'locked':>8}{'429':>6}{'RSS MB':>9}")
+    for server in results:
+        for level in server['levels']:
+            outcomes = level['outcomes']
+            print(f"{server['server']:<14}{level['concurrency']:>6}{level['throughput_rps']:>9}"
+                  f"{level['latency_ms']['p50']:>9}{level['latency_ms']['p95']:>9}{level['latency_ms']['p99']:>9}"
+                  f"{level['error_rate'] * 100:>8.1f}{outcomes.get('sqlite_locked', 0):>8}"
+                  f"{outcomes.get('rate_limited', 0):>6}{level['rss_peak_mb']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', nargs='+', default=['runserver', 'wsgi-threads', 'uvicorn'],
+                        choices=['runserver', 'wsgi-threads', 'uvicorn'])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4, 8, 16, 32],
+                        help="依次测试的并发用户数")
+    parser.add_argument('--turns', type=int, default=5, help="每个用户的对话轮数")
+    parser.add_argument('--timeout', type=float, default=120.0, help="单个请求超时（秒）")
+    parser.add_argument('--stop-error-rate', type=float, default=0.5, help="错误率达到该值后停止加压，0 表示不停止")
+    parser.add_argument('--server-threads', type=int, default=16, help="wsgi-threads 的线程池大小")
+    parser.add_argument('--server-workers', type=int, default=4, help="uvicorn 的 worker 进程数")
+    parser.add_argument('--llm-tps', type=float, default=200.0, help="替身 LLM 每秒生成 token 数")
+    parser.add_argument('--llm-prefill-ms', type=float, default=100.0, help="替身 LLM 预填充延迟")
+    parser.add_argument('--llm-max-tokens', type=int, default=128, help="替身 LLM 回复 token 数")
+    parser.add_argument('--real-models', action='store_true', help="使用 Ollama 模型而非离线替身")
+    parser.add_argument('--output', help="结果 JSON 路径")
+    parser.add_argument('--serve-wsgi', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_wsgi:
+        serve_wsgi_threads(args.port, args.server_threads)
+        return
+
+    results = []
+    for name in args.servers:
+        print(f"压测 {name} ...", flush=True)
+        results.append(bench_server(name, args))
+    print_report(results)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'turns_per_user': args.turns,
+        'fake_llm': None if args.real_models else {
+            'tokens_per_second': args.llm_tps, 'prefill_ms': args.llm_prefill_ms, 'max_tokens': args.llm_max_tokens},
+        'results': results,
+    }
+    output = args.output or os.path.join(BACKEND_DIR, 'data', 'benchmarks', 'chat_load',
+                                         f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+导入耗时预算检查：基于 python -X importtime 校验关键模块的导入耗时，
+并确认 Django 接口和轻量分析模块不会在导入阶段加载向量库/大模型相关的重量级依赖
+
+每项检查在新的子进程中执行，超出预算或加载了禁止的模块时返回非零退出码，可直接用于 CI。
+
+用法（在 backend/django_backend 目录下）:
+    python benchmarks/import_budget.py
+    python benchmarks/import_budget.py --scale 2    # 在较慢的机器上放宽预算
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DJANGO_SETUP = ("import os, django; "
+                "os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'deepseek_project.settings'); "
+                "django.setup(); ")
+
+# 导入阶段不允许出现的重量级依赖（应在首次使用时再导入）
+HEAVY_MODULES = ('chromadb', 'llama_index', 'langchain', 'langchain_core', 'langchain_ollama',
+                 'langchain_community', 'pandas', 'numpy', 'onnxruntime', 'opentelemetry')
+
+# (名称, 预导入代码, 目标模块, 预算毫秒)；目标模块的累计导入耗时需在预算内
+IMPORT_BUDGETS = [
+    ('log_analysis', '', 'log_analysis', 150),
+    ('topklogsystem', '', 'topklogsystem', 200),
+    ('deepseek_api.api', DJANGO_SETUP, 'deepseek_api.api', 1000),
+]
+
+# (名称, 命令, 预算秒)；管理命令按整体墙钟耗时计
+COMMAND_BUDGETS = [
+    ('manage.py check', [sys.executable, 'manage.py', 'check'], 3.0),
+]
+
+
+def _env() -> dict:
+    # 不触发服务进程的后台索引加载，只计量导入本身
+    return dict(os.environ, INDEX_WARMUP='0')
+
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$')
+
+
+def parse_importtime(stderr: str) -> dict:
+    """解析 -X importtime 输出，返回 {模块名: 累计微秒}"""
+    modules = {}
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def check_import(name: str, setup: str, target: str, budget_ms: float) -> dict:
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'{setup}import {target}'],
+                          cwd=BACKEND_DIR, capture_output=True, text=True, env=_env())
+    if proc.returncode != 0:
+        return {'name': name, 'ok': False, 'detail': proc.stderr.strip().splitlines()[-1]}
+
+    modules = parse_importtime(proc.stderr)
+    elapsed_ms = modules.get(target, 0) / 1000
+    heavy = sorted({m.split('.')[0] for m in modules} & set(HEAVY_MODULES))
+    ok = elapsed_ms <= budget_ms and not heavy
+    detail = f"{elapsed_ms:.0f} ms / 预算 {budget_ms:.0f} ms"
+    if heavy:
+        detail += f"，加载了重量级依赖: {', '.join(heavy)}"
+    return {'name': name, 'ok': ok, 'detail': detail}
+
+
+def check_command(name: str, command: list, budget_s: float) -> dict:
+    started = time.perf_counter()
+    proc = subprocess.run(command, cwd=BACKEND_DIR, capture_output=True, text=True, env=_env())
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        return {'name': name, 'ok': False, 'detail': proc.stderr.strip().splitlines()[-1]}
+    return {'name': name, 'ok': elapsed <= budget_s, 'detail': f"{elapsed:.2f} s / 预算 {budget_s:.1f} s"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help="预算倍数")
+    args = parser.parse_args()
+
+    results = [check_import(name, setup, target, budget * args.scale)
+               for name, setup, target, budget in IMPORT_BUDGETS]
+    results += [check_command(name, command, budget * args.scale)
+                for name, command, budget in COMMAND_BUDGETS]
+
+    for r in results:
+        print(f"{'OK  ' if r['ok'] else 'FAIL'} {r['name']:<20} {r['detail']}")
+    sys.exit(0 if all(r['ok'] for r in results) else 1)
+
+
+if __name__ == '__main__':
+    main()
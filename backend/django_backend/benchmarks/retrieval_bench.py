@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+检索基准测试：在自带日志和按规模扩充的合成日志上评估 TopKLogSystem.retrieve_logs
+
+对每个数据规模构建索引（记录构建耗时和索引体积），然后重放固定的查询集
+（精确错误码、中文关键词、模糊语义问题三类），统计各检索策略的 p50/p95/p99 延迟
+以及基于标注相关行的 recall@k，结果保存为 JSON 便于多次运行之间对比。
+
+默认使用离线替身嵌入（IDA_EMBEDDING_BACKEND=hashing），加 --real-models 使用 Ollama。
+
+用法（在 backend/django_backend 目录下）:
+    python benchmarks/retrieval_bench.py --sizes base 10000
+    python benchmarks/retrieval_bench.py --sizes 100000 1000000 --repeat 3 --baseline old.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_CSV = os.path.join(BACKEND_DIR, 'data', 'log', '20200.csv')
+
+# 固定查询集：match 为字段精确匹配，match_text 为任意字段包含任一子串，用于标注相关行
+QUERIES = [
+    {'id': 'code-db-conn', 'category': 'error_code', 'query': 'DB_CONNECTION_LOST 错误是什么原因',
+     'match': {'错误': ['DB_CONNECTION_LOST']}},
+    {'id': 'code-token', 'category': 'error_code', 'query': 'INVALID_TOKEN 频繁出现怎么办',
+     'match': {'错误': ['INVALID_TOKEN']}},
+    {'id': 'code-stock-neg', 'category': 'error_code', 'query': 'STOCK_NEGATIVE 和 STOCK_NEG_SKU777 有什么关系',
+     'match': {'错误': ['STOCK_NEGATIVE', 'STOCK_NEG_SKU777']}},
+    {'id': 'code-metaspace', 'category': 'error_code', 'query': 'METASPACE_OOM 怎么处理',
+     'match': {'错误': ['METASPACE_OOM', 'JVM_METASPACE_OOM']}},
+    {'id': 'code-kafka-disk', 'category': 'error_code', 'query': 'KAFKA_DISK_FULL 导致消息写入失败',
+     'match': {'错误': ['KAFKA_DISK_FULL']}},
+    {'id': 'kw-conn-pool', 'category': 'keyword', 'query': '数据库连接池耗尽',
+     'match_text': ['连接池']},
+    {'id': 'kw-stock-neg', 'category': 'keyword', 'query': '库存为负',
+     'match_text': ['库存为负', '库存负值']},
+    {'id': 'kw-disk-temp', 'category': 'keyword', 'query': '磁盘温度过高',
+     'match_text': ['磁盘温度', '磁盘 65']},
+    {'id': 'kw-third-login', 'category': 'keyword', 'query': '第三方登录失败',
+     'match_text': ['第三方登录失败']},
+    {'id': 'kw-cert', 'category': 'keyword', 'query': '证书过期',
+     'match_text': ['证书过期', '后过期', '证书被']},
+    {'id': 'sem-login', 'category': 'semantic', 'query': '为什么用户总是登录不上？',
+     'match_text': ['登录失败', 'LOGIN_CAPTCHA_FAIL', 'INVALID_TOKEN']},
+    {'id': 'sem-storage', 'category': 'semantic', 'query': '服务器存储空间快满了会有什么影响',
+     'match_text': ['磁盘满', '磁盘 100%', '磁盘<10%', '磁盘写满', '磁盘只读']},
+    {'id': 'sem-payment', 'category': 'semantic', 'query': '付款一直没有响应是怎么回事',
+     'match_text': ['PaymentService', '支付超时']},
+    {'id': 'sem-memory', 'category': 'semantic', 'query': '内存好像不够用了',
+     'match_text': ['OOM']},
+    {'id': 'sem-security', 'category': 'semantic', 'query': '系统安全方面最近有没有风险',
+     'match_text': ['攻击', 'JWT', '吊销', '证书链']},
+]
+
+STRATEGIES = ('semantic', 'keyword', 'error_code', 'combined')
+
+
+def make_dataset(size, workdir: str, seed: int):
+    """生成指定规模的日志目录，返回 (目录, DataFrame)；base 表示原始日志"""
+    import pandas as pd
+
+    source = pd.read_csv(SOURCE_CSV)
+    if size == 'base':
+        return os.path.dirname(SOURCE_CSV), source
+
+    size = int(size)
+    log_dir = os.path.join(workdir, f'logs_{size}')
+    csv_path = os.path.join(log_dir, 'logs.csv')
+    if os.path.exists(csv_path):
+        return log_dir, pd.read_csv(csv_path)
+
+    # 整体复制原始日志，副本中的消息数字随机扰动（ID、数值），错误码与服务保持不变以便沿用标注
+    copies = -(-size // len(source))
+    frame = pd.concat([source] * copies, ignore_index=True).iloc[:size].copy()
+    rng = random.Random(seed)
+    copy_index = frame.index // len(source)
+    perturbed = frame['消息'].astype(str).str.replace(
+        r'\d{2,}', lambda m: str(rng.randrange(10 ** (len(m.group()) - 1), 10 ** len(m.group()))), regex=True)
+    frame['消息'] = perturbed.where(copy_index > 0, frame['消息'])
+
+    os.makedirs(log_dir, exist_ok=True)
+    frame.to_csv(csv_path, index=False)
+    return log_dir, frame
+
+
+def relevant_mask(frame, spec: dict):
+    """按查询标注计算 DataFrame 中的相关行"""
+    if 'match' in spec:
+        mask = None
+        for field, values in spec['match'].items():
+            cond = frame[field].isin(values)
+            mask = cond if mask is None else mask | cond
+        return mask
+    text = frame.astype(str).agg(' '.join, axis=1)
+    pattern = '|'.join(re.escape(s) for s in spec['match_text'])
+    return text.str.contains(pattern, regex=True)
+
+
+def is_relevant(content: str, spec: dict) -> bool:
+    """判断检索结果是否相关（文档文本为 Pandas(服务='…', 错误='…', …) 形式）"""
+    if 'match' in spec:
+        return any(f"{field}='{value}'" in content
+                   for field, values in spec['match'].items() for value in values)
+    return any(s in content for s in spec['match_text'])
+
+
+def percentile(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def bench_size(size, args) -> dict:
+    from topklogsystem import TopKLogSystem
+
+    log_dir, frame = make_dataset(size, args.workdir, args.seed)
+    store_dir = os.path.join(args.workdir, f'vector_store_{size}')
+    if args.rebuild and os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+
+    started = time.perf_counter()
+    system = TopKLogSystem(log_path=log_dir, llm=args.llm, embedding_model=args.embedding_model,
+                           vector_store_path=store_dir)
+    build_seconds = time.perf_counter() - started
+
+    runners = {
+        'semantic': system._semantic_retrieval,
+        'keyword': system._keyword_retrieval,
+        'error_code': system._error_code_retrieval,
+        'combined': system.retrieve_logs,
+    }
+    latencies = {name: [] for name in STRATEGIES}
+    per_query = []
+    for spec in QUERIES:
+        total_relevant = int(relevant_mask(frame, spec).sum())
+        expected = min(args.top_k, total_relevant)
+        entry = {'id': spec['id'], 'category': spec['category'], 'relevant_rows': total_relevant, 'recall': {}}
+        for name, runner in runners.items():
+            results = []
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                results = runner(spec['query'], args.top_k)
+                latencies[name].append((time.perf_counter() - t0) * 1000)
+            # 模板化索引中一条结果代表 occurrences 条原始日志
+            hits = sum(r.get('occurrences', 1) for r in results[:args.top_k] if is_relevant(r['content'], spec))
+            entry['recall'][name] = round(min(hits, expected) / expected, 3) if expected else None
+        per_query.append(entry)
+
+    def _mean_recall(name, category=None):
+        values = [q['recall'][name] for q in per_query
+                  if q['recall'][name] is not None and category in (None, q['category'])]
+        return round(sum(values) / len(values), 3) if values else None
+
+    return {
+        'size': len(frame),
+        'label': str(size),
+        'documents': system.document_count(),
+        'build_seconds': round(build_seconds, 2),
+        'index_bytes': directory_size(store_dir),
+        'latency_ms': {
+            name: {f'p{q}': round(percentile(samples, q), 2) for q in (50, 95, 99)}
+            for name, samples in latencies.items()
+        },
+        f'recall_at_{args.top_k}': {
+            name: {
+                'all': _mean_recall(name),
+                **{c: _mean_recall(name, c) for c in ('error_code', 'keyword', 'semantic')},
+            }
+            for name in STRATEGIES
+        },
+        'queries': per_query,
+    }
+
+
+def print_report(results: list, top_k: int, baseline: dict = None):
+    baseline_by_label = {r['label']: r for r in (baseline or {}).get('results', [])}
+    print(f"{'size':>9} {'strategy':<11}{'p50':>9}{'p95':>9}{'p99':>9}{'recall@' + str(top_k):>11}{'Δp95':>9}")
+    for r in results:
+        print(f"{r['size']:>9} build {r['build_seconds']}s, index {r.get('documents', '-')} docs "
+              f"{r['index_bytes'] / 1e6:.1f} MB")
+        old = baseline_by_label.get(r['label'])
+        for name in STRATEGIES:
+            lat = r['latency_ms'][name]
+            recall = r[f'recall_at_{top_k}'][name]['all']
+            delta = ''
+            if old and name in old['latency_ms']:
+                delta = f"{lat['p95'] - old['latency_ms'][name]['p95']:+.1f}"
+            print(f"{'':>9} {name:<11}{lat['p50']:>9}{lat['p95']:>9}{lat['p99']:>9}"
+                  f"{'-' if recall is None else recall:>11}{delta:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', default=['base', '10000'],
+                        help="数据规模，base 为自带日志，其余为合成行数（如 10000 100000 1000000）")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5, help="每条查询重复次数")
+    parser.add_argument('--workdir', default=os.path.join(BACKEND_DIR, 'data', 'benchmarks', 'retrieval'),
+                        help="合成数据和索引的存放目录（已存在的索引会直接复用）")
+    parser.add_argument('--rebuild', action='store_true', help="删除已有索引，重新计量构建耗时")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--llm', default='deepseek-r1:7b')
+    parser.add_argument('--embedding-model', default='bge-large:latest')
+    parser.add_argument('--real-models', action='store_true', help="使用 Ollama 模型而非离线替身")
+    parser.add_argument('--output', help="结果 JSON 路径，默认写入 workdir/results-<时间>.json")
+    parser.add_argument('--baseline', help="与之前保存的结果 JSON 对比 p95")
+    args = parser.parse_args()
+
+    if not args.real_models:
+        os.environ.setdefault('IDA_EMBEDDING_BACKEND', 'hashing')
+        os.environ.setdefault('IDA_LLM_BACKEND', 'fake')
+    sys.path.insert(0, BACKEND_DIR)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    results = [bench_size(size, args) for size in args.sizes]
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'embedding_backend': os.environ.get('IDA_EMBEDDING_BACKEND', 'ollama'),
+        'embedding_model': args.embedding_model,
+        'top_k': args.top_k,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(results, args.top_k, baseline)
+
+    output = args.output or os.path.join(args.workdir, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+SQLite 并发写入压测：对比 default 与 production 两种 SQLITE_PROFILE 的写吞吐
+
+模拟多个请求线程并发执行「登录建 Key + 多轮对话写会话」，统计吞吐量和
+database is locked 错误数。每种配置在独立子进程和临时数据库中运行。
+
+用法（在 backend/django_backend 目录下）:
+    python benchmarks/sqlite_write_load.py --threads 16 --turns 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_worker(threads: int, turns: int) -> dict:
+    """在当前进程内执行压测（由子进程调用，数据库与配置来自环境变量）"""
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'deepseek_project.settings')
+    os.environ.setdefault('INDEX_WARMUP', '0')  # 只压测数据库写入，不加载日志索引
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from django.db import OperationalError, connection
+    from deepseek_api.models import APIKey
+    from deepseek_api.services import create_api_key, get_or_create_session
+    from deepseek_api.write_queue import run_write
+
+    call_command('migrate', verbosity=0)
+
+    errors = {'locked': 0, 'other': 0}
+    writes = [0]
+    counter_lock = threading.Lock()
+    barrier = threading.Barrier(threads)
+
+    def _user_loop(index: int):
+        barrier.wait()
+        try:
+            for turn in range(turns):
+                try:
+                    if turn == 0:
+                        api_key = APIKey.objects.get(key=create_api_key(f"load-{index}"))
+                        session = get_or_create_session(f"session-{index}", api_key)
+                    session.update_context_with_compression(f"问题{turn}", "回复内容" * 50, save=False)
+                    run_write(session.save_turn)
+                    with counter_lock:
+                        writes[0] += 1
+                except OperationalError as e:
+                    with counter_lock:
+                        errors['locked' if 'locked' in str(e) else 'other'] += 1
+                except Exception:
+                    with counter_lock:
+                        errors['other'] += 1
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=_user_loop, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'profile': os.environ.get('SQLITE_PROFILE'),
+        'threads': threads,
+        'turns_per_thread': turns,
+        'successful_writes': writes[0],
+        'locked_errors': errors['locked'],
+        'other_errors': errors['other'],
+        'elapsed_seconds': round(elapsed, 3),
+        'writes_per_second': round(writes[0] / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16, help="并发写线程数")
+    parser.add_argument('--turns', type=int, default=50, help="每个线程写入的对话轮数")
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    parser.add_argument('--output', help="结果保存为 JSON 文件")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.threads, args.turns)))
+        return
+
+    results = []
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, SQLITE_PROFILE=profile, SQLITE_PATH=os.path.join(tmp, 'load.sqlite3'))
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker',
+                 '--threads', str(args.threads), '--turns', str(args.turns)],
+                env=env, cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+            )
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'profile':<12}{'writes/s':>10}{'ok':>8}{'locked':>8}{'other':>8}{'seconds':>10}")
+    for r in results:
+        print(f"{r['profile']:<12}{r['writes_per_second']:>10}{r['successful_writes']:>8}"
+              f"{r['locked_errors']:>8}{r['other_errors']:>8}{r['elapsed_seconds']:>10}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,28 @@
 from ninja import NinjaAPI, Router
 # from ninja.security import BaseAuth
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 from typing import Optional
-from . import services
+from . import services, session_memory
 from django.conf import settings
-from .schemas import LoginIn, LoginOut, ChatIn, ChatOut, HistoryOut, ErrorResponse
+from .schemas import LoginIn, LoginOut, ChatIn, ChatOut, HistoryOut, StatsOut, ErrorResponse
 from .models import APIKey
 from .services import get_or_create_session, deepseek_r1_api_call, get_cached_reply, set_cached_reply
+from .write_queue import run_write
+from .log_system import get_log_system, log_system_status
 from datetime import datetime
+from log_analysis import detect_conversation_type
+from llm_scheduler import QueueFull
+from reasoning import EmptyAnswer
+from metrics import observe_stage, render_metrics, CHAT_REQUESTS
+from tracing import current_span, traced
 import logging
 logger = logging.getLogger(__name__)
 
 api = NinjaAPI(title="DeepSeek-KAI API", version="0.0.1")
 
+# 索引加载期间的降级回答前缀
+DEGRADED_NOTICE = "> ⚠️ 日志索引仍在加载中，本次回答未参考日志检索结果，稍后重试可获得更准确的分析。\n\n"
+
 # class ApiKeyAuth(AuthBase):
     # def authenticate(self, request):
         # auth_header = request.headers.get("Authorization")
@@ -46,7 +56,8 @@ def api_key_auth(request):
             return None  # 认证方案错误
 
         # 验证API Key是否存在
-        api_key = APIKey.objects.get(key=key)
+        with observe_stage("auth"):
+            api_key = APIKey.objects.get(key=key)
         return api_key  # 认证成功，返回APIKey对象
     except (ValueError, APIKey.DoesNotExist):
         return None  # 解析失败或Key不存在，认证失败
@@ -71,8 +82,10 @@ def login(request, data: LoginIn):
     key = services.create_api_key(username)
     return {"api_key": key, "expiry": settings.TOKEN_EXPIRY_SECONDS}
 
-@router.post("/chat", response={200: ChatOut, 401: ErrorResponse})
-def chat(request, data: ChatIn):
+@router.post("/chat", response={200: ChatOut, 400: ErrorResponse, 401: ErrorResponse,
+                                429: ErrorResponse, 502: ErrorResponse, 503: ErrorResponse})
+@traced("api.chat")
+def chat(request, response: HttpResponse, data: ChatIn):
     # 1. 认证验证（确保用户已登录）
     if not request.auth:
         return 401, {"error": "请先登录获取API Key"}
@@ -97,16 +110,46 @@ def chat(request, data: ChatIn):
     
     # 5. 智能响应处理（带完整上下文）
     # 获取缓存时传入session_id和user
-    cached_reply = get_cached_reply(prompt, session_id, user)
+    with observe_stage("reply_cache"):
+        cached_reply = get_cached_reply(prompt, session_id, user)
+    current_span().set_attribute("reply_cache.hit", bool(cached_reply))
+    reasoning = ""
     if cached_reply:
         reply = cached_reply
+        CHAT_REQUESTS.inc(outcome="cache_hit")
     else:
-        # 智能调用大模型，传入上下文和对话类型
-        raw_reply = deepseek_r1_api_call(
-            prompt=user_input,  # 只传入当前用户输入
-            session_context=session.context,  # 传入历史上下文
-            conversation_type=session.conversation_type or "fault_analysis"  # 传入对话类型
-        )
+        # 共享的日志分析系统在后台加载，索引未就绪时按配置拒绝（503）或不带检索结果降级回答
+        log_system = get_log_system()
+        degraded = log_system is None or not log_system.index_ready
+        if degraded and (log_system is None or settings.INDEX_NOT_READY_MODE == "reject"):
+            CHAT_REQUESTS.inc(outcome="warming_up")
+            response["Retry-After"] = str(settings.INDEX_NOT_READY_RETRY_AFTER)
+            return 503, {"error": "日志索引正在加载，请稍后重试"}
+        current_span().set_attribute("degraded", degraded)
+
+        # prompt 中的对话历史：最近几轮 + 与当前问题最相关的早期轮次，长度不随会话增长
+        history = session_memory.build_history(session, user_input, log_system) if settings.SESSION_MEMORY else ""
+
+        # 智能调用大模型，传入上下文和对话类型；生成名额按用户公平排队，排队已满时返回 429
+        try:
+            raw_reply, reasoning = deepseek_r1_api_call(
+                prompt=user_input,  # 只传入当前用户输入
+                session_context=session.context,  # 传入历史上下文
+                conversation_type=session.conversation_type or "fault_analysis",  # 传入对话类型
+                system=log_system,
+                user=user.user,
+                session_key=str(session.pk),
+                history=history,
+            )
+        except QueueFull as e:
+            CHAT_REQUESTS.inc(outcome="queue_full")
+            response["Retry-After"] = str(e.retry_after)
+            return 429, {"error": "当前分析请求较多，请稍后重试"}
+        except EmptyAnswer as e:
+            # 推理过程被截断、没有回答：不缓存也不写入会话历史，由用户重试
+            logger.warning(f"大模型没有生成回答: {e}")
+            CHAT_REQUESTS.inc(outcome="empty_answer")
+            return 502, {"error": "模型未能生成完整回答（推理过程被截断），请重试或换个问法"}
         
         # 响应质量评估和优化
         from deepseek_api.services import assess_response_quality, optimize_response
@@ -123,37 +166,44 @@ def chat(request, data: ChatIn):
             logger.warning(f"响应完整性得分较低: {quality_metrics['completeness_score']}")
         if quality_metrics['relevance_score'] < 0.01:
             logger.warning(f"响应相关性得分较低: {quality_metrics['relevance_score']}")
-        # 设置缓存时传入session_id和user
-        set_cached_reply(prompt, reply, session_id, user)
+        if degraded:
+            # 降级回答不写入缓存，索引就绪后同样的问题会重新检索生成
+            reply = DEGRADED_NOTICE + reply
+            CHAT_REQUESTS.inc(outcome="degraded")
+        else:
+            # 设置缓存时传入session_id和user
+            set_cached_reply(prompt, reply, session_id, user)
+            CHAT_REQUESTS.inc(outcome="generated")
     
-    # 6. 智能上下文更新（带压缩）
-    # 使用带压缩的上下文更新方法
-    session.update_context_with_compression(user_input, reply)
+    # 6. 智能上下文更新（带压缩，仅修改内存，第8步统一持久化）；推理过程不进入上下文，按配置随轮次归档
+    # 本轮向量在写事务之外计算，供后续轮次检索相关历史
+    embedding = session_memory.embed_turn(get_log_system(), user_input, reply) if settings.SESSION_MEMORY else None
+    with observe_stage("compression"):
+        session.update_context_with_compression(
+            user_input, reply, save=False,
+            reasoning=reasoning if settings.REASONING_MODE == "store" else "",
+            embedding=embedding)
     
     # 7. 智能对话类型识别和更新
     try:
-        from topklogsystem import TopKLogSystem, ConversationType
-        
-        # 创建临时系统实例用于对话类型识别
-        temp_system = TopKLogSystem(
-            log_path="./data/log",
-            llm="deepseek-r1:7b",
-            embedding_model="bge-large:latest"
-        )
-        
-        # 识别对话类型
-        detected_type = temp_system.detect_conversation_type(user_input, session.context)
+        # 识别对话类型（纯规则判断，无需加载索引和模型）
+        with observe_stage("conversation_type"):
+            detected_type = detect_conversation_type(user_input, session.context)
         
+        current_span().set_attribute("conversation_type", detected_type.value)
         # 更新会话的对话类型
         if session.conversation_type != detected_type.value:
-            session.conversation_type = detected_type.value
-            session.save()
             logger.info(f"对话类型更新: {session.conversation_type} -> {detected_type.value}")
+            session.conversation_type = detected_type.value
         
     except Exception as e:
         logger.warning(f"对话类型识别失败: {e}")
         # 如果识别失败，保持现有类型
     
+    # 8. 单条 UPDATE 持久化本轮的上下文、摘要和对话类型（经写队列与其他请求合并提交）
+    with observe_stage("persistence"):
+        run_write(session.save_turn)
+    
     # session.update_context(user_input, reply)
 
     return {
@@ -162,15 +212,92 @@ def chat(request, data: ChatIn):
         "timestamp": datetime.now().strftime("%H:%M:%S")
     }
 
+@api.get("/metrics", include_in_schema=False)
+def metrics(request):
+    """Prometheus 指标接口，仅允许本机或配置的地址访问"""
+    if request.META.get("REMOTE_ADDR") not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponse(status=403)
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@api.get("/health/live", response={200: dict})
+def health_live(request):
+    """存活探针：进程能够处理请求即返回 200"""
+    return {"status": "ok"}
+
+
+@api.get("/health/ready", response={200: dict, 503: dict})
+def health_ready(request):
+    """就绪探针：索引加载完成前返回 503，响应中包含索引状态、日志条数和模型可用性"""
+    status = log_system_status()
+    return (200 if status["state"] == "ready" else 503), status
+
+
 # 1. 修复 history 接口
-@router.get("/history", response={200: HistoryOut})
-def history(request, session_id: str = "default_session"):
-    """查看对话历史接口：根据session_id返回对话历史"""
+@router.get("/history", response={200: HistoryOut, 304: None})
+def history(request, response: HttpResponse, session_id: str = "default_session",
+            cursor: Optional[int] = None, limit: int = 0):
+    """
+    查看对话历史接口：根据session_id返回对话历史
+    
+    - cursor/limit：按轮次从新到旧分页，limit=0 返回全部轮次
+    - 支持 If-None-Match，会话版本未变化时返回 304 且不带响应体
+    - 只读查询，不会创建会话
+    """
     # 直接使用 session_id 参数，无需通过 data
     processed_session_id = session_id.strip() or "default_session"
-    user_api_key = request.auth.key
-    session = services.get_or_create_session(processed_session_id, request.auth)
-    return {"history": session.context}
+    meta = services.get_session_version(processed_session_id, request.auth)
+    if meta is None:
+        return {"history": ""}
+    
+    etag = services.build_history_etag(meta['pk'], meta['version'], cursor, limit)
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    if etag in request.headers.get("If-None-Match", ""):
+        return 304, None
+    
+    session = services.get_session(processed_session_id, request.auth)
+    if session is None:
+        return {"history": ""}
+    # 两次查询之间会话可能被更新，以实际读取到的版本为准
+    response["ETag"] = services.build_history_etag(session.pk, session.version, cursor, limit)
+    # 历史轮次按 zstd 压缩归档，只解压本页需要的轮次
+    total_turns = session.turns.count()
+    start, end, next_cursor = services.paginate_turns(total_turns, cursor, limit)
+    page = [turn.text for turn in session.turns.order_by('seq')[start:end]] if end > start else []
+    return {
+        "history": "".join(page),
+        "turns": page,
+        "total_turns": total_turns,
+        "next_cursor": next_cursor,
+        "version": session.version,
+    }
+
+
+@router.get("/stats", response={200: StatsOut, 304: None, 404: ErrorResponse, 503: ErrorResponse})
+def stats(request, response: HttpResponse, top: int = 20):
+    """
+    日志库统计接口：各级别、服务、错误码、组件的出现次数（前 top 个）及 服务×错误码、服务×级别 共现次数
+
+    - 统计在构建索引时预先计算，按索引代缓存，请求时不扫描日志
+    - 支持 If-None-Match，索引代未变化时返回 304
+    """
+    log_system = get_log_system()
+    if log_system is None or not log_system.index_ready:
+        response["Retry-After"] = str(settings.INDEX_NOT_READY_RETRY_AFTER)
+        return 503, {"error": "日志索引正在加载，请稍后重试"}
+    top = max(1, min(top, 1000))
+
+    etag = services.build_stats_etag(log_system.index_generation, top)
+    response["ETag"] = etag
+    response["Cache-Control"] = f"private, max-age={settings.STATS_MAX_AGE}"
+    if etag in request.headers.get("If-None-Match", ""):
+        return 304, None
+
+    data = services.get_log_stats(log_system, top)
+    if data is None:
+        return 404, {"error": "当前索引没有统计数据，请重新构建索引（manage.py build_index --force）"}
+    return data
 
 
 # 2. 修复 clear_history 接口
@@ -182,6 +309,7 @@ def clear_history(request, session_id: str = "default_session"):
     user_api_key = request.auth.key
     session = services.get_or_create_session(processed_session_id, request.auth)
     session.clear_context()
+    services.clear_retrieval_state(str(session.pk))
     return {"message": "历史记录已清空"}
 
 # 将路由添加到API
@@ -1,5 +1,29 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
+
+def is_serving_process() -> bool:
+    """判断当前进程是否是实际处理请求的服务进程（排除迁移等管理命令和 runserver 的自动重载父进程）"""
+    if len(sys.argv) > 1 and sys.argv[0].endswith('manage.py'):
+        if sys.argv[1] != 'runserver':
+            return False
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    return True
+
+
 class DeepseekApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'deepseek_api'
+
+    def ready(self):
+        if not is_serving_process():
+            return
+        from .services import start_maintenance_scheduler
+        start_maintenance_scheduler()
+
+        from django.conf import settings
+        if settings.INDEX_WARMUP:
+            from .log_system import start_log_system
+            start_log_system()
@@ -0,0 +1,109 @@
+"""
+对话历史的 zstandard 压缩编解码
+
+历史轮次以 zstd 帧的形式存入 ConversationTurn.payload。大模型回复是重复度很高的
+Markdown，使用基于历史样本训练的字典可以显著提高单条记录的压缩率。字典文件按
+dict_id 保存在 HISTORY_ZSTD_DICT_DIR 下，ACTIVE 文件记录当前用于压缩的字典，
+旧字典保留用于解压历史数据。
+"""
+import os
+import threading
+from typing import Iterable, Optional, Tuple
+
+import zstandard as zstd
+from django.conf import settings
+
+_local = threading.local()  # ZstdCompressor/ZstdDecompressor 不是线程安全的，按线程缓存
+_dict_cache = {}
+_dict_lock = threading.Lock()
+
+
+def _dict_dir() -> str:
+    return str(settings.HISTORY_ZSTD_DICT_DIR)
+
+
+def _load_dictionary(dict_id: int) -> zstd.ZstdCompressionDict:
+    with _dict_lock:
+        if dict_id not in _dict_cache:
+            with open(os.path.join(_dict_dir(), f"{dict_id}.dict"), 'rb') as f:
+                _dict_cache[dict_id] = zstd.ZstdCompressionDict(f.read())
+        return _dict_cache[dict_id]
+
+
+def active_dict_id() -> int:
+    """当前用于压缩的字典 ID，0 表示不使用字典"""
+    try:
+        with open(os.path.join(_dict_dir(), 'ACTIVE'), encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _compressor(dict_id: int) -> zstd.ZstdCompressor:
+    cache = getattr(_local, 'compressors', None)
+    if cache is None:
+        cache = _local.compressors = {}
+    if dict_id not in cache:
+        level = settings.HISTORY_ZSTD_LEVEL
+        if dict_id:
+            cache[dict_id] = zstd.ZstdCompressor(level=level, dict_data=_load_dictionary(dict_id))
+        else:
+            cache[dict_id] = zstd.ZstdCompressor(level=level)
+    return cache[dict_id]
+
+
+def _decompressor(dict_id: int) -> zstd.ZstdDecompressor:
+    cache = getattr(_local, 'decompressors', None)
+    if cache is None:
+        cache = _local.decompressors = {}
+    if dict_id not in cache:
+        if dict_id:
+            cache[dict_id] = zstd.ZstdDecompressor(dict_data=_load_dictionary(dict_id))
+        else:
+            cache[dict_id] = zstd.ZstdDecompressor()
+    return cache[dict_id]
+
+
+def compress_text(text: str, dict_id: Optional[int] = None) -> Tuple[bytes, int]:
+    """
+    压缩文本，dict_id 为空时使用当前启用的字典
+
+    Returns:
+        tuple: (zstd 帧, 使用的字典 ID)
+    """
+    if dict_id is None:
+        dict_id = active_dict_id()
+    return _compressor(dict_id).compress(text.encode('utf-8')), dict_id
+
+
+def decompress_text(payload: bytes, dict_id: int = 0) -> str:
+    """解压 compress_text 生成的数据"""
+    return _decompressor(dict_id).decompress(bytes(payload)).decode('utf-8')
+
+
+def train_dictionary(samples: Iterable[str], dict_size: Optional[int] = None, activate: bool = True) -> int:
+    """
+    基于历史轮次样本训练 zstd 字典并保存
+
+    Args:
+        samples: 训练样本（每条为一轮对话的原文）
+        dict_size: 字典大小（字节）
+        activate: 是否设置为新的压缩字典
+
+    Returns:
+        int: 新字典的 dict_id
+    """
+    dict_size = dict_size or settings.HISTORY_ZSTD_DICT_SIZE
+    dictionary = zstd.train_dictionary(dict_size, [s.encode('utf-8') for s in samples])
+    dict_id = dictionary.dict_id()
+
+    os.makedirs(_dict_dir(), exist_ok=True)
+    with open(os.path.join(_dict_dir(), f"{dict_id}.dict"), 'wb') as f:
+        f.write(dictionary.as_bytes())
+    if activate:
+        # 先写临时文件再原子替换，避免其他进程读到半个 ACTIVE 文件
+        tmp_path = os.path.join(_dict_dir(), 'ACTIVE.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(str(dict_id))
+        os.replace(tmp_path, os.path.join(_dict_dir(), 'ACTIVE'))
+    return dict_id
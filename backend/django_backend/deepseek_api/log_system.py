@@ -0,0 +1,145 @@
+"""
+进程内共享的 TopKLogSystem
+
+服务进程启动时在后台线程中创建模型、加载（或构建）向量索引并预热大模型，
+请求线程通过 get_log_system() 获取实例而不会被索引构建阻塞。
+索引就绪前实例已可用于生成回答（retrieve_logs 返回空结果），由调用方决定降级还是拒绝。
+"""
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+STATE_IDLE = 'idle'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+MODEL_STATUS_TTL = 30  # 模型可用性检查结果的缓存时长（秒），避免探针频繁请求 Ollama
+
+
+class LogSystemHolder:
+    """持有共享实例及其加载状态"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = STATE_IDLE
+        self.system = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self._model_status = None
+        self._model_status_at = 0.0
+
+    def start(self) -> bool:
+        """开始后台加载，已在加载或已就绪时不重复启动；失败后需间隔 INDEX_RETRY_SECONDS 才会重试"""
+        with self._lock:
+            if self.state in (STATE_LOADING, STATE_READY):
+                return False
+            if self.state == STATE_FAILED and time.time() - self.started_at < settings.INDEX_RETRY_SECONDS:
+                return False
+            self.state = STATE_LOADING
+            self.error = None
+            self.started_at = time.time()
+            self.ready_at = None
+        threading.Thread(target=self._warm_up, name='log-system-warmup', daemon=True).start()
+        return True
+
+    def _warm_up(self) -> None:
+        from topklogsystem import TopKLogSystem
+
+        try:
+            with observe_stage("warmup.models"):
+                system = self.system or TopKLogSystem(
+                    log_path=settings.LOG_DATA_PATH,
+                    llm=settings.LLM_MODEL,
+                    embedding_model=settings.EMBEDDING_MODEL,
+                    vector_store_path=settings.VECTOR_STORE_PATH,
+                    build_index=False,
+                    fast_llm=settings.LLM_FAST_MODEL,
+                )
+            # 模型已可用，索引加载期间即可提供不带检索的降级回答
+            self.system = system
+
+            with observe_stage("warmup.index"):
+                system.load_index()
+            if not system.index_ready:
+                # 日志目录为空或不存在时没有可发布的索引，保持未就绪，间隔 INDEX_RETRY_SECONDS 后重试
+                self.error = f"{settings.LOG_DATA_PATH} 中没有可用的日志，未能构建索引"
+                logger.error(self.error)
+                self.state = STATE_FAILED
+                return
+            logger.info(f"日志索引已就绪，共 {system.document_count()} 条记录，"
+                        f"耗时 {time.time() - self.started_at:.1f} 秒")
+
+            if settings.LLM_WARMUP:
+                try:
+                    with observe_stage("warmup.llm"):
+                        system.warm_up_llm()
+                except Exception as e:
+                    logger.warning(f"大模型预热失败: {e}")
+
+            self.ready_at = time.time()
+            self.state = STATE_READY
+        except Exception as e:
+            logger.exception("日志分析系统加载失败")
+            self.error = str(e)
+            self.state = STATE_FAILED
+
+    def get(self):
+        """获取共享实例，尚未开始加载（或失败后可重试）时触发后台加载；模型未创建完成时返回 None"""
+        if self.state in (STATE_IDLE, STATE_FAILED):
+            self.start()
+        return self.system
+
+    def model_status(self) -> Dict[str, Any]:
+        from offline_models import check_model_availability
+
+        now = time.time()
+        if self._model_status is None or now - self._model_status_at > MODEL_STATUS_TTL:
+            self._model_status = check_model_availability(settings.LLM_MODEL, settings.EMBEDDING_MODEL)
+            self._model_status_at = now
+        return self._model_status
+
+    def status(self) -> Dict[str, Any]:
+        system = self.system
+        elapsed = None
+        if self.started_at:
+            elapsed = round((self.ready_at or time.time()) - self.started_at, 2)
+        return {
+            'state': self.state,
+            'index_ready': bool(system and system.index_ready),
+            'documents': system.document_count() if system and system.index_ready else 0,
+            'generation': system.index_generation if system else None,
+            'models': self.model_status(),
+            'load_seconds': elapsed,
+            'error': self.error,
+        }
+
+
+_holder = LogSystemHolder()
+
+
+def start_log_system() -> bool:
+    """服务进程启动时调用，在后台加载共享实例"""
+    return _holder.start()
+
+
+def get_log_system():
+    """获取共享的 TopKLogSystem，模型尚未创建完成时返回 None"""
+    return _holder.get()
+
+
+def log_system_status() -> Dict[str, Any]:
+    """就绪探针使用的状态信息"""
+    return _holder.status()
+
+
+def is_log_system_ready() -> bool:
+    return _holder.state == STATE_READY
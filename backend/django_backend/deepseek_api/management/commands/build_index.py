@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from topklogsystem import TopKLogSystem
+
+
+class Command(BaseCommand):
+    help = "加载或构建日志向量索引（与服务进程共用构建锁，同一时刻只有一个进程构建）"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help="即使已有索引也构建新一代并发布，服务进程重启后使用新索引")
+
+    def handle(self, *args, **options):
+        system = TopKLogSystem(
+            log_path=settings.LOG_DATA_PATH,
+            llm=settings.LLM_MODEL,
+            embedding_model=settings.EMBEDDING_MODEL,
+            vector_store_path=settings.VECTOR_STORE_PATH,
+            build_index=False,
+        )
+        if options['force']:
+            system.rebuild_index()
+        else:
+            system.load_index()
+
+        if not system.index_ready:
+            raise CommandError(f"没有可用的日志数据: {settings.LOG_DATA_PATH}")
+        self.stdout.write(self.style.SUCCESS(
+            f"索引 {system.index_generation} 可用，共 {system.document_count()} 条记录"))
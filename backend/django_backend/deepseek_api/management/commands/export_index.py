@@ -0,0 +1,75 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from index_store import IndexStore, SnapshotError, export_snapshot, file_sha256
+from offline_models import embedding_model_id
+from topklogsystem import TopKLogSystem
+
+
+class Command(BaseCommand):
+    help = "把已发布的日志向量索引导出为单个快照文件，供其他环境用 import_index 直接导入而无需重新嵌入"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="快照文件路径，以 .tar.gz 结尾时压缩；默认写到 VECTOR_STORE_PATH 同级的 snapshots 目录")
+        parser.add_argument('--generation', help="导出指定的代（如 gen-000003），默认导出当前发布的代")
+
+    def handle(self, *args, **options):
+        system = TopKLogSystem(
+            log_path=settings.LOG_DATA_PATH,
+            llm=settings.LLM_MODEL,
+            embedding_model=settings.EMBEDDING_MODEL,
+            vector_store_path=settings.VECTOR_STORE_PATH,
+            build_index=False,
+        )
+        store = IndexStore(settings.VECTOR_STORE_PATH)
+        generation = options['generation'] or store.current_generation()
+        if not generation or not os.path.isdir(store.path_of(generation)):
+            raise CommandError("没有可导出的已发布索引，请先执行 build_index")
+
+        # 读取条数和向量维度写入 manifest，导入方据此核对（get_collection 不会改动已发布的目录）
+        import chromadb
+        client = chromadb.PersistentClient(path=store.path_of(generation))
+        try:
+            collection = client.get_collection(system._collection_name())
+        except Exception:
+            raise CommandError(f"索引 {generation} 中没有当前嵌入模型的数据")
+        documents = collection.count()
+        sample = collection.get(limit=1, include=['embeddings'])
+        dimension = len(sample['embeddings'][0]) if len(sample['embeddings']) else None
+
+        output = options['output']
+        if not output:
+            snapshot_dir = os.path.join(os.path.dirname(os.path.abspath(settings.VECTOR_STORE_PATH)), 'snapshots')
+            os.makedirs(snapshot_dir, exist_ok=True)
+            stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+            output = os.path.join(snapshot_dir, f"index-{generation}-{stamp}.tar.gz")
+
+        extra = {
+            'collection': system._collection_name(),
+            'embedding_model': settings.EMBEDDING_MODEL,
+            'embedding_model_id': embedding_model_id(system.embedding_model),
+            'embedding_dimension': dimension,
+            'documents': documents,
+            'source_files': _source_files(settings.LOG_DATA_PATH),
+        }
+        try:
+            manifest = export_snapshot(store, output, extra, generation=generation)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+        size_mb = os.path.getsize(output) / 1024 / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f"已导出索引 {manifest['generation']}（{documents} 条记录，{len(manifest['files'])} 个文件，"
+            f"{size_mb:.1f} MB）: {output}"))
+
+
+def _source_files(data_path: str) -> dict:
+    """构建索引所用日志文件的校验和，导入方可据此判断快照与本地日志是否一致"""
+    if not os.path.isdir(data_path):
+        return {}
+    return {name: file_sha256(os.path.join(data_path, name))
+            for name in sorted(os.listdir(data_path))
+            if os.path.isfile(os.path.join(data_path, name))}
@@ -0,0 +1,68 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from index_store import IndexStore, SnapshotError, file_sha256, import_snapshot, read_manifest
+from offline_models import embedding_model_id
+from topklogsystem import TopKLogSystem
+
+
+class Command(BaseCommand):
+    help = "导入 export_index 生成的索引快照：校验文件和嵌入模型后作为新的一代发布，服务进程重启后使用"
+
+    def add_arguments(self, parser):
+        parser.add_argument('snapshot', help="快照文件路径")
+        parser.add_argument('--allow-model-mismatch', action='store_true',
+                            help="快照的嵌入模型与当前配置不一致时仍然导入（检索结果将不可用，仅用于排查）")
+
+    def handle(self, *args, **options):
+        path = options['snapshot']
+        if not os.path.isfile(path):
+            raise CommandError(f"快照文件不存在: {path}")
+        try:
+            manifest = read_manifest(path)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+        system = TopKLogSystem(
+            log_path=settings.LOG_DATA_PATH,
+            llm=settings.LLM_MODEL,
+            embedding_model=settings.EMBEDDING_MODEL,
+            vector_store_path=settings.VECTOR_STORE_PATH,
+            build_index=False,
+        )
+        # 查询向量与索引向量必须来自同一嵌入模型，否则检索结果没有意义
+        model_id = embedding_model_id(system.embedding_model)
+        if manifest.get('embedding_model_id') != model_id or manifest.get('collection') != system._collection_name():
+            message = (f"快照的嵌入模型 {manifest.get('embedding_model_id')} 与当前配置 {model_id} 不一致")
+            if not options['allow_model_mismatch']:
+                raise CommandError(message)
+            self.stderr.write(self.style.WARNING(message))
+
+        stale = [name for name, digest in manifest.get('source_files', {}).items()
+                 if os.path.isfile(os.path.join(settings.LOG_DATA_PATH, name))
+                 and file_sha256(os.path.join(settings.LOG_DATA_PATH, name)) != digest]
+        if stale:
+            self.stderr.write(self.style.WARNING(f"本地日志文件与快照构建时不一致: {', '.join(stale)}"))
+
+        def verify(generation_path, manifest):
+            import chromadb
+            try:
+                collection = chromadb.PersistentClient(path=generation_path).get_collection(manifest.get('collection'))
+            except Exception as e:
+                raise SnapshotError(f"无法打开快照中的索引: {e}")
+            count = collection.count()
+            if count != manifest.get('documents'):
+                raise SnapshotError(f"导入后的记录数 {count} 与快照记录数 {manifest.get('documents')} 不一致")
+
+        started = time.time()
+        store = IndexStore(settings.VECTOR_STORE_PATH)
+        try:
+            generation, manifest = import_snapshot(store, path, verify=verify)
+        except SnapshotError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"已导入快照（源索引 {manifest['generation']}，{manifest['documents']} 条记录）"
+            f"并发布为 {generation}，耗时 {time.time() - started:.1f} 秒"))
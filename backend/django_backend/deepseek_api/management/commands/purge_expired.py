@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from deepseek_api.services import purge_expired_data
+
+
+class Command(BaseCommand):
+    help = "分批清理过期的 API Key、速率限制记录和陈旧会话，可选执行 VACUUM/ANALYZE"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.MAINTENANCE_BATCH_SIZE,
+                            help="每个事务最多删除的行数")
+        parser.add_argument('--retention-seconds', type=int, default=settings.SESSION_RETENTION_SECONDS,
+                            help="会话保留时长（秒），0 表示不清理未过期 Key 下的会话")
+        parser.add_argument('--vacuum', action='store_true', default=settings.MAINTENANCE_VACUUM,
+                            help="清理后执行 VACUUM 回收磁盘空间")
+        parser.add_argument('--no-analyze', dest='analyze', action='store_false',
+                            default=settings.MAINTENANCE_ANALYZE, help="清理后不执行 ANALYZE")
+
+    def handle(self, *args, **options):
+        report = purge_expired_data(
+            batch_size=options['batch_size'],
+            retention_seconds=options['retention_seconds'],
+            vacuum=options['vacuum'],
+            analyze=options['analyze'],
+        )
+        for label, count in sorted(report['reclaimed'].items()):
+            self.stdout.write(f"{label}: {count}")
+        self.stdout.write(self.style.SUCCESS(
+            f"共回收 {report['total']} 行，耗时 {report['elapsed_seconds']}s"
+        ))
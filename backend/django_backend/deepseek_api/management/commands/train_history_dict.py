@@ -0,0 +1,35 @@
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from deepseek_api.history_codec import compress_text, train_dictionary
+from deepseek_api.models import ConversationTurn
+
+
+class Command(BaseCommand):
+    help = "基于已归档的对话轮次训练 zstd 字典，并设置为新写入历史的压缩字典"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=5000, help="最多使用的样本轮次数（取最新的轮次）")
+        parser.add_argument('--dict-size', type=int, default=None, help="字典大小（字节）")
+        parser.add_argument('--no-activate', dest='activate', action='store_false',
+                            help="只训练保存，不切换当前压缩字典")
+
+    def handle(self, *args, **options):
+        turns = ConversationTurn.objects.order_by('-id')[:options['samples']]
+        samples = [turn.text for turn in turns.iterator()]
+        if len(samples) < 10:
+            raise CommandError(f"样本不足（{len(samples)} 轮），至少需要 10 轮归档对话")
+
+        try:
+            dict_id = train_dictionary(samples, options['dict_size'], activate=options['activate'])
+        except Exception as e:
+            raise CommandError(f"字典训练失败: {e}")
+
+        # 抽样估算压缩效果
+        probe = random.sample(samples, min(200, len(samples)))
+        raw = sum(len(s.encode('utf-8')) for s in probe)
+        compressed = sum(len(compress_text(s)[0]) for s in probe) if options['activate'] else 0
+        self.stdout.write(self.style.SUCCESS(f"字典 {dict_id} 训练完成，样本 {len(samples)} 轮"))
+        if compressed:
+            self.stdout.write(f"抽样压缩率: {raw} -> {compressed} 字节 ({compressed / raw:.1%})")
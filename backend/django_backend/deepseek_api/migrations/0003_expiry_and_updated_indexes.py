@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepseek_api', '0002_conversationsession_context_summary_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apikey',
+            name='expiry_time',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='conversationsession',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
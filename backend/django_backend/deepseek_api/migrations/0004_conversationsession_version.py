@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepseek_api', '0003_expiry_and_updated_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsession',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='会话版本号，每次历史变更递增，用于 ETag'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def archive_existing_turns(apps, schema_editor):
+    """把已有会话上下文中的轮次压缩归档，旧会话的历史分页与新会话一致"""
+    import zstandard as zstd
+    ConversationSession = apps.get_model('deepseek_api', 'ConversationSession')
+    ConversationTurn = apps.get_model('deepseek_api', 'ConversationTurn')
+    compressor = zstd.ZstdCompressor(level=6)
+    for session in ConversationSession.objects.exclude(context='').iterator():
+        texts = [f"用户：{part}" for part in session.context.split('用户：')[1:]]
+        ConversationTurn.objects.bulk_create([
+            ConversationTurn(session=session, seq=seq, payload=compressor.compress(text.encode('utf-8')),
+                             dict_id=0, raw_length=len(text))
+            for seq, text in enumerate(texts, 1)
+        ])
+        if session.version < len(texts):
+            session.version = len(texts)
+            session.save(update_fields=['version'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepseek_api', '0004_conversationsession_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationTurn',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(help_text='轮次序号（取写入时的会话版本号），单调递增')),
+                ('payload', models.BinaryField(help_text='zstd 压缩后的本轮原文')),
+                ('dict_id', models.PositiveIntegerField(default=0, help_text='压缩使用的 zstd 字典 ID，0 表示无字典')),
+                ('raw_length', models.PositiveIntegerField(default=0, help_text='压缩前的字符数')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turns', to='deepseek_api.conversationsession')),
+            ],
+            options={
+                'ordering': ['seq'],
+                'unique_together': {('session', 'seq')},
+            },
+        ),
+        migrations.RunPython(archive_existing_turns, migrations.RunPython.noop),
+    ]
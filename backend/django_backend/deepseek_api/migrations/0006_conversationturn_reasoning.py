@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepseek_api', '0005_conversationturn'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationturn',
+            name='reasoning_payload',
+            field=models.BinaryField(blank=True, help_text='zstd 压缩后的模型推理过程（REASONING_MODE=store 时保存）', null=True),
+        ),
+    ]
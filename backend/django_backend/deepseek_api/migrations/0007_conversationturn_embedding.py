@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 23:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepseek_api', '0006_conversationturn_reasoning'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationturn',
+            name='embedding',
+            field=models.BinaryField(blank=True, help_text='本轮原文的向量（float32），用于检索相关的早期轮次', null=True),
+        ),
+        migrations.AddField(
+            model_name='conversationturn',
+            name='embedding_model',
+            field=models.CharField(blank=True, help_text='生成 embedding 的嵌入模型标识', max_length=100),
+        ),
+    ]
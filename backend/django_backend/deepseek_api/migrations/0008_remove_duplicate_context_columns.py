@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 00:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deepseek_api', '0007_conversationturn_embedding'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='conversationsession',
+            name='context_summary',
+        ),
+        migrations.RemoveField(
+            model_name='conversationsession',
+            name='recent_context',
+        ),
+    ]
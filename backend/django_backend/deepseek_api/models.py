@@ -1,18 +1,22 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import F
 import string
 import random
 import time
 import logging
+from typing import Optional, Tuple
 logger = logging.getLogger(__name__)
 
 from django.db.models import indexes
 
+# 压缩后的上下文中分隔摘要和最近几轮对话的标记行，写入上下文的用户输入和回复中出现的同样文本会被去掉
+SUMMARY_END = "<<<context-summary-end>>>"
+
 class APIKey(models.Model):
     key = models.CharField(max_length=32, unique=True)
     user = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
-    expiry_time = models.IntegerField()  # 过期时间戳
+    expiry_time = models.IntegerField(db_index=True)  # 过期时间戳，建索引便于清理过期记录
     
     @classmethod
     def generate_key(cls, length=32):
@@ -59,9 +63,6 @@ class ConversationSession(models.Model):
         related_name='sessions'
     )
     context = models.TextField(blank=True)
-    # 新增字段：多轮对话功能支持
-    context_summary = models.TextField(blank=True, help_text="上下文摘要，用于压缩历史对话")
-    recent_context = models.TextField(blank=True, help_text="最近N轮对话，保持完整格式")
     max_context_length = models.IntegerField(default=4000, help_text="最大上下文长度限制")
     conversation_type = models.CharField(
         max_length=50, 
@@ -76,15 +77,38 @@ class ConversationSession(models.Model):
         ],
         help_text="当前对话类型"
     )
+    version = models.PositiveIntegerField(default=0, help_text="会话版本号，每次历史变更递增，用于 ETag")
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    # 每轮对话会修改的字段，统一由 save_turn 一次性写回（version 在数据库中单独递增）
+    TURN_UPDATE_FIELDS = ['context', 'conversation_type', 'updated_at']
     
     class Meta:
         unique_together = ('session_id', 'user')  # 确保用户+会话ID唯一
     
+    # 压缩后的 context 为「摘要 + SUMMARY_END 标记行 + 最近几轮」，摘要和最近几轮不再单独存列，按标记行拆出
+    # （每轮原文已压缩归档在 ConversationTurn 中）
+    @property
+    def context_summary(self) -> str:
+        """上下文开头的历史摘要，未压缩过（或二次压缩丢弃了摘要）时为空字符串"""
+        head, separator, _ = self.context.partition(f"\n{SUMMARY_END}\n")
+        return head if separator else ''
+    
+    @property
+    def recent_context(self) -> str:
+        """摘要之后的最近几轮对话，没有摘要时为空字符串"""
+        _, separator, tail = self.context.partition(f"\n{SUMMARY_END}\n")
+        return tail if separator else ''
+    
+    @staticmethod
+    def _context_entry(user_input: str, bot_reply: str) -> str:
+        """写入上下文的一轮对话，去掉其中的摘要标记"""
+        return f"用户：{user_input}\n回复：{bot_reply}\n".replace(SUMMARY_END, '')
+    
     def update_context(self, user_input, bot_reply):
         """原子更新上下文，避免并发覆盖"""
-        new_entry = f"用户：{user_input}\n回复：{bot_reply}\n"
+        new_entry = self._context_entry(user_input, bot_reply)
         # 数据库层面拼接，而非内存中
         ConversationSession.objects.filter(
             pk=self.pk,  # 精确匹配当前会话
@@ -98,11 +122,12 @@ class ConversationSession(models.Model):
         # logger.info(f"更新会话 {self.session_id}（用户：{self.user.key}）：{new_entry}")
     
     def clear_context(self):
-        """清空对话上下文"""
+        """清空对话上下文及归档的历史轮次"""
         self.context = ""
-        self.context_summary = ""
-        self.recent_context = ""
-        self.save()
+        self.version += 1
+        with transaction.atomic():
+            self.turns.all().delete()
+            self.save()
     
     def compress_context_if_needed(self, max_length: int = None):
         """检查并压缩上下文（如果需要）"""
@@ -116,7 +141,7 @@ class ConversationSession(models.Model):
         self._compress_context()
         return True
     
-    def _compress_context(self):
+    def _compress_context(self, save: bool = True):
         """智能压缩上下文，保留最近对话并生成摘要"""
         import re
         
@@ -136,21 +161,22 @@ class ConversationSession(models.Model):
         
         # 保留最近对话
         recent_conversations = conversations[-keep_rounds:]
-        self.recent_context = '用户：'.join(recent_conversations)
+        recent_context = '用户：'.join(recent_conversations)
         
         # 压缩早期对话为摘要
         early_conversations = conversations[:-keep_rounds]
-        self.context_summary = self._generate_context_summary(early_conversations)
+        context_summary = self._generate_context_summary(early_conversations)
         
         # 更新完整上下文
-        compressed_context = f"{self.context_summary}\n\n{self.recent_context}"
+        compressed_context = f"{context_summary}\n{SUMMARY_END}\n{recent_context}"
         
         # 如果压缩后仍然太长，进行二次压缩
         if len(compressed_context) > self.max_context_length:
             compressed_context = self._secondary_compress(compressed_context)
         
         self.context = compressed_context
-        self.save()
+        if save:
+            self.save()
     
     def _generate_context_summary(self, conversations):
         """智能生成上下文摘要"""
@@ -374,14 +400,14 @@ class ConversationSession(models.Model):
         conversations = self.context.split('用户：')
         if len(conversations) > 1:
             recent_conversation = conversations[-1]
-            self.recent_context = f"用户：{recent_conversation}"
+            recent_context = f"用户：{recent_conversation}"
             
             # 生成高度压缩的摘要
             early_conversations = conversations[:-1]
-            self.context_summary = self._generate_compact_summary(early_conversations)
+            context_summary = self._generate_compact_summary(early_conversations)
             
             # 更新上下文
-            self.context = f"{self.context_summary}\n\n{self.recent_context}"
+            self.context = f"{context_summary}\n{SUMMARY_END}\n{recent_context}"
             
             # 如果还是太长，进行二次压缩
             if len(self.context) > target_length:
@@ -461,18 +487,54 @@ class ConversationSession(models.Model):
         
         return '\n'.join(summary_parts)
     
-    def update_context_with_compression(self, user_input: str, bot_reply: str):
-        """带压缩的上下文更新"""
-        new_entry = f"用户：{user_input}\n回复：{bot_reply}\n"
-        new_context = self.context + new_entry
+    def update_context_with_compression(self, user_input: str, bot_reply: str, save: bool = True,
+                                        reasoning: str = "", embedding: Optional[Tuple[bytes, str]] = None):
+        """
+        带压缩的上下文更新，save=False 时只修改内存，由调用方统一持久化
+        reasoning 为模型的推理过程，embedding 为本轮的 (向量, 嵌入模型标识)，只随本轮归档，不进入上下文
+        """
+        from reasoning import strip_reasoning
+        bot_reply = strip_reasoning(bot_reply)  # 旧版本缓存的回答可能仍带有 <think> 块
+        new_entry = self._context_entry(user_input, bot_reply)
+        self._base_context = self.context  # save_turn 据此判断期间是否有其他请求写入了新的轮次
+        self._pending_turn = new_entry  # 由 save_turn 压缩归档
+        self._pending_reasoning = reasoning
+        self._pending_embedding = embedding
+        self.context = self.context + new_entry
         
         # 检查是否需要压缩
-        if len(new_context) > self.max_context_length:
-            self.context = new_context
-            self._compress_context()
-        else:
-            self.context = new_context
-            self.save()
+        if len(self.context) > self.max_context_length:
+            self._compress_context(save=False)
+        if save:
+            self.save_turn()
+    
+    def save_turn(self):
+        """
+        在单个事务内写回本轮对话的全部会话变更，并压缩归档本轮原文
+        版本号在数据库中递增后读回，作为归档轮次的序号，同一会话的并发请求不会得到相同的序号；
+        读取会话之后已有其他请求写入了新的轮次时，本轮追加在数据库中最新的上下文之后，不覆盖对方的轮次
+        """
+        pending_turn = getattr(self, '_pending_turn', None)
+        base_context = getattr(self, '_base_context', self.context)
+        sessions = ConversationSession.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            # 先递增版本号：SQLite 的事务由此取得写锁，其他数据库锁定该行，随后读到的上下文不会再被并发修改
+            sessions.update(version=F('version') + 1)
+            current = sessions.select_for_update().values('version', 'context').get()
+            self.version = current['version']
+            if current['context'] != base_context:
+                self.context = current['context'] + (pending_turn or '')
+                if len(self.context) > self.max_context_length:
+                    self._compress_context(save=False)
+            self.save(update_fields=self.TURN_UPDATE_FIELDS)
+            if pending_turn:
+                ConversationTurn.archive(self, self.version, pending_turn,
+                                         reasoning=getattr(self, '_pending_reasoning', ''),
+                                         embedding=getattr(self, '_pending_embedding', None))
+        self._base_context = self.context
+        self._pending_turn = None
+        self._pending_reasoning = ''
+        self._pending_embedding = None
     
     def get_or_create_state(self):
         """获取或创建对话状态"""
@@ -491,6 +553,63 @@ class ConversationSession(models.Model):
         return self.session_id
 
 
+class ConversationTurn(models.Model):
+    """归档的对话轮次，原文以 zstd 压缩存储，只在查看历史分页时解压"""
+    session = models.ForeignKey(
+        ConversationSession,
+        on_delete=models.CASCADE,
+        related_name='turns'
+    )
+    seq = models.PositiveIntegerField(help_text="轮次序号（取写入时的会话版本号），单调递增")
+    payload = models.BinaryField(help_text="zstd 压缩后的本轮原文")
+    dict_id = models.PositiveIntegerField(default=0, help_text="压缩使用的 zstd 字典 ID，0 表示无字典")
+    raw_length = models.PositiveIntegerField(default=0, help_text="压缩前的字符数")
+    reasoning_payload = models.BinaryField(null=True, blank=True,
+                                           help_text="zstd 压缩后的模型推理过程（REASONING_MODE=store 时保存）")
+    embedding = models.BinaryField(null=True, blank=True, help_text="本轮原文的向量（float32），用于检索相关的早期轮次")
+    embedding_model = models.CharField(max_length=100, blank=True, help_text="生成 embedding 的嵌入模型标识")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('session', 'seq')
+        ordering = ['seq']
+    
+    @classmethod
+    def archive(cls, session: ConversationSession, seq: int, text: str,
+                reasoning: str = "", embedding: Optional[Tuple[bytes, str]] = None) -> "ConversationTurn":
+        """
+        压缩并保存一轮对话原文，推理过程与原文使用同一字典分别压缩
+        embedding 为 (向量, 嵌入模型标识)，由调用方在事务外计算
+        """
+        from .history_codec import compress_text
+        payload, dict_id = compress_text(text)
+        reasoning_payload = None
+        if reasoning:
+            reasoning_payload, _ = compress_text(reasoning, dict_id)
+        vector, model_id = embedding or (None, "")
+        return cls.objects.create(session=session, seq=seq, payload=payload,
+                                  dict_id=dict_id, raw_length=len(text),
+                                  reasoning_payload=reasoning_payload,
+                                  embedding=vector, embedding_model=model_id)
+    
+    @property
+    def text(self) -> str:
+        """解压后的本轮原文"""
+        from .history_codec import decompress_text
+        return decompress_text(self.payload, self.dict_id)
+    
+    @property
+    def reasoning(self) -> str:
+        """解压后的推理过程，未保存时为空字符串"""
+        from .history_codec import decompress_text
+        if not self.reasoning_payload:
+            return ""
+        return decompress_text(self.reasoning_payload, self.dict_id)
+    
+    def __str__(self):
+        return f"{self.session.session_id} #{self.seq}"
+
+
 class ConversationState(models.Model):
     """对话状态管理模型，用于跟踪对话阶段和分析状态"""
     session = models.OneToOneField(
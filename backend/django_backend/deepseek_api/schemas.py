@@ -1,5 +1,5 @@
 from ninja import Schema
-from typing import Optional
+from typing import Dict, List, Optional
 
 class LoginIn(Schema):
     username: str
@@ -18,6 +18,20 @@ class ChatOut(Schema):
 
 class HistoryOut(Schema):
     history: str
+    turns: List[str] = []
+    total_turns: int = 0
+    next_cursor: Optional[int] = None
+    version: int = 0
+
+class StatsOut(Schema):
+    generation: str
+    rows: int
+    levels: Dict[str, int]
+    services: Dict[str, int]
+    error_codes: Dict[str, int]
+    components: Dict[str, int]
+    service_error_codes: Dict[str, Dict[str, int]]
+    service_levels: Dict[str, Dict[str, int]]
 
 class ErrorResponse(Schema):
     error: str
@@ -2,11 +2,19 @@ import time
 import threading
 import json
 import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from django.core.cache import cache
+from django.db import connection, transaction
 import hashlib
-from .models import APIKey, RateLimit, ConversationSession
+import logging
+from .models import APIKey, RateLimit, ConversationSession, ConversationState
+from .write_queue import run_write
+from .log_system import get_log_system
 from django.conf import settings
+from metrics import observe_stage
+from llm_scheduler import LLMScheduler
+
+logger = logging.getLogger(__name__)
 
 # 全局配置
 # API_KEY_LENGTH = 32
@@ -17,6 +25,9 @@ from django.conf import settings
 # 线程锁用于速率限制
 rate_lock = threading.Lock()
 
+# 进程内共享的大模型准入队列
+LLM_SCHEDULER = LLMScheduler(settings.LLM_CONCURRENCY, settings.LLM_MAX_QUEUE, settings.LLM_QUEUE_TIMEOUT)
+
 def json_to_markdown(json_response: str) -> str:
     """
     将JSON格式的AI响应转换为Markdown格式，适配前端显示
@@ -118,39 +129,46 @@ def json_to_markdown(json_response: str) -> str:
         # 其他错误，返回原始响应
         return json_response
 
-def deepseek_r1_api_call(prompt: str, session_context: str = "", conversation_type: str = "fault_analysis") -> str:
-    """智能 DeepSeek-R1 API 调用函数"""
-    from topklogsystem import TopKLogSystem, ConversationType
-    
-    system = TopKLogSystem(
-        log_path="./data/log",
-        llm="deepseek-r1:7b",
-        embedding_model="bge-large:latest"
-    )
+def deepseek_r1_api_call(prompt: str, session_context: str = "", conversation_type: str = "fault_analysis",
+                         system=None, user: str = "", session_key: str = "",
+                         history: str = "") -> Tuple[str, str]:
+    """
+    智能 DeepSeek-R1 API 调用函数（使用进程内共享的 TopKLogSystem，索引未就绪时不带检索结果）
+    调用大模型前需在 LLM_SCHEDULER 中按用户排队取得名额（检索和构建 Prompt 不占名额），排队已满时抛出 QueueFull
+    session_key 不为空时按会话缓存检索状态，跟进问题沿用上一轮的检索结果
+    history 为写入 prompt 的对话历史（见 session_memory.build_history）
+    返回 (回答, 推理过程)，回答中不含 <think> 推理块
+    """
+    system = system or get_log_system()
+    if system is None:
+        raise RuntimeError("日志分析系统尚未加载完成")
 
     query = prompt
     
     # 构建上下文信息
     context = {
         'context': session_context,
+        'history': history,
         'logs': []  # 这里可以添加检索到的日志信息
     }
-    
+    if session_key:
+        context['retrieval_state'] = cache.get(retrieval_cache_key(session_key))
+
     # 生成响应
-    result = system.generate_response(query, context)
-    time.sleep(0.5)
+    result = system.generate_response(query, context, llm_slot=lambda: LLM_SCHEDULER.slot(user))
+    if session_key and context.get('retrieval_state'):
+        cache.set(retrieval_cache_key(session_key), context['retrieval_state'], settings.RETRIEVAL_REUSE_TTL)
 
-    # 获取原始响应
+    # 获取原始响应（各阶段耗时见 /api/metrics，这里只在调试日志中记录响应概况）
     raw_response = result
-    print(f"🔍 原始响应长度: {len(raw_response)} 字符")
-    print(f"🔍 对话类型: {conversation_type}")
-    print(f"🔍 原始响应前200字符: {raw_response[:200]}...")
+    logger.debug(f"原始响应长度: {len(raw_response)} 字符，对话类型: {conversation_type}，"
+                 f"前200字符: {raw_response[:200]}...")
     
     # 根据对话类型进行智能处理
     processed_response = process_response_by_type(raw_response, conversation_type)
-    print(f"✅ 处理后响应长度: {len(processed_response)} 字符")
+    logger.debug(f"处理后响应长度: {len(processed_response)} 字符")
     
-    return processed_response
+    return processed_response, context.get('reasoning', '')
 
 def process_response_by_type(response: str, conversation_type: str) -> str:
     """
@@ -167,7 +185,7 @@ def process_response_by_type(response: str, conversation_type: str) -> str:
         # 现在所有对话类型都返回Markdown格式，直接返回
         return response
     except Exception as e:
-        print(f"⚠️ 响应处理出错: {e}")
+        logger.warning(f"响应处理出错: {e}")
         # 出错时返回原始响应
         return response
 
@@ -241,7 +259,7 @@ def optimize_response(response: str, conversation_type: str) -> str:
             # 其他类型：优化Markdown格式
             return optimize_markdown_response(response)
     except Exception as e:
-        print(f"⚠️ 响应优化出错: {e}")
+        logger.warning(f"响应优化出错: {e}")
         return response
 
 def optimize_json_response(response: str) -> str:
@@ -335,18 +353,21 @@ def create_api_key(user: str) -> str:
     key = APIKey.generate_key()
     expiry = time.time() + settings.TOKEN_EXPIRY_SECONDS
     
-    api_key = APIKey.objects.create(
-        key=key,
-        user=user,
-        expiry_time=expiry
-    )
-    
-    # 创建对应的速率限制记录
-    RateLimit.objects.create(
-        api_key=api_key,
-        reset_time=time.time() + settings.RATE_LIMIT_INTERVAL
-    )
+    def _insert():
+        api_key = APIKey.objects.create(
+            key=key,
+            user=user,
+            expiry_time=expiry
+        )
+        
+        # 创建对应的速率限制记录
+        RateLimit.objects.create(
+            api_key=api_key,
+            reset_time=time.time() + settings.RATE_LIMIT_INTERVAL
+        )
     
+    # 两条插入由写队列合并提交
+    run_write(_insert)
     return key
 
 def validate_api_key(key_str: str) -> bool:
@@ -410,17 +431,72 @@ def get_or_create_session(session_id: str, user: APIKey) -> ConversationSession:
     - 若用户+session_id已存在 → 加载旧会话（保留历史）
     - 若不存在 → 创建新会话（空历史）
     """
-    session, created = ConversationSession.objects.get_or_create(
-        session_id=session_id,  # 匹配会话ID
-        user=user,              # 匹配当前用户（关键！避免跨用户会话冲突）
-        defaults={'context': ''}
-    )
+    with observe_stage("session_load"):
+        session, created = ConversationSession.objects.get_or_create(
+            session_id=session_id,  # 匹配会话ID
+            user=user,              # 匹配当前用户（关键！避免跨用户会话冲突）
+            defaults={'context': ''}
+        )
     # 调试日志：确认是否创建新会话（created=True 表示新会话）
     import logging
     logger = logging.getLogger(__name__)
     logger.info(f"会话 {session_id}（用户：{user.user}）{'创建新会话' if created else '加载旧会话'}")
     return session
 
+def get_session_version(session_id: str, user: APIKey) -> Optional[Dict[str, int]]:
+    """只读查询会话主键和版本号，不加载上下文、不创建会话"""
+    return ConversationSession.objects.filter(
+        session_id=session_id, user=user
+    ).values('pk', 'version').first()
+
+
+def get_session(session_id: str, user: APIKey) -> Optional[ConversationSession]:
+    """只读获取会话，不存在时返回 None（不会创建新会话）"""
+    return ConversationSession.objects.filter(session_id=session_id, user=user).first()
+
+
+def build_history_etag(session_pk: int, version: int, cursor: Optional[int], limit: int) -> str:
+    """基于会话版本号和分页参数生成 ETag"""
+    return f'"{session_pk}-{version}-{cursor if cursor is not None else "end"}-{limit}"'
+
+
+def paginate_turns(total_turns: int, cursor: Optional[int], limit: int) -> tuple:
+    """
+    按轮次从新到旧分页：cursor 为上一页返回的起始轮次（不含），为空时从最新一轮开始
+    
+    Returns:
+        tuple: (本页起始轮次, 本页结束轮次(不含), 下一页游标或 None)
+    """
+    end = total_turns if cursor is None else max(0, min(cursor, total_turns))
+    start = 0 if limit <= 0 else max(0, end - limit)
+    return start, end, (start if start > 0 else None)
+
+
+def retrieval_cache_key(session_key: str) -> str:
+    """会话检索状态的缓存键；状态中记录了索引代，索引更新后自动失效"""
+    return f"retrieval:{session_key}"
+
+def clear_retrieval_state(session_key: str) -> None:
+    """清空会话历史时一并丢弃检索状态"""
+    cache.delete(retrieval_cache_key(session_key))
+
+def build_stats_etag(generation: str, top: int) -> str:
+    """日志统计只随索引代变化，按索引代和 top 生成 ETag"""
+    return f'"stats-{generation}-{top}"'
+
+
+def get_log_stats(system, top: int) -> Optional[Dict[str, Any]]:
+    """当前索引代的日志统计（/api/stats），按索引代缓存；索引没有统计数据时返回 None"""
+    if system.log_statistics is None:
+        return None
+    key = f"log_stats:{system.index_generation}:{top}"
+    stats = cache.get(key)
+    if stats is None:
+        stats = {"generation": system.index_generation, **system.log_statistics.to_dict(top)}
+        cache.set(key, stats, settings.STATS_CACHE_TTL)
+    return stats
+
+
 def get_cached_reply(prompt: str, session_id: str, user: APIKey) -> str | None:
     """缓存键包含 session_id 和 user，避免跨会话冲突"""
     cache_key = f"reply:{user.user}:{session_id}:{hash(prompt)}"
@@ -439,3 +515,114 @@ def generate_cache_key(original_key: str) -> str:
     # 使用SHA256哈希函数生成固定长度的键（64位十六进制字符串）
     hash_obj = hashlib.sha256(original_key.encode('utf-8'))
     return hash_obj.hexdigest()
+
+
+def _delete_in_batches(queryset, batch_size: int) -> Dict[str, int]:
+    """
+    分批删除查询集中的记录，每批使用一个短事务，避免长时间持有 SQLite 写锁
+    
+    Returns:
+        Dict[str, int]: 各模型被删除的行数（包含级联删除）
+    """
+    reclaimed: Dict[str, int] = {}
+    while True:
+        with transaction.atomic():
+            pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            _, per_model = queryset.model.objects.filter(pk__in=pks).delete()
+        for label, count in per_model.items():
+            reclaimed[label] = reclaimed.get(label, 0) + count
+    return reclaimed
+
+
+def purge_expired_data(batch_size: Optional[int] = None, retention_seconds: Optional[int] = None,
+                       vacuum: Optional[bool] = None, analyze: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    清理过期的 API Key 及其速率限制记录、会话历史，以及长期未更新的陈旧会话
+    
+    先删除子表记录再删除 API Key，保证每一批的级联删除规模可控。
+    
+    Args:
+        batch_size: 每批删除的最大行数
+        retention_seconds: 会话保留时长，超过该时长未更新的会话将被删除
+        vacuum: 是否在清理后执行 VACUUM（仅 SQLite）
+        analyze: 是否在清理后执行 ANALYZE（仅 SQLite）
+        
+    Returns:
+        dict: 各表回收的行数、总行数和耗时（秒）
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+
+    batch_size = batch_size or settings.MAINTENANCE_BATCH_SIZE
+    if retention_seconds is None:
+        retention_seconds = settings.SESSION_RETENTION_SECONDS
+    vacuum = settings.MAINTENANCE_VACUUM if vacuum is None else vacuum
+    analyze = settings.MAINTENANCE_ANALYZE if analyze is None else analyze
+
+    started = time.monotonic()
+    now = time.time()
+    reclaimed: Dict[str, int] = {}
+
+    def _merge(counts: Dict[str, int]):
+        for label, count in counts.items():
+            reclaimed[label] = reclaimed.get(label, 0) + count
+
+    expired_keys = APIKey.objects.filter(expiry_time__lt=now)
+    stale_before = timezone.now() - timedelta(seconds=retention_seconds)
+
+    # 子表优先：对话状态 → 会话 → 速率限制 → API Key
+    _merge(_delete_in_batches(ConversationState.objects.filter(session__user__in=expired_keys), batch_size))
+    _merge(_delete_in_batches(ConversationSession.objects.filter(user__in=expired_keys), batch_size))
+    _merge(_delete_in_batches(RateLimit.objects.filter(api_key__in=expired_keys), batch_size))
+    _merge(_delete_in_batches(expired_keys, batch_size))
+    # 未过期 Key 下的陈旧会话
+    if retention_seconds > 0:
+        _merge(_delete_in_batches(ConversationSession.objects.filter(updated_at__lt=stale_before), batch_size))
+
+    if connection.vendor == 'sqlite' and (vacuum or analyze):
+        with connection.cursor() as cursor:
+            if vacuum:
+                cursor.execute("VACUUM")
+            if analyze:
+                cursor.execute("ANALYZE")
+
+    report = {
+        'reclaimed': reclaimed,
+        'total': sum(reclaimed.values()),
+        'elapsed_seconds': round(time.monotonic() - started, 3),
+    }
+    logger.info(f"过期数据清理完成: 回收 {report['total']} 行，耗时 {report['elapsed_seconds']}s，明细 {reclaimed}")
+    return report
+
+
+_maintenance_thread: Optional[threading.Thread] = None
+
+
+def start_maintenance_scheduler(interval: Optional[int] = None) -> bool:
+    """
+    启动进程内的定时清理线程（守护线程，每个进程最多启动一次）
+    
+    Returns:
+        bool: 本次调用是否启动了新线程
+    """
+    global _maintenance_thread
+    interval = interval or settings.MAINTENANCE_INTERVAL_SECONDS
+    if interval <= 0 or (_maintenance_thread and _maintenance_thread.is_alive()):
+        return False
+
+    def _loop():
+        while True:
+            time.sleep(interval)
+            try:
+                purge_expired_data()
+            except Exception as e:
+                logger.error(f"定时清理过期数据失败: {e}")
+            finally:
+                connection.close()  # 线程持有的连接不复用，避免长期占用
+
+    _maintenance_thread = threading.Thread(target=_loop, name="maintenance-scheduler", daemon=True)
+    _maintenance_thread.start()
+    logger.info(f"进程内定时清理已启动，间隔 {interval}s")
+    return True
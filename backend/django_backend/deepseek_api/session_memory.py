@@ -0,0 +1,85 @@
+"""
+会话记忆：按轮次保存对话向量，构建 prompt 时只带最近几轮和与当前问题最相关的早期轮次
+
+每轮对话归档时计算一次向量（ConversationTurn.embedding）；生成回答前用当前问题的向量
+与更早轮次比较，取最相似的 SESSION_MEMORY_TOP_K 轮，再加上最近 SESSION_MEMORY_RECENT_TURNS 轮，
+按时间顺序拼接。每轮截断到 SESSION_MEMORY_TURN_CHARS，prompt 中的历史长度不随会话增长。
+"""
+import logging
+from array import array
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from metrics import observe_stage
+from .models import ConversationSession, ConversationTurn
+
+logger = logging.getLogger(__name__)
+
+
+def _model_id(system) -> str:
+    from offline_models import embedding_model_id
+    return embedding_model_id(system.embedding_model)
+
+
+def _embed(system, text: str) -> Optional[List[float]]:
+    try:
+        return system.embedding_model.embed_query(text[:settings.SESSION_MEMORY_TURN_CHARS * 2])
+    except Exception as e:
+        logger.warning(f"对话向量计算失败: {e}")
+        return None
+
+
+def embed_turn(system, user_input: str, reply: str) -> Optional[Tuple[bytes, str]]:
+    """计算本轮对话的向量，返回 (float32 字节串, 嵌入模型标识)；模型不可用时返回 None"""
+    if system is None:
+        return None
+    with observe_stage("session_memory.embed"):
+        vector = _embed(system, f"用户：{user_input}\n回复：{reply}")
+    if vector is None:
+        return None
+    return array('f', vector).tobytes(), _model_id(system)
+
+
+def _truncate(text: str) -> str:
+    limit = settings.SESSION_MEMORY_TURN_CHARS
+    return text if len(text) <= limit else text[:limit] + "…\n"
+
+
+def _similar_turns(session: ConversationSession, query: str, system, before_seq: int) -> List[int]:
+    """序号小于 before_seq 的轮次中与 query 最相似的若干轮，返回序号列表"""
+    import numpy as np
+
+    rows = list(session.turns.filter(seq__lt=before_seq, embedding_model=_model_id(system))
+                .exclude(embedding=None).order_by('-seq')
+                .values_list('seq', 'embedding')[:settings.SESSION_MEMORY_SCAN_TURNS])
+    if not rows:
+        return []
+    query_vector = _embed(system, query)
+    if query_vector is None:
+        return []
+
+    matrix = np.stack([np.frombuffer(bytes(blob), dtype=np.float32) for _, blob in rows])
+    q = np.asarray(query_vector, dtype=np.float32)
+    scores = matrix @ q / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(q) + 1e-9)
+    best = np.argsort(-scores)[:settings.SESSION_MEMORY_TOP_K]
+    return [rows[i][0] for i in best]
+
+
+def build_history(session: ConversationSession, query: str, system=None) -> str:
+    """
+    构建 prompt 中的对话历史：最近 N 轮 + 更早轮次中与 query 最相似的 K 轮，按时间顺序
+    system 为 None（模型尚未加载）时只带最近 N 轮
+    """
+    with observe_stage("session_memory.select"):
+        recent = list(session.turns.order_by('-seq')
+                      .values_list('seq', flat=True)[:settings.SESSION_MEMORY_RECENT_TURNS])
+        if not recent:
+            return ""
+        selected = set(recent)
+        if system is not None and settings.SESSION_MEMORY_TOP_K > 0:
+            selected.update(_similar_turns(session, query, system, before_seq=min(recent)))
+
+        turns = (ConversationTurn.objects.filter(session=session, seq__in=selected)
+                 .only('seq', 'payload', 'dict_id').order_by('seq'))
+        return "".join(_truncate(turn.text) for turn in turns)
@@ -0,0 +1,102 @@
+"""
+SQLite 单写线程队列
+
+SQLite 同一时刻只允许一个写事务，多个请求线程并发写入时会互相等待甚至报
+"database is locked"。这里把写操作投递到一个专用线程，由它把短时间内到达的
+多个写操作合并进同一个事务提交，每个写操作使用独立的保存点，互不影响。
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteWriteQueue:
+    """合并多个线程写操作的单写线程队列"""
+
+    def __init__(self, max_batch: int = 64, max_delay: float = 0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "queue.Queue[tuple[Callable, tuple, dict, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """投递写操作，返回 Future，可通过 result() 等待提交完成"""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get(timeout=self.max_delay))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [item for item in self._collect_batch() if item[3].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            close_old_connections()
+            outcomes = []
+            try:
+                with transaction.atomic():
+                    for fn, args, kwargs, _ in batch:
+                        try:
+                            with transaction.atomic():  # 保存点：单个写操作失败只回滚自己
+                                outcomes.append((fn(*args, **kwargs), None))
+                        except Exception as e:
+                            outcomes.append((None, e))
+            except Exception as e:
+                # 提交失败，整批写操作都未生效
+                logger.error(f"批量写入提交失败: {e}")
+                outcomes = [(None, e)] * len(batch)
+            # 事务提交后再通知调用方，保证调用方拿到结果时数据已落盘
+            for (_, _, _, future), (result, error) in zip(batch, outcomes):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+_write_queue: Optional[SQLiteWriteQueue] = None
+_write_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> SQLiteWriteQueue:
+    """获取进程内共享的写队列"""
+    global _write_queue
+    with _write_queue_lock:
+        if _write_queue is None:
+            _write_queue = SQLiteWriteQueue(
+                max_batch=settings.SQLITE_WRITE_BATCH_SIZE,
+                max_delay=settings.SQLITE_WRITE_MAX_DELAY,
+            )
+        return _write_queue
+
+
+def run_write(fn: Callable, *args, **kwargs) -> Any:
+    """
+    执行一个写操作：启用写队列且数据库为 SQLite 时交给单写线程批量提交并等待结果，
+    否则在当前线程直接执行
+    """
+    if not settings.SQLITE_WRITE_QUEUE or connection.vendor != 'sqlite':
+        return fn(*args, **kwargs)
+    return get_write_queue().submit(fn, *args, **kwargs).result()
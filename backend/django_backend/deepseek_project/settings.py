@@ -61,10 +61,32 @@ WSGI_APPLICATION = 'deepseek_project.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
     }
 }
 
+# SQLite 并发配置：默认 default 保持 SQLite 默认行为；设置 SQLITE_PROFILE=production 后
+# 启用 WAL + 忙等待 + 连接复用，以及下面的单写线程队列
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'default')
+if SQLITE_PROFILE == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,  # 复用连接，避免每个请求重新打开数据库
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,  # busy_timeout（秒），遇到写锁时等待而不是立即报 database is locked
+            'transaction_mode': 'IMMEDIATE',  # 事务开始即获取写锁，避免读锁升级失败
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    })
+# 单写线程队列：把多个请求线程的写操作合并到同一事务中批量提交
+SQLITE_WRITE_QUEUE = SQLITE_PROFILE == 'production'
+SQLITE_WRITE_BATCH_SIZE = 64
+SQLITE_WRITE_MAX_DELAY = 0.005  # 等待凑批的最长时间（秒）
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -112,3 +134,52 @@ RATE_LIMIT_MAX = 5000  # 每分钟最大请求数
 RATE_LIMIT_INTERVAL = 60
 CACHE_MAX_SIZE = 200
 CACHE_EXPIRY = 300
+
+# 过期数据清理（purge_expired 命令与进程内定时任务）
+MAINTENANCE_BATCH_SIZE = 500  # 每个短事务最多删除的行数
+MAINTENANCE_INTERVAL_SECONDS = int(os.environ.get('MAINTENANCE_INTERVAL_SECONDS', '0'))  # 0 表示不启用进程内定时清理
+SESSION_RETENTION_SECONDS = 30 * 24 * 3600  # 超过该时长未更新的会话视为陈旧会话
+MAINTENANCE_VACUUM = False  # 清理后是否执行 VACUUM
+MAINTENANCE_ANALYZE = True  # 清理后是否执行 ANALYZE
+
+# 对话历史归档压缩（zstandard）
+HISTORY_ZSTD_LEVEL = 6
+HISTORY_ZSTD_DICT_DIR = BASE_DIR / 'data' / 'zstd_dicts'  # 训练得到的字典文件目录
+HISTORY_ZSTD_DICT_SIZE = 64 * 1024  # 训练字典大小（字节）
+
+# Prometheus 指标接口 /api/metrics 允许访问的来源地址
+METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# 日志分析系统（TopKLogSystem）：每个服务进程共享一个实例，启动时在后台加载索引并预热模型
+LOG_DATA_PATH = os.environ.get('LOG_DATA_PATH', str(BASE_DIR / 'data' / 'log'))
+VECTOR_STORE_PATH = os.environ.get('VECTOR_STORE_PATH', str(BASE_DIR / 'data' / 'vector_stores'))
+LLM_MODEL = 'deepseek-r1:7b'
+LLM_FAST_MODEL = os.environ.get('LLM_FAST_MODEL', '')  # 概念解释、一般问答使用的快速模型（如 qwen2.5:3b），默认为空即全部使用 LLM_MODEL
+EMBEDDING_MODEL = 'bge-large:latest'
+INDEX_WARMUP = os.environ.get('INDEX_WARMUP', '1') == '1'  # 服务进程启动时即开始后台加载，否则在首个请求时开始
+LLM_WARMUP = True  # 索引就绪后发送一次短请求，让 Ollama 提前加载模型
+INDEX_RETRY_SECONDS = 60  # 加载失败后，至少间隔该时长才会在请求中重新尝试
+INDEX_NOT_READY_MODE = os.environ.get('INDEX_NOT_READY_MODE', 'degraded')  # degraded：不检索直接回答；reject：返回 503
+INDEX_NOT_READY_RETRY_AFTER = 10  # reject 模式下 503 响应的 Retry-After（秒）
+
+# 大模型准入队列（每个进程独立计数，多进程部署时 Ollama 的实际并发为 进程数 × LLM_CONCURRENCY）
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '2'))  # 同时发往 Ollama 的生成请求数
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '32'))  # 排队请求上限，超过时返回 429
+LLM_QUEUE_TIMEOUT = 120  # 排队超过该时长（秒）同样返回 429
+
+# deepseek-r1 推理过程（<think> 块）的处理方式，两种方式下推理过程都不会返回给前端、写入缓存或进入会话上下文
+# drop：丢弃；store：zstd 压缩后随对话轮次归档（ConversationTurn.reasoning）
+REASONING_MODE = os.environ.get('REASONING_MODE', 'drop')
+
+RETRIEVAL_REUSE_TTL = 1800  # 会话检索状态的缓存时长（秒），跟进问题在此期间沿用上一轮的检索结果
+
+# /api/stats 的响应按索引代缓存（秒），索引重建后自动失效；客户端缓存时长见 Cache-Control
+STATS_CACHE_TTL = 3600
+STATS_MAX_AGE = 60
+
+# 会话记忆：prompt 中的对话历史只包含最近几轮和按向量相似度选出的早期轮次
+SESSION_MEMORY = True
+SESSION_MEMORY_RECENT_TURNS = 2  # 始终带上的最近轮数
+SESSION_MEMORY_TOP_K = 3  # 额外带上的最相关早期轮数
+SESSION_MEMORY_TURN_CHARS = 800  # 每轮最多保留的字符数
+SESSION_MEMORY_SCAN_TURNS = 200  # 参与相似度比较的早期轮次上限
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+向量索引的分代存储与跨进程构建锁
+
+目录结构：
+    <root>/CURRENT        当前发布的代目录名（写临时文件后原子替换）
+    <root>/gen-000001/    每一代独立的 Chroma 持久化目录
+    <root>/.build.lock    构建锁（filelock），同一时刻只有一个进程构建新一代索引
+
+构建中的代目录在发布前对读取方不可见，发布只需原子替换 CURRENT；
+旧代保留若干个，已经打开旧代的进程可以继续读取。
+旧版本直接写在 <root> 下的 Chroma 数据在没有 CURRENT 时仍按当前索引读取。
+
+快照（export_snapshot / import_snapshot）把某一代目录连同 manifest.json 打包成单个 tar 文件，
+manifest 记录格式版本、嵌入模型标识和每个文件的 sha256，导入时逐一校验后作为新的一代发布。
+"""
+
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tarfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from filelock import FileLock, Timeout
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".build.lock"
+_GENERATION_PATTERN = re.compile(r"^gen-(\d{6})$")
+
+
+class IndexStore:
+    def __init__(self, root: str, keep_generations: int = 2):
+        self.root = root
+        self.keep_generations = max(1, keep_generations)
+        os.makedirs(root, exist_ok=True)
+        self._lock = FileLock(os.path.join(root, LOCK_FILE))
+
+    # ------------------------------------------------------------ 读取
+
+    def current_generation(self) -> Optional[str]:
+        """当前发布的代名称，尚未发布过时返回 None"""
+        try:
+            with open(os.path.join(self.root, CURRENT_FILE), encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        if _GENERATION_PATTERN.match(name) and os.path.isdir(os.path.join(self.root, name)):
+            return name
+        return None
+
+    def current_path(self) -> Optional[str]:
+        """当前索引的 Chroma 目录，兼容旧版直接写在根目录下的数据"""
+        name = self.current_generation()
+        if name:
+            return os.path.join(self.root, name)
+        if os.path.exists(os.path.join(self.root, "chroma.sqlite3")):
+            return self.root
+        return None
+
+    def generations(self) -> List[str]:
+        """磁盘上的全部代目录（含未发布的），按代号升序"""
+        return sorted(name for name in os.listdir(self.root)
+                      if _GENERATION_PATTERN.match(name) and os.path.isdir(os.path.join(self.root, name)))
+
+    def path_of(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    # ------------------------------------------------------------ 构建锁
+
+    def try_lock(self, timeout: float = 0) -> bool:
+        """获取构建锁，timeout=0 不等待，-1 一直等待；进程退出时锁由操作系统自动释放"""
+        try:
+            self._lock.acquire(timeout=timeout)
+            return True
+        except Timeout:
+            return False
+
+    def release_lock(self) -> None:
+        self._lock.release()
+
+    def is_building(self) -> bool:
+        """是否有其他进程持有构建锁"""
+        if self._lock.is_locked:
+            return False  # 本进程持有
+        if self.try_lock():
+            self.release_lock()
+            return False
+        return True
+
+    def wait_for_publish(self, previous: Optional[str], poll_interval: float = 1.0) -> Optional[str]:
+        """
+        等待其他进程发布新的一代：CURRENT 变化时返回新代名称；
+        构建进程在发布前退出（锁被释放）时返回 None，由调用方决定是否自己构建
+        """
+        while True:
+            name = self.current_generation()
+            if name and name != previous:
+                return name
+            if not self.is_building():
+                name = self.current_generation()
+                return name if name != previous else None
+            time.sleep(poll_interval)
+
+    # ------------------------------------------------------------ 写入（需持有构建锁）
+
+    def new_generation(self) -> str:
+        """创建下一代目录并返回其名称"""
+        existing = [int(_GENERATION_PATTERN.match(name).group(1)) for name in self.generations()]
+        name = f"gen-{max(existing, default=0) + 1:06d}"
+        os.makedirs(self.path_of(name))
+        return name
+
+    def publish(self, name: str) -> None:
+        """原子地把 CURRENT 指向新一代，并清理多余的旧代和构建失败遗留的代目录"""
+        current_file = os.path.join(self.root, CURRENT_FILE)
+        tmp_file = f"{current_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, current_file)
+        self._fsync_root()
+        logger.info(f"索引 {name} 已发布")
+        self._prune(name)
+
+    def discard(self, name: str) -> None:
+        shutil.rmtree(self.path_of(name), ignore_errors=True)
+
+    def _prune(self, current: str) -> None:
+        published = [name for name in self.generations() if name <= current]
+        keep = set(published[-self.keep_generations:])
+        for name in self.generations():
+            if name not in keep:
+                logger.info(f"清理旧索引 {name}")
+                self.discard(name)
+
+    def _fsync_root(self) -> None:
+        try:
+            fd = os.open(self.root, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+# ------------------------------------------------------------ 快照
+
+SNAPSHOT_FORMAT = "ida-index-snapshot"
+SNAPSHOT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+_INDEX_PREFIX = "index/"
+
+
+class SnapshotError(Exception):
+    """快照格式错误或校验失败"""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(store: IndexStore, output: str, extra: Dict, generation: Optional[str] = None) -> Dict:
+    """
+    把已发布的一代索引导出为快照文件，返回 manifest
+    导出期间持有构建锁，避免该代被并发的发布操作清理
+    """
+    store.try_lock(timeout=-1)
+    try:
+        name = generation or store.current_generation()
+        if not name or not os.path.isdir(store.path_of(name)):
+            raise SnapshotError("没有可导出的已发布索引")
+        root = store.path_of(name)
+
+        files = {}
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                rel = os.path.relpath(path, root).replace(os.sep, "/")
+                files[rel] = {"sha256": file_sha256(path), "size": os.path.getsize(path)}
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": SNAPSHOT_VERSION,
+            "generation": name,
+            "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            **extra,
+            "files": files,
+        }
+
+        tmp_output = f"{output}.{os.getpid()}.tmp"
+        mode = "w:gz" if output.endswith((".tar.gz", ".tgz")) else "w"
+        with tarfile.open(tmp_output, mode) as tar:
+            data = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            info = tarfile.TarInfo(MANIFEST_NAME)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))  # manifest 放在最前，读取时无需解压整个文件
+            for rel in sorted(files):
+                tar.add(os.path.join(root, rel), arcname=_INDEX_PREFIX + rel, recursive=False)
+        os.replace(tmp_output, output)
+        return manifest
+    finally:
+        store.release_lock()
+
+
+def read_manifest(archive: str) -> Dict:
+    """读取并检查快照的 manifest"""
+    try:
+        with tarfile.open(archive, "r:*") as tar:
+            member = tar.extractfile(MANIFEST_NAME)
+            manifest = json.load(member)
+    except (tarfile.TarError, KeyError, ValueError, OSError) as e:
+        raise SnapshotError(f"无法读取快照 manifest: {e}")
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise SnapshotError("不是索引快照文件")
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotError(f"不支持的快照版本: {manifest.get('version')}")
+    return manifest
+
+
+def import_snapshot(store: IndexStore, archive: str,
+                    verify: Optional[Callable[[str, Dict], None]] = None) -> Tuple[str, Dict]:
+    """
+    把快照解压为新的一代，校验全部文件的 sha256 后发布，返回 (代名称, manifest)
+    verify(path, manifest) 可做额外检查（如打开索引核对条数），抛出异常即放弃导入
+    """
+    manifest = read_manifest(archive)
+    expected = manifest.get("files", {})
+
+    store.try_lock(timeout=-1)
+    try:
+        name = store.new_generation()
+        dest = store.path_of(name)
+        try:
+            seen = set()
+            with tarfile.open(archive, "r:*") as tar:
+                for member in tar:
+                    if member.name == MANIFEST_NAME:
+                        continue
+                    rel = member.name[len(_INDEX_PREFIX):] if member.name.startswith(_INDEX_PREFIX) else None
+                    if (not rel or not member.isfile() or rel not in expected
+                            or rel.startswith("/") or ".." in rel.split("/")):
+                        raise SnapshotError(f"快照包含非法条目: {member.name}")
+
+                    target = os.path.join(dest, *rel.split("/"))
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    digest = hashlib.sha256()
+                    with tar.extractfile(member) as src, open(target, "wb") as dst:
+                        for block in iter(lambda: src.read(1024 * 1024), b""):
+                            digest.update(block)
+                            dst.write(block)
+                    if digest.hexdigest() != expected[rel]["sha256"]:
+                        raise SnapshotError(f"文件校验失败: {rel}")
+                    seen.add(rel)
+
+            missing = set(expected) - seen
+            if missing:
+                raise SnapshotError(f"快照缺少文件: {', '.join(sorted(missing))}")
+            if verify:
+                verify(dest, manifest)
+        except BaseException:
+            store.discard(name)
+            raise
+        store.publish(name)
+        return name, manifest
+    finally:
+        store.release_lock()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+大模型调用的准入队列
+
+同一时刻最多 concurrency 个生成请求发往 Ollama，其余请求排队等待；
+排队人数达到 max_queue 时立即拒绝（QueueFull），调用方据此返回 429 和 Retry-After。
+队列按优先级（数值越小越优先）分层，同一优先级内按用户轮询出队，
+某个用户连续提交大量请求时不会挤占其他用户的名额。
+
+调度器只在进程内生效，多进程部署时 Ollama 实际承受的并发为 进程数 × concurrency。
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, Optional
+
+from metrics import LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, observe_stage
+
+# 尚无完成记录时估算 Retry-After 使用的单次生成耗时（秒）
+DEFAULT_SERVICE_SECONDS = 5.0
+MAX_RETRY_AFTER = 60
+
+
+class QueueFull(Exception):
+    """排队人数已满或排队超时，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class LLMScheduler:
+    def __init__(self, concurrency: int = 2, max_queue: int = 32, queue_timeout: Optional[float] = None):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        # 优先级 -> {用户: 排队中的请求}，OrderedDict 的顺序即轮询顺序
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Ticket]]"] = {}
+        self._service_seconds = DEFAULT_SERVICE_SECONDS  # 单次生成耗时的指数滑动平均
+
+    @contextmanager
+    def slot(self, user: str, priority: int = 0) -> Iterator[None]:
+        """取得一个生成名额后执行代码块（排队耗时记入 llm_queue 阶段），排队已满或超时抛出 QueueFull"""
+        with observe_stage("llm_queue"):
+            self.acquire(user, priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def acquire(self, user: str, priority: int = 0) -> None:
+        queued_at = time.perf_counter()
+        with self._lock:
+            if self._running < self.concurrency and not self._waiting:
+                self._start()
+                LLM_QUEUE_WAIT.observe(0.0)
+                return
+            if self._waiting >= self.max_queue:
+                raise QueueFull("大模型请求排队已满", self._retry_after())
+            ticket = _Ticket()
+            self._queues.setdefault(priority, OrderedDict()).setdefault(user, deque()).append(ticket)
+            self._waiting += 1
+            LLM_QUEUE_DEPTH.set(self._waiting)
+
+        ticket.event.wait(self.queue_timeout)
+        with self._lock:
+            if not ticket.granted:
+                # 超时：从队列中撤下，未被唤醒前名额不会分配给它
+                self._remove(priority, user, ticket)
+                raise QueueFull("大模型请求排队超时", self._retry_after())
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - queued_at)
+
+    def release(self, service_seconds: Optional[float] = None) -> None:
+        with self._lock:
+            if service_seconds is not None:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+            ticket = self._next_ticket()
+            if ticket is None:
+                self._running -= 1
+                LLM_IN_FLIGHT.set(self._running)
+                return
+            # 名额直接交给下一个排队的请求，_running 不变
+            ticket.granted = True
+            ticket.event.set()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "concurrency": self.concurrency,
+                "max_queue": self.max_queue,
+                "service_seconds": round(self._service_seconds, 3),
+            }
+
+    # 以下方法需持有 self._lock
+
+    def _start(self) -> None:
+        self._running += 1
+        LLM_IN_FLIGHT.set(self._running)
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if not users:
+                continue
+            user, tickets = next(iter(users.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                users.move_to_end(user)  # 该用户还有请求，排到本优先级的队尾
+            else:
+                del users[user]
+            self._waiting -= 1
+            LLM_QUEUE_DEPTH.set(self._waiting)
+            return ticket
+        return None
+
+    def _remove(self, priority: int, user: str, ticket: _Ticket) -> None:
+        users = self._queues.get(priority, {})
+        tickets = users.get(user)
+        if tickets is None or ticket not in tickets:
+            return
+        tickets.remove(ticket)
+        if not tickets:
+            del users[user]
+        self._waiting -= 1
+        LLM_QUEUE_DEPTH.set(self._waiting)
+
+    def _retry_after(self) -> int:
+        """按当前排队人数和平均生成耗时估算多久后可能轮到"""
+        estimate = self._service_seconds * (self._waiting + 1) / self.concurrency
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(estimate)))
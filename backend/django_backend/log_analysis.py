@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+日志分析的轻量部分：对话类型识别、关键词/错误码/服务名提取、信息价值评分和领域知识上下文构建
+只依赖标准库和 domain_knowledge，Django 接口可以直接使用，无需加载向量库和大模型相关的依赖
+"""
+
+import re
+from enum import Enum
+from typing import List, Optional
+
+from metrics import observe_stage
+
+# 导入领域知识
+from domain_knowledge import (
+    get_error_code_meaning,
+    get_service_dependencies,
+    get_fault_category,
+    get_severity_level,
+    get_expert_insights,
+    get_industry_standards,
+    get_best_practices,
+    COMMON_PATTERNS
+)
+
+
+class ConversationType(Enum):
+    """对话类型枚举"""
+    FAULT_ANALYSIS = "fault_analysis"        # 故障分析（Markdown格式）
+    GENERAL_QUESTION = "general_question"    # 一般问题（Markdown格式）
+    FOLLOW_UP_QUESTION = "follow_up"         # 跟进问题（Markdown格式）
+    EXPLANATION_REQUEST = "explanation"       # 解释请求（Markdown格式）
+    PREVENTION_QUESTION = "prevention"       # 预防措施（Markdown格式）
+    DEPENDENCY_QUESTION = "dependency"       # 依赖关系（Markdown格式）
+
+
+def detect_conversation_type(query: str, context: str = "") -> ConversationType:
+    """
+    识别对话类型
+
+    Args:
+        query: 用户当前查询
+        context: 对话历史上下文
+
+    Returns:
+        ConversationType: 识别出的对话类型
+    """
+    query_lower = query.lower()
+    context_lower = context.lower()
+
+    # 1. 故障分析类问题（优先级最高，包含错误码的查询）
+    fault_keywords = [
+        "错误", "故障", "异常", "失败", "error", "fatal", "exception", 
+        "报错", "出错", "问题", "bug", "issue", "crash", "down"
+    ]
+
+    # 检查是否包含错误码模式（如：Alatest97, ERROR, FATAL等）
+    error_code_patterns = [
+        r'[A-Za-z]+\d+',  # 如 Alatest97
+        r'\b(ERROR|FATAL|WARN|INFO|DEBUG)\b',  # 日志级别
+        r'\b[A-Z_]+\b'  # 大写错误码
+    ]
+
+    has_error_code = any(re.search(pattern, query) for pattern in error_code_patterns)
+
+    if has_error_code or any(keyword in query_lower for keyword in fault_keywords):
+        # 如果是第一轮对话或上下文很短，认为是故障分析
+        if len(context) < 100 or not context.strip():
+            return ConversationType.FAULT_ANALYSIS
+        else:
+            # 有历史对话，认为是跟进问题
+            return ConversationType.FOLLOW_UP_QUESTION
+
+    # 2. 预防措施类问题（优先级第二）
+    prevention_keywords = [
+        "预防", "避免", "防止", "如何避免", "怎么预防", "预防措施",
+        "避免", "防范", "预防性", "proactive", "prevention", "avoid"
+    ]
+
+    if any(keyword in query_lower for keyword in prevention_keywords):
+        return ConversationType.PREVENTION_QUESTION
+
+    # 3. 解释类问题（优先级第三）
+    explanation_keywords = [
+        "是什么", "为什么", "什么意思", "解释", "说明", "这个", "这个错误"
+    ]
+
+    # 特殊处理：如果包含"是什么"、"为什么"等，优先判断为解释请求
+    if any(keyword in query_lower for keyword in explanation_keywords):
+        return ConversationType.EXPLANATION_REQUEST
+
+    # 4. 依赖关系类问题（优先级第四）
+    dependency_keywords = [
+        "依赖", "关系", "调用", "服务", "依赖关系", "调用链", "依赖链",
+        "关联", "连接", "dependencies", "relationship", "call", "service"
+    ]
+
+    # 特殊处理：避免"数据库连接"被误判为依赖关系
+    if any(keyword in query_lower for keyword in dependency_keywords):
+        # 排除故障相关词汇
+        if not any(keyword in query_lower for keyword in ["失败", "错误", "异常", "故障"]):
+            return ConversationType.DEPENDENCY_QUESTION
+
+    # 5. 基于上下文的判断
+    if context:
+        # 如果上下文包含故障分析相关内容，可能是跟进问题
+        if any(keyword in context_lower for keyword in fault_keywords):
+            return ConversationType.FOLLOW_UP_QUESTION
+
+        # 如果上下文包含预防相关内容，可能是预防问题
+        if any(keyword in context_lower for keyword in prevention_keywords):
+            return ConversationType.PREVENTION_QUESTION
+
+    # 6. 特殊处理：包含"如何"或"怎么"但不是预防措施
+    if any(keyword in query_lower for keyword in ["如何", "怎么"]):
+        # 检查是否包含预防相关词汇
+        if not any(keyword in query_lower for keyword in ["预防", "避免", "防止"]):
+            return ConversationType.EXPLANATION_REQUEST
+
+    # 7. 默认情况
+    return ConversationType.GENERAL_QUESTION
+
+
+def extract_keywords(query: str) -> List[str]:
+    """提取查询关键词"""
+    # 提取中文和英文关键词
+    keywords = []
+
+    # 提取中文词汇（2-4个字符）
+    chinese_words = re.findall(r'[\u4e00-\u9fff]{2,4}', query)
+    keywords.extend(chinese_words)
+
+    # 提取英文词汇（3个字符以上）
+    english_words = re.findall(r'\b[A-Za-z]{3,}\b', query)
+    keywords.extend(english_words)
+
+    # 提取技术术语
+    tech_terms = ['数据库', '连接池', '认证', '支付', '库存', '订单', '用户', '服务']
+    for term in tech_terms:
+        if term in query:
+            keywords.append(term)
+
+    return list(set(keywords))  # 去重
+
+
+def calculate_keyword_score(text: str, keywords: List[str]) -> float:
+    """计算关键词匹配分数"""
+    if not keywords:
+        return 0.0
+
+    matches = 0
+    for keyword in keywords:
+        if keyword.lower() in text.lower():
+            matches += 1
+
+    return matches / len(keywords)
+
+
+# 按优先级排列，日志中同时出现多个级别时取最靠前的
+LOG_LEVELS = ['FATAL', 'ERROR', 'WARN', 'WARNING', 'INFO', 'INFORMATION', 'DEBUG']
+_LOG_LEVEL_PATTERN = re.compile(r'\b(' + '|'.join(LOG_LEVELS) + r')\b', re.IGNORECASE)
+# 大写字母+数字+下划线的模式
+_ERROR_CODE_PATTERN = re.compile(r'\b[A-Z][A-Z0-9_]{2,}\b')
+# 以Service结尾的词汇
+_SERVICE_PATTERN = re.compile(r'\b[A-Za-z][A-Za-z0-9]*Service\b')
+# 常见的非错误码词汇
+_NON_ERROR_CODES = {'HTTP', 'URL', 'API', 'JSON', 'XML', 'SQL', 'TCP', 'UDP', 'IP', 'DNS'}
+LEVEL_WEIGHTS = {'FATAL': 1.0, 'ERROR': 0.8, 'WARN': 0.6, 'INFO': 0.4, 'DEBUG': 0.2}
+
+
+# 英文词必须整词匹配，避免 ACCOUNT_LOCK_EXPIRE 中的 COUNT、stop / AUTO_TOPUP 中的 top 被当成统计意图
+# （re.ASCII 使 \b 只以 ASCII 字母数字为界，英文词紧挨中文时仍能匹配）
+_COUNT_INTENT = re.compile(r"多少|几次|几条|几个|数量|总数|次数|计数|统计|占比|比例|\b(?:how many|count)\b",
+                           re.IGNORECASE | re.ASCII)
+_TOP_INTENT = re.compile(r"最常见|最多|最频繁|排名|排行|前\s*\d+|\btop\s*\d+\b", re.IGNORECASE | re.ASCII)
+# 要求分析原因、排查故障或给出建议的措辞，出现时即使问了数量也交给大模型回答
+_ANALYSIS_INTENT = re.compile(
+    r"为什么|原因|怎么|如何|分析|建议|解决|处理|影响|排查|定位|诊断|修复|故障|无响应|超时|挂了|"
+    r"\b(?:why|how to|fix|troubleshoot)\b", re.IGNORECASE | re.ASCII)
+
+
+def detect_aggregate_intent(query: str) -> Optional[str]:
+    """识别统计类问题：返回 "top"（最常见/前 N）、"count"（有多少）或 None"""
+    if _TOP_INTENT.search(query):
+        return "top"
+    if _COUNT_INTENT.search(query):
+        return "count"
+    return None
+
+
+def is_statistics_only(query: str) -> bool:
+    """
+    只问数量、排名而不要求分析原因、排查故障或给出建议的问题，可以直接用统计结果回答
+    是否包含可识别的过滤条件或分组维度由 LogStore.recognizes 另行判断
+    """
+    return detect_aggregate_intent(query) is not None and not _ANALYSIS_INTENT.search(query)
+
+
+def extract_log_level(content: str) -> str:
+    """提取日志级别"""
+    found = {match.upper() for match in _LOG_LEVEL_PATTERN.findall(content)}
+    for level in LOG_LEVELS:
+        if level in found:
+            return level
+    return "UNKNOWN"
+
+
+def extract_error_codes(content: str) -> List[str]:
+    """提取错误码"""
+    return [match for match in _ERROR_CODE_PATTERN.findall(content) if match not in _NON_ERROR_CODES]
+
+
+def extract_services(content: str) -> List[str]:
+    """提取服务名称"""
+    return _SERVICE_PATTERN.findall(content)
+
+
+def calculate_information_value(content: str, log_level: str, error_codes: List[str], services: List[str]) -> float:
+    """
+    计算日志信息价值分数
+    """
+    value_score = 0.0
+
+    # 日志级别权重
+    value_score += LEVEL_WEIGHTS.get(log_level, 0.1)
+
+    # 错误码权重
+    if error_codes:
+        value_score += 0.3
+
+    # 服务名称权重
+    if services:
+        value_score += 0.2
+
+    # 内容长度权重（避免过短或过长的日志）
+    content_length = len(content)
+    if 50 <= content_length <= 500:
+        value_score += 0.1
+
+    return min(value_score, 1.0)  # 限制最大值为1.0
+
+
+def extract_features(texts):
+    """
+    批量提取日志特征（构建索引时调用），texts 为 pandas Series，返回同索引的 DataFrame：
+    log_level、error_codes（列表）、services（列表）、value_score，与逐条调用上面的函数结果一致
+    """
+    import pandas as pd
+
+    upper = texts.str.upper()
+    log_level = pd.Series("UNKNOWN", index=texts.index, dtype=object)
+    # 倒序覆盖，优先级高的级别最后写入
+    for level in reversed(LOG_LEVELS):
+        log_level = log_level.mask(upper.str.contains(r'\b' + level + r'\b', regex=True), level)
+
+    error_codes = texts.str.findall(_ERROR_CODE_PATTERN).map(
+        lambda codes: [code for code in codes if code not in _NON_ERROR_CODES])
+    services = texts.str.findall(_SERVICE_PATTERN)
+
+    lengths = texts.str.len()
+    value_score = (log_level.map(LEVEL_WEIGHTS).fillna(0.1)
+                   + 0.3 * (error_codes.str.len() > 0)
+                   + 0.2 * (services.str.len() > 0)
+                   + 0.1 * lengths.between(50, 500)).clip(upper=1.0)
+
+    return texts.to_frame("text").assign(
+        log_level=log_level, error_codes=error_codes, services=services, value_score=value_score,
+    ).drop(columns="text")
+
+
+# 构建索引时写入 Document.metadata 的特征字段（Chroma 的 metadata 只能是标量，列表以逗号拼接）
+FEATURE_KEYS = ["log_level", "error_codes", "services", "value_score"]
+
+
+def features_to_metadata(log_level: str, error_codes: List[str], services: List[str], value_score: float) -> dict:
+    return {
+        "log_level": log_level,
+        "error_codes": ",".join(error_codes),
+        "services": ",".join(services),
+        "value_score": float(value_score),
+    }
+
+
+def features_from_metadata(metadata: dict) -> dict:
+    """检索结果 metadata 中的特征，旧索引没有特征时返回空字典"""
+    if not metadata or "value_score" not in metadata:
+        return {}
+    return {
+        "log_level": metadata["log_level"],
+        "error_codes": [code for code in metadata["error_codes"].split(",") if code],
+        "services": [service for service in metadata["services"].split(",") if service],
+        "value_score": metadata["value_score"],
+    }
+
+
+def log_features(log: dict) -> tuple:
+    """
+    检索结果的 (日志级别, 错误码, 服务名, 信息价值)，优先使用构建索引时写入的特征，
+    旧索引中没有特征时再从内容中提取
+    """
+    if "value_score" in log:
+        return log["log_level"], log["error_codes"], log["services"], log["value_score"]
+    content = log.get("content", "")
+    log_level = extract_log_level(content)
+    error_codes = extract_error_codes(content)
+    services = extract_services(content)
+    return log_level, error_codes, services, calculate_information_value(content, log_level, error_codes, services)
+
+
+def build_domain_context(context, statistics=None) -> str:
+    """
+    构建领域知识上下文，为AI提供专业的故障诊断知识
+    statistics 为入库时预先计算的日志统计（log_store.LogStatistics），附带相关错误码、服务的整体统计
+    """
+    with observe_stage("domain_context"):
+        return _build_domain_context_text(context, statistics)
+
+
+def _build_domain_context_text(context, statistics=None) -> str:
+    # 处理不同类型的context
+    if isinstance(context, str):
+        # 如果是字符串，直接返回基础领域知识
+        return "## 领域知识\n基于系统故障诊断的专业知识。"
+
+    if not context or not isinstance(context, (list, dict)):
+        return "## 领域知识\n暂无相关日志信息。"
+
+    # 如果是字典，尝试获取logs
+    if isinstance(context, dict):
+        logs = context.get('logs', [])
+        if not logs:
+            return "## 领域知识\n基于系统故障诊断的专业知识。"
+    else:
+        logs = context
+
+    # 提取所有错误码和服务
+    error_codes = set()
+    services = set()
+
+    for log in logs:
+        if isinstance(log, dict):
+            _, log_error_codes, log_services, _ = log_features(log)
+        else:
+            log_error_codes, log_services = extract_error_codes(str(log)), extract_services(str(log))
+        error_codes.update(log_error_codes)
+        services.update(log_services)
+
+    # 构建领域知识上下文
+    domain_context = "## 相关错误码的专业知识\n"
+
+    for error_code in list(error_codes)[:10]:  # 限制最多10个错误码
+        meaning = get_error_code_meaning(error_code)
+        category = get_fault_category(error_code)
+        severity = get_severity_level(error_code)
+
+        domain_context += f"- **{error_code}**: {meaning}\n"
+        domain_context += f"  - 分类: {category}\n"
+        domain_context += f"  - 严重程度: {severity}\n"
+
+    # 添加日志库整体统计（领域知识会放入 prompt 模板，转义花括号）
+    if statistics is not None:
+        section = statistics.slice_for(sorted(error_codes), sorted(services))
+        if section:
+            domain_context += "\n" + section.replace("{", "{{").replace("}", "}}")
+
+    # 添加服务依赖关系
+    if services:
+        domain_context += "\n## 服务依赖关系\n"
+        for service in list(services)[:5]:  # 限制最多5个服务
+            dependencies = get_service_dependencies(service)
+            if dependencies:
+                domain_context += f"- **{service}** 依赖: {', '.join(dependencies)}\n"
+
+    # 添加常见故障模式
+    domain_context += "\n## 常见故障模式\n"
+    for pattern_name, pattern_info in list(COMMON_PATTERNS.items())[:3]:  # 限制最多3个模式
+        domain_context += f"- **{pattern_name}**:\n"
+        domain_context += f"  - 症状: {', '.join(pattern_info.get('symptoms', [])[:3])}\n"
+        domain_context += f"  - 常见原因: {', '.join(pattern_info.get('root_causes', [])[:3])}\n"
+        domain_context += f"  - 立即行动: {', '.join(pattern_info.get('immediate_actions', [])[:2])}\n"
+
+    # 添加专家洞察和行业标准
+    domain_context += "\n## 专家洞察和行业标准\n"
+    expert_patterns = ["数据库连接池耗尽", "认证失败", "支付异常"]
+    for pattern in expert_patterns[:2]:  # 限制最多2个模式
+        insights = get_expert_insights(pattern)
+        standards = get_industry_standards(pattern)
+
+        if insights:
+            domain_context += f"- **{pattern}专家洞察**:\n"
+            for insight in insights[:2]:  # 限制最多2条洞察
+                domain_context += f"  - {insight}\n"
+
+        if standards:
+            domain_context += f"- **{pattern}行业标准**:\n"
+            for standard in standards[:2]:  # 限制最多2条标准
+                domain_context += f"  - {standard}\n"
+
+    # 添加行业最佳实践
+    domain_context += "\n## 行业最佳实践\n"
+    best_practices = get_best_practices("微服务架构")
+    if best_practices:
+        domain_context += "- **微服务架构最佳实践**:\n"
+        for category, practices in list(best_practices.items())[:2]:  # 限制最多2个类别
+            domain_context += f"  - {category}: {', '.join(practices[:2])}\n"
+
+    return domain_context
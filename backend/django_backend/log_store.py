@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+列式日志表与聚合查询
+
+构建索引时把全部日志行的服务、级别、错误码、组件保存为 pandas 分类列（只存类别编码），
+与向量索引放在同一代目录中（log_table.npz，快照导出时一并带上）。
+"有多少 / 最常见 / 前 N" 一类问题直接在表上做过滤、分组计数，得到的是精确统计，
+不依赖检索到的少量日志，也不需要大模型计算。
+
+LogStatistics 在读取日志时按分块累加各维度计数和 服务×错误码、服务×级别 共现计数，
+保存为 log_stats.json，供 /api/stats 和 prompt 的领域知识直接使用，请求时不再计算。
+"""
+
+import json
+import logging
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "log_table.npz"
+STATS_NAME = "log_stats.json"
+
+# CSV 列名 -> 表中的列名
+COLUMNS = {"服务": "service", "级别": "level", "错误": "error_code", "组件": "component"}
+DIMENSION_LABELS = {"service": "服务", "level": "级别", "error_code": "错误码", "component": "组件"}
+
+# 问题中指定分组维度的词，按顺序匹配
+_DIMENSION_WORDS = [
+    ("error_code", re.compile(r"错误码|错误类型|错误|异常码|\b(?:error code|error)s?\b", re.IGNORECASE | re.ASCII)),
+    ("service", re.compile(r"服务|\bservices?\b", re.IGNORECASE | re.ASCII)),
+    ("component", re.compile(r"组件|模块|\bcomponents?\b", re.IGNORECASE | re.ASCII)),
+    ("level", re.compile(r"级别|等级|\blevels?\b", re.IGNORECASE | re.ASCII)),
+]
+_TOP_N = re.compile(r"(?:前|top\s*)(\d+)", re.IGNORECASE)
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9_]*")
+DEFAULT_TOP_N = 5
+
+
+class LogStore:
+    def __init__(self, frame):
+        """frame 的列为 COLUMNS 中的英文列名，dtype 为 category"""
+        self.frame = frame
+        # 大写取值 -> (列, 原始取值)，用于从问题中识别过滤条件；级别优先于同名的其他取值
+        self._values: Dict[str, Tuple[str, str]] = {}
+        for column in ("component", "error_code", "service", "level"):
+            if column in frame:
+                for value in frame[column].cat.categories:
+                    self._values[str(value).upper()] = (column, str(value))
+
+    @property
+    def rows(self) -> int:
+        return len(self.frame)
+
+    @classmethod
+    def from_frames(cls, frames: List) -> Optional["LogStore"]:
+        """由构建索引时读取的各 CSV 分块组成，没有可用的列时返回 None"""
+        import pandas as pd
+
+        frames = [frame[[c for c in COLUMNS if c in frame]] for frame in frames]
+        frames = [frame for frame in frames if len(frame.columns)]
+        if not frames:
+            return None
+        frame = pd.concat(frames, ignore_index=True).rename(columns=COLUMNS)
+        return cls(frame.astype("string").astype("category"))
+
+    def save(self, directory: str) -> None:
+        import numpy as np
+
+        arrays = {}
+        for column in self.frame:
+            values = self.frame[column]
+            arrays[f"{column}__codes"] = values.cat.codes.to_numpy(dtype=np.int32)
+            arrays[f"{column}__categories"] = np.array([str(v) for v in values.cat.categories], dtype=str)
+        np.savez_compressed(os.path.join(directory, TABLE_NAME), **arrays)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["LogStore"]:
+        """读取代目录中的日志表，旧索引没有该文件时返回 None"""
+        import numpy as np
+        import pandas as pd
+
+        path = os.path.join(directory, TABLE_NAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                columns = {
+                    column: pd.Categorical.from_codes(data[f"{column}__codes"], data[f"{column}__categories"])
+                    for column in COLUMNS.values() if f"{column}__codes" in data
+                }
+        except Exception as e:
+            logger.warning(f"加载日志表失败 {path}: {e}")
+            return None
+        return cls(pd.DataFrame(columns))
+
+    def filters_in(self, query: str) -> Dict[str, List[str]]:
+        """问题中出现的服务、级别、错误码、组件取值"""
+        filters: Dict[str, List[str]] = {}
+        for word in _WORD.findall(query):
+            match = self._values.get(word.upper())
+            if match and match[1] not in filters.get(match[0], []):
+                filters.setdefault(match[0], []).append(match[1])
+        return filters
+
+    def dimension_in(self, query: str, filters: Optional[Dict[str, List[str]]] = None) -> Optional[str]:
+        """问题中的分组维度（错误码、服务、组件、级别），已作为过滤条件的列除外"""
+        filters = self.filters_in(query) if filters is None else filters
+        # 过滤条件中的取值（如 ERROR、PaymentService）不作为分组维度词
+        rest = _WORD.sub(lambda m: "" if m.group().upper() in self._values else m.group(), query)
+        return next((column for column, pattern in _DIMENSION_WORDS
+                     if column in self.frame and column not in filters and pattern.search(rest)), None)
+
+    def recognizes(self, query: str) -> bool:
+        """问题中是否有可识别的过滤条件或分组维度，没有时统计结果不足以直接作为回答"""
+        filters = self.filters_in(query)
+        return bool(filters) or self.dimension_in(query, filters) is not None
+
+    def _mask(self, filters: Dict[str, List[str]]):
+        import numpy as np
+
+        mask = np.ones(self.rows, dtype=bool)
+        for column, values in filters.items():
+            mask &= self.frame[column].isin(values).to_numpy()
+        return mask
+
+    def count(self, filters: Optional[Dict[str, List[str]]] = None) -> int:
+        return int(self._mask(filters or {}).sum())
+
+    def top(self, column: str, n: int = DEFAULT_TOP_N,
+            filters: Optional[Dict[str, List[str]]] = None) -> List[Tuple[str, int]]:
+        """按 column 分组计数，返回出现次数最多的 n 个取值"""
+        if column not in self.frame:
+            return []
+        counts = self.frame.loc[self._mask(filters or {}), column].value_counts()
+        return [(str(value), int(count)) for value, count in counts.head(n).items() if count > 0]
+
+    def aggregate(self, query: str, intent: str) -> str:
+        """
+        按意图（count / top，见 log_analysis.detect_aggregate_intent）计算统计结果，返回 Markdown 段落
+        问题中既没有可识别的过滤条件、也没有分组维度时返回空字符串
+        """
+        filters = self.filters_in(query)
+        dimension = self.dimension_in(query, filters)
+        if intent == "top" and dimension is None:
+            return ""
+        if intent == "count" and not filters and "日志" not in query:
+            return ""
+
+        lines = [f"## 日志精确统计（基于全部 {self.rows} 条日志）"]
+        if filters:
+            condition = "，".join(f"{DIMENSION_LABELS[c]}={'/'.join(v)}" for c, v in filters.items())
+            lines.append(f"- 条件: {condition}")
+        matched = self.count(filters)
+        if filters or intent == "count":
+            share = matched / self.rows * 100 if self.rows else 0.0
+            lines.append(f"- 匹配日志数: {matched}（占全部日志 {share:.1f}%）")
+
+        if intent == "top":
+            match = _TOP_N.search(query)
+            n = int(match.group(1)) if match else DEFAULT_TOP_N
+            ranking = self.top(dimension, n, filters)
+            lines.append(f"- 出现次数最多的{DIMENSION_LABELS[dimension]}（前 {n}）:")
+            lines += [f"  {i}. {value}: {count} 次（{count / matched * 100:.1f}%）"
+                      for i, (value, count) in enumerate(ranking, 1)]
+        else:
+            # 计数问题附带一个未作为条件的维度的分布，优先级别
+            breakdown = next((column for column in ("level", "service", "error_code")
+                              if column in self.frame and column not in filters), None)
+            if breakdown and matched:
+                distribution = "，".join(f"{value} {count}" for value, count in self.top(breakdown, 5, filters))
+                lines.append(f"- 按{DIMENSION_LABELS[breakdown]}分布: {distribution}")
+        return "\n".join(lines) + "\n"
+
+
+class LogStatistics:
+    """全部日志的计数：各维度取值的出现次数，以及 服务×错误码、服务×级别 的共现次数"""
+
+    DIMENSIONS = ("level", "service", "error_code", "component")
+    PAIRS = (("service", "error_code"), ("service", "level"))
+
+    def __init__(self):
+        self.rows = 0
+        self.counts: Dict[str, Counter] = {column: Counter() for column in self.DIMENSIONS}
+        # "service×error_code" -> {服务: Counter(错误码)}
+        self.pairs: Dict[str, Dict[str, Counter]] = {f"{a}×{b}": {} for a, b in self.PAIRS}
+        self._ranks: Optional[Dict[str, int]] = None
+
+    def update(self, chunk) -> None:
+        """累加一个日志分块（CSV 列名或 COLUMNS 中的英文列名均可）"""
+        frame = chunk.rename(columns=COLUMNS)
+        self.rows += len(frame)
+        for column in self.DIMENSIONS:
+            if column in frame:
+                self.counts[column].update(frame[column].dropna().astype(str).value_counts().to_dict())
+        for a, b in self.PAIRS:
+            if a in frame and b in frame:
+                matrix = self.pairs[f"{a}×{b}"]
+                for (x, y), n in frame.groupby([a, b], observed=True).size().items():
+                    matrix.setdefault(str(x), Counter())[str(y)] += int(n)
+        self._ranks = None
+
+    def save(self, directory: str) -> None:
+        data = {"rows": self.rows, "counts": self.counts, "pairs": self.pairs}
+        with open(os.path.join(directory, STATS_NAME), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, log_store: Optional[LogStore] = None) -> Optional["LogStatistics"]:
+        """读取代目录中的统计；没有统计文件但有日志表时（旧版本构建）由日志表计算一次"""
+        path = os.path.join(directory, STATS_NAME)
+        stats = cls()
+        if not os.path.exists(path):
+            if log_store is None:
+                return None
+            stats.update(log_store.frame)
+            return stats
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"加载日志统计失败 {path}: {e}")
+            return None
+        stats.rows = data["rows"]
+        stats.counts.update({column: Counter(values) for column, values in data["counts"].items()})
+        stats.pairs.update({name: {x: Counter(ys) for x, ys in matrix.items()}
+                            for name, matrix in data["pairs"].items()})
+        return stats
+
+    def to_dict(self, top: int = 20) -> Dict:
+        """/api/stats 的响应：各维度前 top 个取值，共现矩阵取出现最多的 top 个服务、每个服务前 top 个取值"""
+        def _top(counter: Counter) -> Dict[str, int]:
+            return dict(counter.most_common(top))
+
+        services = [service for service, _ in self.counts["service"].most_common(top)]
+        return {
+            "rows": self.rows,
+            "levels": _top(self.counts["level"]),
+            "services": _top(self.counts["service"]),
+            "error_codes": _top(self.counts["error_code"]),
+            "components": _top(self.counts["component"]),
+            "service_error_codes": {s: _top(self.pairs["service×error_code"].get(s, Counter())) for s in services},
+            "service_levels": {s: _top(self.pairs["service×level"].get(s, Counter())) for s in services},
+        }
+
+    def _error_code_ranks(self) -> Dict[str, int]:
+        """
+        错误码的排名，并列的排名相同（排名 = 出现次数更多的错误码数 + 1）
+        实例由多个请求线程共享：在局部字典中算完后一次性赋值，其他线程不会读到填充到一半的结果
+        """
+        ranks = self._ranks
+        if ranks is None:
+            ranks, previous, rank = {}, None, 0
+            for i, (code, count) in enumerate(self.counts["error_code"].most_common(), 1):
+                if count != previous:
+                    previous, rank = count, i
+                ranks[code] = rank
+            self._ranks = ranks
+        return ranks
+
+    def slice_for(self, error_codes, services, max_codes: int = 5, max_services: int = 3) -> str:
+        """检索到的日志涉及的错误码、服务在全部日志中的统计，用于 prompt 的领域知识，没有可用数据时返回空字符串"""
+        ranks = self._error_code_ranks()
+        codes = [code for code in error_codes if code in self.counts["error_code"]][:max_codes]
+        services = [service for service in services if service in self.counts["service"]][:max_services]
+        if not codes and not services:
+            return ""
+
+        lines = [f"## 日志库整体统计（全部 {self.rows} 条日志）"]
+        code_services = {}
+        for service, codes_of_service in self.pairs["service×error_code"].items():
+            for code in codes:
+                if codes_of_service.get(code):
+                    code_services.setdefault(code, Counter())[service] = codes_of_service[code]
+        for code in codes:
+            count = self.counts["error_code"][code]
+            line = (f"- **{code}**: 共 {count} 次（占 {count / self.rows * 100:.1f}%，"
+                    f"在 {len(self.counts['error_code'])} 个错误码中排第 {ranks[code]}）")
+            top_services = code_services.get(code, Counter()).most_common(3)
+            if top_services:
+                line += "，主要来自 " + "、".join(f"{s} {n} 次" for s, n in top_services)
+            lines.append(line)
+        for service in services:
+            levels = self.pairs["service×level"].get(service, Counter()).most_common()
+            top_codes = self.pairs["service×error_code"].get(service, Counter()).most_common(3)
+            line = f"- **{service}**: 共 {self.counts['service'][service]} 条日志"
+            if levels:
+                line += "，级别 " + "、".join(f"{level} {n}" for level, n in levels)
+            if top_codes:
+                line += "，最常见错误码 " + "、".join(f"{code} {n}" for code, n in top_codes)
+            lines.append(line)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+日志模板挖掘：入库时把只有参数（用户ID、订单号、偏移量、数值等）不同的重复日志归并为一个模板
+
+参照 Drain 的做法：
+1. 先用正则把 UUID、十六进制、IP、含数字的 ID/数值替换为 <*>；
+2. 服务、级别、错误码、组件等分类列必须完全相同（相当于 Drain 的前缀层），
+   其余文本列按分隔符切分后按 token 数分组；
+3. 组内与已有模板逐位比较，相同 token 的比例达到 SIM_THRESHOLD 即归入该模板，不同的位置改为 <*>。
+
+每个模板记录出现次数、首次/末次出现位置（文件:行号）和若干组参数示例，构建索引时每个模板只生成一个向量。
+只出现一次的日志保留原文，不做任何替换。
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+PARAM = "<*>"
+SIM_THRESHOLD = 0.8
+MAX_SAMPLES = 3
+
+# 必须完全相同才能归为同一模板的列，CSV 中不存在的列忽略
+KEY_COLUMNS = ("服务", "级别", "错误", "组件")
+
+# 写入 Document.metadata 的模板字段（不参与向量计算）
+TEMPLATE_KEYS = ["occurrences", "first_seen", "last_seen", "sample_params"]
+
+_PARAM_PATTERNS = [
+    re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"),
+    re.compile(r"0[xX][0-9a-fA-F]+"),
+    re.compile(r"(?<![\d.])\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?(?![\d.])"),
+    # 含数字的 ID 或数值，如 1001、ORD20250919001、3.5、SKU-777（中文与数字之间没有 \b，用前后断言）
+    re.compile(r"(?<![A-Za-z0-9_])[A-Za-z_-]*\d[A-Za-z0-9_.-]*(?![A-Za-z0-9_])"),
+]
+_DELIMITER = re.compile(r"(\s+|[，,。；;：:=()（）\[\]【】/|])")
+
+
+def mask_parameters(value: str) -> Tuple[str, List[str]]:
+    """把文本中的参数替换为 <*>，返回 (替换后的文本, 按出现顺序的参数)"""
+    params: List[str] = []
+
+    def _replace(match):
+        params.append(match.group())
+        return PARAM
+
+    for pattern in _PARAM_PATTERNS:
+        value = pattern.sub(_replace, value)
+    return value, params
+
+
+def _tokenize(value: str) -> List[str]:
+    return [token for token in _DELIMITER.split(value) if token]
+
+
+def _is_content(token: str) -> bool:
+    return not _DELIMITER.fullmatch(token)
+
+
+class LogTemplate:
+    __slots__ = ("key", "columns", "fields", "count", "first_seen", "last_seen", "last_row", "samples",
+                 "_original")
+
+    def __init__(self, key: Tuple, columns: Optional[List[str]], fields: List[List[str]],
+                 location: str, original: str):
+        self.key = key
+        self.columns = columns  # 为 None 表示整篇文档（txt/md/json），不参与归并
+        self.fields = fields  # 非分类列的 token 序列
+        self.count = 0
+        self.first_seen = self.last_seen = location
+        self.last_row = 0  # 末次出现是第几条日志，用于合并模板时比较先后
+        self.samples: List[str] = []
+        self._original = original
+
+    @property
+    def text(self) -> str:
+        """用于向量化的文本：只出现一次时为原文，否则为模板（格式与单行日志一致）"""
+        if self.count == 1 or self.columns is None:
+            return self._original
+        values = dict(zip(self.key_columns, self.key))
+        values.update(zip(self.text_columns, ("".join(tokens) for tokens in self.fields)))
+        return " (" + ", ".join(f"{column}={values[column]!r}" for column in self.columns) + ")"
+
+    @property
+    def key_columns(self) -> List[str]:
+        return [column for column in self.columns if column in KEY_COLUMNS]
+
+    @property
+    def text_columns(self) -> List[str]:
+        return [column for column in self.columns if column not in KEY_COLUMNS]
+
+    def similarity(self, fields: List[List[str]]) -> float:
+        same = total = 0
+        for template_tokens, tokens in zip(self.fields, fields):
+            for template_token, token in zip(template_tokens, tokens):
+                if not _is_content(token):
+                    continue
+                total += 1
+                if template_token == token or template_token == PARAM:
+                    same += 1
+        return same / total if total else 1.0
+
+    def merge(self, fields: List[List[str]], params: List[str], location: str, row: int) -> None:
+        """归入一条日志：与模板不同的位置改为 <*>，该位置的值计入参数"""
+        for template_tokens, tokens in zip(self.fields, fields):
+            for i, token in enumerate(tokens):
+                if template_tokens[i] != token:
+                    if template_tokens[i] != PARAM:
+                        template_tokens[i] = PARAM
+                    if token != PARAM:
+                        params = params + [token]
+        self.add(params, location, row)
+
+    def add(self, params: List[str], location: str, row: int) -> None:
+        self.count += 1
+        self.last_seen, self.last_row = location, row
+        self._add_sample(", ".join(params))
+
+    def absorb(self, other: "LogTemplate") -> None:
+        """并入另一个近似重复的模板（见 minhash），保留本模板的文本"""
+        self.count += other.count
+        if other.last_row > self.last_row:
+            self.last_seen, self.last_row = other.last_seen, other.last_row
+        for sample in other.samples:
+            self._add_sample(sample)
+
+    def _add_sample(self, sample: str) -> None:
+        if sample and len(self.samples) < MAX_SAMPLES and sample not in self.samples:
+            self.samples.append(sample)
+
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            "occurrences": self.count,
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+            "sample_params": " | ".join(self.samples),
+        }
+
+
+class TemplateMiner:
+    def __init__(self, sim_threshold: float = SIM_THRESHOLD):
+        self.sim_threshold = sim_threshold
+        self.rows = 0
+        self._templates: List[LogTemplate] = []
+        # (分类列的值, 各文本列的 token 数) -> 候选模板
+        self._groups: Dict[Tuple, List[LogTemplate]] = {}
+
+    def add_row(self, row: Dict[str, Any], location: str, original: str) -> LogTemplate:
+        """加入一行 CSV 日志，row 为 列名 -> 值，original 为该行原本用于向量化的文本"""
+        self.rows += 1
+        columns = list(row)
+        key = tuple(str(row[column]) for column in columns if column in KEY_COLUMNS)
+        fields, params = [], []
+        for column in columns:
+            if column in KEY_COLUMNS:
+                continue
+            masked, found = mask_parameters(str(row[column]))
+            fields.append(_tokenize(masked))
+            params += found
+
+        group = self._groups.setdefault((key, tuple(len(tokens) for tokens in fields)), [])
+        best, best_similarity = None, self.sim_threshold
+        for template in group:
+            similarity = template.similarity(fields)
+            if similarity >= best_similarity:
+                best, best_similarity = template, similarity
+        if best is not None:
+            best.merge(fields, params, location, self.rows)
+            return best
+
+        template = LogTemplate(key, columns, fields, location, original)
+        template.add(params, location, self.rows)
+        group.append(template)
+        self._templates.append(template)
+        return template
+
+    def add_document(self, text: str, location: str) -> LogTemplate:
+        """加入一篇整体向量化的文档（txt/md/json），不参与归并"""
+        self.rows += 1
+        template = LogTemplate((), None, [], location, text)
+        template.add([], location, self.rows)
+        self._templates.append(template)
+        return template
+
+    def templates(self) -> List[LogTemplate]:
+        """按首次出现顺序返回全部模板"""
+        return list(self._templates)
+
+
+def template_info(metadata: dict) -> dict:
+    """检索结果 metadata 中的模板统计，旧索引没有时返回空字典"""
+    if not metadata or "occurrences" not in metadata:
+        return {}
+    return {key: metadata[key] for key in TEMPLATE_KEYS}
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+轻量级指标采集模块
+提供计数器、仪表、直方图和 Prometheus 文本格式输出，仅依赖标准库，
+供 Django 接口和 TopKLogSystem 共同使用。指标保存在进程内，多进程部署时每个进程各自暴露。
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# 默认耗时分桶（秒），覆盖毫秒级的数据库操作到分钟级的大模型生成
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_labels(label_names: Sequence[str], label_values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    """可增可减的当前值（如排队人数）"""
+
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = float(value)
+
+
+class Histogram:
+    """累积分桶直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        # 每个标签组合：[各桶计数..., +Inf 计数], 总和
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """输出 Prometheus 文本格式（0.0.4）"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "ida_stage_duration_seconds", "聊天链路各阶段耗时（秒）", ["stage"]))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "ida_stage_errors_total", "聊天链路各阶段异常次数", ["stage"]))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "ida_llm_tokens_total", "大模型处理的 token 数（prompt 为预填充，completion 为生成）", ["kind"]))
+RETRIEVAL_HITS = REGISTRY.register(Counter(
+    "ida_retrieval_hits_total", "各检索策略返回的日志条数", ["strategy"]))
+RETRIEVAL_REUSE = REGISTRY.register(Counter(
+    "ida_retrieval_reuse_total", "检索方式（reused 沿用上一轮结果，delta 增量检索，full 完整检索）", ["outcome"]))
+CHAT_REQUESTS = REGISTRY.register(Counter(
+    "ida_chat_requests_total", "聊天请求数", ["outcome"]))
+LLM_ROUTE_LATENCY = REGISTRY.register(Histogram(
+    "ida_llm_route_duration_seconds", "各模型路由的大模型调用耗时（秒）", ["route", "model"]))
+LLM_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "ida_llm_queue_depth", "等待大模型生成名额的请求数"))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ida_llm_in_flight", "正在进行的大模型生成请求数"))
+LLM_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "ida_llm_queue_wait_seconds", "大模型生成请求的排队等待时间（秒）"))
+
+
+@contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    """记录一个阶段的耗时，阶段内抛出异常时同时累计异常次数"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage=stage)
+
+
+def render_metrics() -> str:
+    """输出全部指标的 Prometheus 文本"""
+    return REGISTRY.render()
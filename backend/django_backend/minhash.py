@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+MinHash 签名与 LSH 近似重复检测
+
+日志文本按字符 SHINGLE_SIZE-gram 切片（中文没有空格分词），每个切片用 mmh3 计算一次 32 位哈希，
+再经 NUM_PERM 个 (a*h + b) mod p 置换取最小值得到签名；两个签名相同位置的比例即 Jaccard 相似度的估计。
+LSH 把签名分成 BANDS 段，任一段完全相同的文本才作为候选比较，阈值约为 (1/BANDS)^(1/ROWS)。
+
+签名在入库时计算并写入 metadata（十六进制字符串），检索结果合并时直接比较，旧索引的结果再现算。
+"""
+
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import mmh3
+
+NUM_PERM = 64
+BANDS = 8
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+THRESHOLD = 0.8  # 估计的 Jaccard 相似度达到该值视为近似重复
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_SEED = 20250919
+
+Signature = Tuple[int, ...]
+
+_permutations = None
+
+
+def _perm_params():
+    """固定种子生成的置换参数 (a, b)，a < 2^31 保证 a*h + b 不超出 uint64"""
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+
+        rng = np.random.RandomState(_SEED)
+        _permutations = (rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.uint64),
+                         rng.randint(0, 1 << 31, size=NUM_PERM, dtype=np.uint64))
+    return _permutations
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    text = " ".join(text.lower().split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def signature(text: str) -> Signature:
+    import numpy as np
+
+    a, b = _perm_params()
+    hashes = np.fromiter((mmh3.hash(shingle, signed=False) for shingle in shingles(text)), dtype=np.uint64)
+    values = (a[:, None] * hashes[None, :] + b[:, None]) % _PRIME & _MAX_HASH
+    return tuple(int(v) for v in values.min(axis=1))
+
+
+def similarity(left: Sequence[int], right: Sequence[int]) -> float:
+    """估计的 Jaccard 相似度"""
+    return sum(1 for x, y in zip(left, right) if x == y) / NUM_PERM
+
+
+def encode(sig: Signature) -> str:
+    """写入 metadata 的十六进制字符串（Chroma 的 metadata 只能是标量）"""
+    return "".join(f"{v:08x}" for v in sig)
+
+
+def decode(value: str) -> Signature:
+    return tuple(int(value[i:i + 8], 16) for i in range(0, len(value), 8))
+
+
+class LSHIndex:
+    def __init__(self, threshold: float = THRESHOLD):
+        self.threshold = threshold
+        self._buckets: Dict[Tuple, List[Hashable]] = {}
+        self._signatures: Dict[Hashable, Signature] = {}
+
+    def query(self, sig: Signature, scope: Hashable = None) -> Optional[Hashable]:
+        """返回已加入的、与 sig 近似重复（且 scope 相同）的第一个键，没有时返回 None"""
+        seen = set()
+        for bucket in self._bands(sig, scope):
+            for key in self._buckets.get(bucket, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if similarity(sig, self._signatures[key]) >= self.threshold:
+                    return key
+        return None
+
+    def add(self, key: Hashable, sig: Signature, scope: Hashable = None) -> None:
+        self._signatures[key] = sig
+        for bucket in self._bands(sig, scope):
+            self._buckets.setdefault(bucket, []).append(key)
+
+    @staticmethod
+    def _bands(sig: Signature, scope: Hashable):
+        for band in range(BANDS):
+            yield scope, band, sig[band * ROWS:(band + 1) * ROWS]
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+按对话类型和 prompt 长度选择大模型
+
+故障分析、追问、预防、依赖分析需要较长的推理过程，使用推理模型（如 deepseek-r1:7b）；
+概念解释和一般问答使用响应更快的小模型，并限制生成长度（num_predict）。
+推理模型的回答前有较长的 <think> 推理过程，不限制生成长度，否则推理可能耗尽 token 预算而没有回答；
+未配置快速模型、或快速路由改走推理模型时同样去掉长度限制。
+快速路由的 prompt 超过 max_prompt_chars（检索到大量日志）时改走推理模型，小模型处理长上下文效果较差。
+
+路由的模型调用失败（未拉取、服务异常）时回退到推理模型，并在 FALLBACK_COOLDOWN 秒内不再尝试该模型。
+每次调用按 路由/实际模型 记录耗时（ida_llm_route_duration_seconds），用于调整路由表。
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import LLM_ROUTE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_COOLDOWN = 300  # 调用失败的模型在该时长（秒）内直接回退
+
+# model 为 None 表示推理模型（TopKLogSystem 的 llm），"fast" 表示快速模型；num_predict 只对快速模型生效
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    "fault_analysis": {"model": None, "temperature": 0.1},
+    "follow_up": {"model": None, "temperature": 0.1},
+    "prevention": {"model": None, "temperature": 0.2},
+    "dependency": {"model": None, "temperature": 0.1},
+    "explanation": {"model": "fast", "num_predict": 768, "temperature": 0.3, "max_prompt_chars": 6000},
+    "general_question": {"model": "fast", "num_predict": 512, "temperature": 0.3, "max_prompt_chars": 6000},
+}
+
+
+def prompt_chars(prompt: List) -> int:
+    """prompt 消息的总字符数"""
+    return sum(len(getattr(message, "content", message) or "") for message in prompt)
+
+
+class ModelRouter:
+    def __init__(self, default_model: str, fast_model: Optional[str] = None,
+                 routes: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        default_model: 推理模型，同时也是回退模型
+        fast_model: 快速模型，为空时所有路由都使用推理模型（只保留各路由的生成参数）
+        """
+        self.default_model = default_model
+        self.fast_model = fast_model or None
+        self.routes = routes or DEFAULT_ROUTES
+        self._llms: Dict[Tuple[str, int, float], Any] = {}
+        self._unavailable: Dict[str, float] = {}  # 模型 -> 恢复尝试的时间
+        self._lock = threading.Lock()
+
+    def models(self) -> List[str]:
+        """路由表用到的全部模型"""
+        return sorted({self._model_name(route) for route in self.routes.values()})
+
+    def select(self, conversation_type: str, prompt_size: int = 0) -> Tuple[str, Dict[str, Any]]:
+        """返回 (路由名称, 路由参数)，路由参数中的 model 已解析为实际模型名"""
+        route = self.routes.get(conversation_type) or self.routes["fault_analysis"]
+        name = conversation_type if conversation_type in self.routes else "fault_analysis"
+        model = self._model_name(route)
+
+        if model != self.default_model and prompt_size > route.get("max_prompt_chars", float("inf")):
+            model, name = self.default_model, f"{name}:long_prompt"
+        if model != self.default_model and not self._is_available(model):
+            model, name = self.default_model, f"{name}:fallback"
+        return name, self._resolve(route, model)
+
+    def invoke(self, conversation_type: str, prompt: List, call) -> Any:
+        """
+        按路由选择模型后执行 call(llm)，失败时用推理模型重试一次
+        call 接收 LLM 实例并返回调用结果
+        """
+        name, route = self.select(conversation_type, prompt_chars(prompt))
+        started = time.perf_counter()
+        try:
+            result = call(self.llm_for(route))
+        except Exception as e:
+            if route["model"] == self.default_model:
+                raise
+            logger.warning(f"模型 {route['model']} 调用失败，回退到 {self.default_model}: {e}")
+            self._mark_unavailable(route["model"])
+            name, route = f"{name}:fallback", self._resolve(route, self.default_model)
+            started = time.perf_counter()
+            result = call(self.llm_for(route))
+        LLM_ROUTE_LATENCY.observe(time.perf_counter() - started, route=name, model=route["model"])
+        return result
+
+    def llm_for(self, route: Dict[str, Any]):
+        """按 (模型, num_predict, temperature) 缓存 LLM 实例"""
+        from offline_models import create_llm
+
+        key = (route["model"], route.get("num_predict", -1), route.get("temperature", 0.1))
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is None:
+                kwargs = {"temperature": key[2]}
+                if route.get("num_predict"):
+                    kwargs["num_predict"] = route["num_predict"]
+                llm = self._llms[key] = create_llm(route["model"], **kwargs)
+            return llm
+
+    def _resolve(self, route: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """路由参数中填入实际模型，推理模型不限制生成长度"""
+        resolved = dict(route, model=model)
+        if model == self.default_model:
+            resolved.pop("num_predict", None)
+        return resolved
+
+    def _model_name(self, route: Dict[str, Any]) -> str:
+        if route.get("model") == "fast":
+            return self.fast_model or self.default_model
+        return route.get("model") or self.default_model
+
+    def _is_available(self, model: str) -> bool:
+        with self._lock:
+            retry_at = self._unavailable.get(model)
+            if retry_at is None:
+                return True
+            if time.time() >= retry_at:
+                del self._unavailable[model]
+                return True
+            return False
+
+    def _mark_unavailable(self, model: str) -> None:
+        with self._lock:
+            self._unavailable[model] = time.time() + FALLBACK_COOLDOWN
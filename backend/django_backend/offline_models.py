@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+离线模型替身与模型工厂
+在没有 Ollama 的环境（CI、笔记本）中用确定性的替身模型跑通真实的索引、检索、
+Prompt 和 API 代码，便于做可复现的性能测试。通过环境变量选择后端：
+
+- IDA_EMBEDDING_BACKEND: ollama（默认）| hashing
+- IDA_LLM_BACKEND: ollama（默认）| fake
+- IDA_FAKE_LLM_TOKENS_PER_SECOND / IDA_FAKE_LLM_PREFILL_MS / IDA_FAKE_LLM_MAX_TOKENS: 替身 LLM 的速度参数
+- OLLAMA_HOST: Ollama 服务地址，用于检查模型是否可用
+"""
+
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import time
+import urllib.request
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk, LLMResult
+
+from tracing import start_span
+
+EMBEDDING_BACKEND = os.environ.get("IDA_EMBEDDING_BACKEND", "ollama").lower()
+LLM_BACKEND = os.environ.get("IDA_LLM_BACKEND", "ollama").lower()
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+
+# 中文按单字切分，英文/数字按整词切分，特征再加上相邻 token 组成的二元组
+_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_]+|[\u4e00-\u9fff]')
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    特征哈希嵌入：把词和字的 n-gram 哈希到固定维度并做 L2 归一化
+    结果只由文本决定，词面重合度越高的文本余弦相似度越高，维度默认与 bge-large 一致
+    """
+
+    def __init__(self, dimension: int = 1024, seed: int = 42):
+        self.dimension = dimension
+        self.seed = seed
+        self.model_id = f"hashing-{dimension}-{seed}"
+
+    def _features(self, text: str) -> List[str]:
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        features = list(tokens)
+        features.extend(a + b for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(f"{self.seed}:{feature}".encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dimension] += 1.0 if (value >> 63) & 1 else -1.0
+        norm = float(np.linalg.norm(vector))
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class FakeLLM(LLM):
+    """
+    模拟 deepseek-r1 的替身 LLM
+    按配置的预填充延迟（对数正态分布）和 token 速率 sleep，返回由 prompt 决定的 Markdown 回复，
+    generation_info 的字段与 Ollama 一致，指标和追踪代码无需区分真假模型
+    """
+
+    model: str = "fake-llm"
+    tokens_per_second: float = 30.0
+    prefill_ms: float = 200.0
+    latency_sigma: float = 0.25
+    max_tokens: int = 256
+    emit_reasoning: bool = True
+    seed: int = 42
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ollama"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "tokens_per_second": self.tokens_per_second, "prefill_ms": self.prefill_ms}
+
+    def _rng(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "little"))
+
+    def _reply_tokens(self, prompt: str, rng: random.Random) -> List[str]:
+        words = _TOKEN_PATTERN.findall(prompt)[-40:] or ["日志"]
+        tokens = []
+        if self.emit_reasoning:
+            tokens += ["<think>", "\n"] + [rng.choice(words) for _ in range(self.max_tokens // 4)] + ["\n", "</think>", "\n"]
+        tokens += ["#", " ", "分析", "结果", "\n", "-", " "]
+        while len(tokens) < self.max_tokens:
+            tokens.append(rng.choice(words))
+            tokens.append("\n- " if rng.random() < 0.1 else " ")
+        return tokens[:self.max_tokens]
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        rng = self._rng(prompt)
+        prefill = self.prefill_ms / 1000 * math.exp(rng.gauss(0, self.latency_sigma))
+        started = time.perf_counter()
+        time.sleep(prefill)
+        prefill_done = time.perf_counter()
+
+        tokens = self._reply_tokens(prompt, rng)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for token in tokens:
+            if interval:
+                time.sleep(interval)
+            chunk = GenerationChunk(text=token)
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+        finished = time.perf_counter()
+        yield GenerationChunk(text="", generation_info={
+            "done": True,
+            "model": self.model,
+            "prompt_eval_count": len(_TOKEN_PATTERN.findall(prompt)),
+            "prompt_eval_duration": int((prefill_done - started) * 1e9),
+            "eval_count": len(tokens),
+            "eval_duration": int((finished - prefill_done) * 1e9),
+            "total_duration": int((finished - started) * 1e9),
+        })
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            final_chunk = None
+            for chunk in self._stream(prompt, stop=stop, run_manager=run_manager, **kwargs):
+                final_chunk = chunk if final_chunk is None else final_chunk + chunk
+            generations.append([final_chunk])
+        return LLMResult(generations=generations)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return self._generate([prompt], stop=stop, run_manager=run_manager, **kwargs).generations[0][0].text
+
+
+class TracedEmbeddings(Embeddings):
+    """
+    在链路追踪 span（ollama.embed）中执行嵌入调用，覆盖构建索引、检索时的问题向量和会话记忆
+    model_id 与被包装的模型一致，不影响索引 collection 和会话向量的模型标识
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.model_id = embedding_model_id(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with start_span("ollama.embed", model=self.model_id, input="documents", texts=len(texts),
+                        chars=sum(len(text) for text in texts)):
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with start_span("ollama.embed", model=self.model_id, input="query", texts=1, chars=len(text)):
+            return self.embeddings.embed_query(text)
+
+
+def create_embedding_model(model: str):
+    """按 IDA_EMBEDDING_BACKEND 创建嵌入模型"""
+    if EMBEDDING_BACKEND == "hashing":
+        return TracedEmbeddings(HashingEmbeddings(dimension=int(os.environ.get("IDA_HASHING_EMBEDDING_DIM", "1024"))))
+    from langchain_ollama import OllamaEmbeddings
+    return TracedEmbeddings(OllamaEmbeddings(model=model))
+
+
+def create_llm(model: str, **kwargs):
+    """按 IDA_LLM_BACKEND 创建 LLM，kwargs 透传给 OllamaLLM"""
+    if LLM_BACKEND == "fake":
+        max_tokens = int(os.environ.get("IDA_FAKE_LLM_MAX_TOKENS", "256"))
+        if kwargs.get("num_predict"):
+            max_tokens = min(max_tokens, kwargs["num_predict"])
+        return FakeLLM(
+            model=f"fake-{model}",
+            tokens_per_second=float(os.environ.get("IDA_FAKE_LLM_TOKENS_PER_SECOND", "30")),
+            prefill_ms=float(os.environ.get("IDA_FAKE_LLM_PREFILL_MS", "200")),
+            max_tokens=max_tokens,
+        )
+    from langchain_ollama import OllamaLLM
+    return OllamaLLM(model=model, **kwargs)
+
+
+def embedding_model_id(embedding_model) -> str:
+    """嵌入模型标识，用于区分不同嵌入模型构建的索引"""
+    return getattr(embedding_model, "model_id", None) or getattr(embedding_model, "model", "unknown")
+
+
+def _ollama_models(timeout: float) -> set:
+    """Ollama 已拉取的模型名称，服务不可达时返回空集合"""
+    host = OLLAMA_HOST if OLLAMA_HOST.startswith("http") else f"http://{OLLAMA_HOST}"
+    try:
+        with urllib.request.urlopen(f"{host.rstrip('/')}/api/tags", timeout=timeout) as resp:
+            return {m["name"] for m in json.load(resp).get("models", [])}
+    except (OSError, ValueError):
+        return set()
+
+
+def check_model_availability(llm: str, embedding_model: str, timeout: float = 2.0) -> Dict[str, Any]:
+    """检查模型是否可用：替身模型总是可用，Ollama 模型需已拉取"""
+    pulled = None
+
+    def _available(name: str) -> bool:
+        nonlocal pulled
+        if pulled is None:
+            pulled = _ollama_models(timeout)
+        return name in pulled or f"{name}:latest" in pulled
+
+    return {
+        "llm": {"name": llm, "backend": LLM_BACKEND,
+                "available": LLM_BACKEND == "fake" or _available(llm)},
+        "embedding": {"name": embedding_model, "backend": EMBEDDING_BACKEND,
+                      "available": EMBEDDING_BACKEND == "hashing" or _available(embedding_model)},
+    }
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+deepseek-r1 推理过程（<think>...</think>）与最终回答的分离
+
+ThinkStreamParser 按生成的 token 增量解析，标签被拆在多个 token 中也能正确识别；
+解析结果分为 reasoning（推理过程）和 answer（最终回答）两个通道，
+回答中不再包含推理文本，不会进入缓存、会话上下文和后续 prompt。
+
+部分 Ollama 模板会把 <think> 放在 prompt 末尾，输出只有结尾的 </think>；
+这种情况下在遇到 </think> 时把此前的全部输出改记为推理过程（已流式输出的回答增量无法撤回，以 answer 属性为准）。
+"""
+
+import re
+import time
+from typing import Optional, Tuple
+
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
+_THINK_BLOCK = re.compile(r"<think>.*?(?:</think>|$)\s*", re.DOTALL)
+
+_BEFORE, _REASONING, _ANSWER = "before", "reasoning", "answer"
+
+
+class EmptyAnswer(Exception):
+    """生成结束时没有最终回答（推理过程未闭合或被截断），这样的回答不应缓存或写入会话历史"""
+
+    def __init__(self, truncated: bool):
+        self.truncated = truncated
+        super().__init__("推理过程未结束即停止生成，没有得到回答" if truncated else "模型没有生成回答")
+
+
+class ThinkStreamParser:
+    def __init__(self):
+        self._state = _BEFORE
+        self._buffer = ""  # 可能是标签前缀、暂不能确定归属的尾部文本
+        self._reasoning = []
+        self._answer = []
+        self._saw_open = False
+        self.truncated = False  # 生成结束时推理过程仍未闭合
+        self.reasoning_tokens = 0
+        self.started_at: Optional[float] = None
+        self.answer_started_at: Optional[float] = None
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self._reasoning).strip()
+
+    @property
+    def answer(self) -> str:
+        return "".join(self._answer).strip()
+
+    @property
+    def reasoning_seconds(self) -> Optional[float]:
+        """从第一个 token 到推理结束的耗时，没有推理过程时为 None"""
+        if self.started_at is None or self.answer_started_at is None or not self._reasoning:
+            return None
+        return self.answer_started_at - self.started_at
+
+    def feed(self, text: str) -> Tuple[str, str]:
+        """输入一段生成文本，返回本次可以确定的 (推理增量, 回答增量)"""
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+        if self._state == _REASONING:
+            self.reasoning_tokens += 1
+        data = self._buffer + text
+        self._buffer = ""
+        reasoning, answer = [], []
+
+        while data:
+            if self._state == _BEFORE:
+                stripped = data.lstrip()
+                if not stripped:
+                    return "", ""
+                if stripped.startswith(OPEN_TAG):
+                    self._state, self._saw_open = _REASONING, True
+                    data = stripped[len(OPEN_TAG):]
+                    continue
+                if OPEN_TAG.startswith(stripped):
+                    self._buffer = data  # 可能是被拆开的 <think>
+                    return "", ""
+                self._state = _ANSWER
+                self.answer_started_at = time.perf_counter()
+                continue
+
+            tag = CLOSE_TAG
+            index = data.find(tag)
+            if index >= 0:
+                if self._state == _REASONING:
+                    reasoning.append(data[:index])
+                    self._state = _ANSWER
+                    self.answer_started_at = time.perf_counter()
+                elif not self._saw_open and not reasoning and not "".join(self._reasoning):
+                    # 没有开头标签：此前输出的全部内容都是推理过程
+                    self._reasoning.extend(self._answer)
+                    self._answer.clear()
+                    reasoning.extend(answer + [data[:index]])
+                    answer.clear()
+                    self.answer_started_at = time.perf_counter()
+                else:
+                    answer.append(data[:index + len(tag)])
+                data = data[index + len(tag):]
+                continue
+
+            keep = _partial_suffix(data, tag)
+            emitted, self._buffer = data[:len(data) - keep], data[len(data) - keep:]
+            (reasoning if self._state == _REASONING else answer).append(emitted)
+            data = ""
+
+        reasoning_delta, answer_delta = "".join(reasoning), "".join(answer)
+        self._reasoning.append(reasoning_delta)
+        self._answer.append(answer_delta)
+        return reasoning_delta, answer_delta
+
+    def close(self) -> Tuple[str, str]:
+        """生成结束，输出缓冲中剩余的文本；推理过程未闭合时全部计为推理"""
+        data, self._buffer = self._buffer, ""
+        if self._state == _REASONING:
+            self.truncated = True
+            self._reasoning.append(data)
+            return data, ""
+        self._answer.append(data)
+        return "", data
+
+
+def _partial_suffix(text: str, tag: str) -> int:
+    """text 末尾与 tag 前缀重合的最大长度"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+def split_reasoning(text: str) -> Tuple[str, str]:
+    """把完整的生成文本拆分为 (推理过程, 最终回答)"""
+    parser = ThinkStreamParser()
+    parser.feed(text)
+    parser.close()
+    return parser.reasoning, parser.answer
+
+
+def strip_reasoning(text: str) -> str:
+    """去掉文本中残留的 <think> 块（如旧版本缓存的回答）"""
+    if OPEN_TAG not in text:
+        return text
+    return _THINK_BLOCK.sub("", text)
@@ -7,121 +7,221 @@ os.environ["CHROMA_TELEMETRY_ENABLED"] = "false"
 
 import json
 import logging
-import pandas as pd
-import re
-from typing import Any, Dict, List
-from enum import Enum
-
-# langchain
-from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
-from langchain_ollama import OllamaLLM, OllamaEmbeddings
-
-# llama-index & chroma
-import chromadb
-from llama_index.core import Settings  # 全局
-from llama_index.core import Document
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext
-from llama_index.vector_stores.chroma import ChromaVectorStore  # 注意导入路径
-
-# 导入领域知识
-from domain_knowledge import (
-    get_error_code_meaning, 
-    get_service_dependencies, 
-    get_fault_category,
-    get_severity_level,
-    get_common_pattern_info,
-    get_monitoring_recommendations,
-    get_expert_insights,
-    get_industry_standards,
-    get_best_practices,
-    FAULT_CATEGORIES,
-    COMMON_PATTERNS
-)
+from contextlib import nullcontext
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+# langchain、llama-index、chromadb、pandas 导入耗时数秒，均在首次使用时再导入，
+# 对话类型识别、关键词提取、领域知识上下文等轻量逻辑见 log_analysis
+import log_analysis
+import minhash
+from log_analysis import ConversationType
+from log_store import COLUMNS as LOG_TABLE_COLUMNS, LogStatistics, LogStore
+from log_templates import TEMPLATE_KEYS, LogTemplate, TemplateMiner, template_info
+
+from metrics import observe_stage, STAGE_LATENCY, LLM_TOKENS, RETRIEVAL_HITS, RETRIEVAL_REUSE
+from model_routing import ModelRouter
+from reasoning import EmptyAnswer, ThinkStreamParser
+from tracing import current_span, start_span, traced
 
 # 日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class ConversationType(Enum):
-    """对话类型枚举"""
-    FAULT_ANALYSIS = "fault_analysis"        # 故障分析（Markdown格式）
-    GENERAL_QUESTION = "general_question"    # 一般问题（Markdown格式）
-    FOLLOW_UP_QUESTION = "follow_up"         # 跟进问题（Markdown格式）
-    EXPLANATION_REQUEST = "explanation"       # 解释请求（Markdown格式）
-    PREVENTION_QUESTION = "prevention"       # 预防措施（Markdown格式）
-    DEPENDENCY_QUESTION = "dependency"       # 依赖关系（Markdown格式）
-
-
 class TopKLogSystem:
     def __init__(
             self,
             log_path: str,
             llm: str,
             embedding_model: str,
+            vector_store_path: str = "./data/vector_stores",
+            build_index: bool = True,
+            fast_llm: Optional[str] = None,
     ) -> None:
-        # init models
-        self.embedding_model = OllamaEmbeddings(model=embedding_model)
+        from llama_index.core import Settings  # 全局
+        from offline_models import create_embedding_model, create_llm
+
+        # init models（可通过 IDA_EMBEDDING_BACKEND / IDA_LLM_BACKEND 切换为离线替身）
+        self.embedding_model = create_embedding_model(embedding_model)
 
-        self.llm = OllamaLLM(model=llm, temperature=0.1)
+        self.llm = create_llm(llm, temperature=0.1)
+        # 生成时按对话类型选择模型，fast_llm 为空时全部使用 llm
+        self.router = ModelRouter(llm, fast_llm)
 
         # init database
         Settings.llm = self.llm
         Settings.embed_model = self.embedding_model  # 全局设置
 
         self.log_path = log_path
+        self.vector_store_path = vector_store_path
         self.log_index = None
         self.vector_store = None
-        self._build_vectorstore()  # 直接构建
+        self.log_collection = None
+        self.index_generation = None  # 当前加载的索引代，用于区分索引版本
+        self.log_store: Optional[LogStore] = None  # 全部日志行的分类列，用于精确统计
+        self.log_statistics: Optional[LogStatistics] = None  # 入库时累加的计数和共现矩阵
+        if build_index:  # build_index=False 时由调用方稍后调用 load_index()（如后台预热）
+            self._build_vectorstore()
+
+    def load_index(self) -> None:
+        """加载或构建向量索引，完成前 retrieve_logs 返回空结果"""
+        self._build_vectorstore()
+
+    @property
+    def index_ready(self) -> bool:
+        return self.log_index is not None
+
+    def document_count(self) -> int:
+        """向量库中的日志条数"""
+        return self.log_collection.count() if self.log_collection is not None else 0
+
+    def warm_up_llm(self) -> None:
+        """对路由表用到的每个模型发送一次极短的生成请求，让 Ollama 提前把模型加载进内存"""
+        for model in self.router.models():
+            llm = self.router.llm_for({"model": model, "num_predict": 1})
+            try:
+                llm.invoke("你好")
+            except Exception as e:
+                if model == self.router.default_model:
+                    raise
+                logger.warning(f"模型 {model} 预热失败: {e}")
 
     # 加载数据并构建索引
     def _build_vectorstore(self):
-        vector_store_path = "./data/vector_stores"
-        os.makedirs(vector_store_path, exist_ok=True)  # exist_ok=True 目录存在时不报错
+        """
+        加载当前发布的索引；尚无可用索引时，由持有构建锁的一个进程构建新一代并发布，
+        其他进程等待发布后直接加载（等待期间 log_index 为空，调用方按降级模式服务）
+        """
+        from index_store import IndexStore
+
+        store = IndexStore(self.vector_store_path)
+        while True:
+            current = store.current_generation()
+            path = store.current_path()
+            if path and self._open_index(path):
+                self.index_generation = current or "legacy"
+                return
 
-        chroma_client = chromadb.PersistentClient(path=vector_store_path)  # chromadb 持久化
+            if not store.try_lock():
+                logger.info("其他进程正在构建日志索引，等待其发布")
+                store.wait_for_publish(current)
+                continue
+
+            try:
+                if store.current_generation() != current:
+                    continue  # 获取锁之前已有其他进程发布了新索引，重新加载
+                self._build_generation(store)
+                return
+            finally:
+                store.release_lock()
+
+    def rebuild_index(self) -> Optional[str]:
+        """强制构建新一代索引并发布（等待构建锁），返回新代名称；正在服务的进程重启或重新加载后生效"""
+        from index_store import IndexStore
+
+        store = IndexStore(self.vector_store_path)
+        store.try_lock(timeout=-1)
+        try:
+            return self._build_generation(store)
+        finally:
+            store.release_lock()
+
+    def _chroma_storage(self, path: str):
+        import chromadb
+        from llama_index.core import StorageContext
+        from llama_index.vector_stores.chroma import ChromaVectorStore  # 注意导入路径
+
+        chroma_client = chromadb.PersistentClient(path=path)  # chromadb 持久化
 
         # ChromaVectorStore 将 collection 与 store 绑定
         # 也是将 Chroma 包装为 llama-index 的接口
         # StorageContext存储上下文， 包含 Vector Store、Document Store、Index Store 等
-        log_collection = chroma_client.get_or_create_collection("log_collection")
-
-        # 构建 log 库 index
+        log_collection = chroma_client.get_or_create_collection(self._collection_name())
         log_vector_store = ChromaVectorStore(chroma_collection=log_collection)
         log_storage_context = StorageContext.from_defaults(vector_store=log_vector_store)
-        
-        # 检查是否已经存在索引
+        return log_collection, log_vector_store, log_storage_context
+
+    def _open_index(self, path: str) -> bool:
+        """从已发布的目录加载索引，目录中没有数据或加载失败时返回 False"""
+        from llama_index.core import VectorStoreIndex
+
         try:
-            # 尝试从现有存储加载索引
-            if log_collection.count() > 0:
-                logger.info(f"发现现有索引，包含 {log_collection.count()} 条记录")
-                self.log_index = VectorStoreIndex.from_vector_store(
-                    log_vector_store,
-                    storage_context=log_storage_context,
-                    show_progress=True,
-                )
-                logger.info("成功加载现有日志库索引")
-                return
+            log_collection, log_vector_store, log_storage_context = self._chroma_storage(path)
+            if log_collection.count() == 0:
+                return False
+            logger.info(f"发现现有索引，包含 {log_collection.count()} 条记录")
+            self.log_index = VectorStoreIndex.from_vector_store(
+                log_vector_store,
+                storage_context=log_storage_context,
+                show_progress=True,
+            )
+            self.log_collection = log_collection
+            self.log_store = LogStore.load(path)
+            self.log_statistics = LogStatistics.load(path, self.log_store)
+            logger.info("成功加载现有日志库索引")
+            return True
         except Exception as e:
             logger.warning(f"加载现有索引失败: {e}，将重新构建")
-        
-        # 如果不存在索引或加载失败，重新构建
-        if log_documents := self._load_documents(self.log_path):
-            self.log_index = VectorStoreIndex.from_documents(
+            return False
+
+    def _build_generation(self, store) -> Optional[str]:
+        """在新的代目录中构建索引并发布（调用方需持有构建锁），没有可用日志时不发布"""
+        from llama_index.core import VectorStoreIndex
+
+        tables = []
+        log_documents = self._load_documents(self.log_path, tables)
+        if not log_documents:
+            return None
+        log_store = LogStore.from_frames(tables)
+        log_statistics = LogStatistics()
+        for table in tables:
+            log_statistics.update(table)
+
+        name = store.new_generation()
+        try:
+            log_collection, _, log_storage_context = self._chroma_storage(store.path_of(name))
+            log_index = VectorStoreIndex.from_documents(
                 log_documents,
                 storage_context=log_storage_context,
                 show_progress=True,
             )
-            logger.info(f"日志库索引构建完成，共 {len(log_documents)} 条日志")
+            if log_store is not None:
+                log_store.save(store.path_of(name))
+                log_statistics.save(store.path_of(name))
+        except Exception:
+            store.discard(name)
+            raise
+        store.publish(name)
+        logger.info(f"日志库索引构建完成，共 {len(log_documents)} 条日志（{name}）")
+
+        self.log_index = log_index
+        self.log_collection = log_collection
+        self.log_store = log_store
+        self.log_statistics = log_statistics if log_store is not None else None
+        self.index_generation = name
+        return name
+
+    def _collection_name(self) -> str:
+        """不同嵌入模型的向量不能混用，离线替身模型使用独立的 collection"""
+        from offline_models import embedding_model_id
+        model_id = embedding_model_id(self.embedding_model)
+        if model_id.startswith("hashing"):
+            return f"log_collection_{model_id}"
+        return "log_collection"
 
     @staticmethod
     # 加载文档数据
-    def _load_documents(data_path: str) -> List[Document]:
+    def _load_documents(data_path: str, tables: Optional[List] = None) -> List["Document"]:
+        """tables 不为 None 时，CSV 各分块另外追加到其中（用于构建日志表）"""
+        import pandas as pd
+        from llama_index.core import Document
+
         if not os.path.exists(data_path):
             logger.warning(f"数据路径不存在: {data_path}")
             return []
 
-        documents = []
+        # 只有参数不同的重复日志归并为一个模板，每个模板生成一个向量
+        miner = TemplateMiner()
         for file in os.listdir(data_path):
             ext = os.path.splitext(file)[1]
             if ext not in [".txt", ".md", ".json", ".jsonl", ".csv"]:
@@ -132,18 +232,61 @@ class TopKLogSystem:
                 if ext == ".csv":  # utf-8 的 csv
                     # 大型 csv 分块进行读取
                     chunk_size = 1000  # 每次读取1000行
+                    line = 1  # 表头
                     for chunk in pd.read_csv(file_path, chunksize=chunk_size):
+                        if tables is not None:
+                            tables.append(chunk.filter(items=list(LOG_TABLE_COLUMNS)))
                         for row in chunk.itertuples(index=False):  # 无行号
-                            content = str(row).replace("Pandas", " ")
-                            documents.append(Document(text=content))
+                            line += 1
+                            miner.add_row(dict(zip(chunk.columns, row)), f"{file}:{line}",
+                                          str(row).replace("Pandas", " "))
                 else:  # .txt or .md, .json
                     with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        doc = Document(text=content, )
-                        documents.append(doc)
+                        miner.add_document(f.read(), file)
             except Exception as e:
                 logger.error(f"加载文档失败 {file_path}: {e}")
-        return documents
+        templates = miner.templates()
+        if not templates:
+            return []
+        templates, signatures = TopKLogSystem._collapse_near_duplicates(templates)
+        logger.info(f"日志模板归并：{miner.rows} 条日志 -> {len(templates)} 个模板")
+
+        # 日志级别、错误码、服务名和信息价值在入库时批量提取一次，写入 metadata 随检索结果返回；
+        # 这些字段和模板统计不参与向量计算，也不拼入发给大模型的文本
+        texts = [template.text for template in templates]
+        features = log_analysis.extract_features(pd.Series(texts))
+        excluded_keys = log_analysis.FEATURE_KEYS + TEMPLATE_KEYS + ["minhash"]
+        return [
+            Document(
+                text=text,
+                metadata={**log_analysis.features_to_metadata(*feature), **template.metadata(),
+                          "minhash": minhash.encode(signature)},
+                excluded_embed_metadata_keys=excluded_keys,
+                excluded_llm_metadata_keys=excluded_keys,
+            )
+            for text, template, signature, feature in zip(
+                texts, templates, signatures, features[log_analysis.FEATURE_KEYS].itertuples(index=False))
+        ]
+
+    @staticmethod
+    def _collapse_near_duplicates(templates: List[LogTemplate]) -> Tuple[List[LogTemplate], List[tuple]]:
+        """
+        模板挖掘只能归并 token 数相同的日志，这里再用 MinHash 把分类列相同、文本近似重复的模板并入先出现的一个
+        返回保留的模板及其签名
+        """
+        lsh = minhash.LSHIndex()
+        kept, signatures = [], []
+        for template in templates:
+            signature = minhash.signature(template.text)
+            if template.columns is not None:
+                duplicate = lsh.query(signature, scope=template.key)
+                if duplicate is not None:
+                    kept[duplicate].absorb(template)
+                    continue
+                lsh.add(len(kept), signature, scope=template.key)
+            kept.append(template)
+            signatures.append(signature)
+        return kept, signatures
 
         # 检索相关日志
 
@@ -154,24 +297,37 @@ class TopKLogSystem:
         if not self.log_index:
             return []
 
-        try:
-            # 策略1: 语义相似度检索
-            semantic_results = self._semantic_retrieval(query, top_k)
-            
-            # 策略2: 关键词精确匹配
-            keyword_results = self._keyword_retrieval(query, top_k)
-            
-            # 策略3: 错误码匹配
-            error_code_results = self._error_code_retrieval(query, top_k)
-            
-            # 合并和去重结果
-            all_results = semantic_results + keyword_results + error_code_results
-            filtered_results = self._deduplicate_and_rank(all_results, top_k)
-            
-            return filtered_results
-        except Exception as e:
-            logger.error(f"日志检索失败: {e}")
-            return []
+        with start_span("TopKLogSystem.retrieve_logs", top_k=top_k) as span:
+            try:
+                # 策略1: 语义相似度检索
+                semantic_results = self._run_strategy("semantic", self._semantic_retrieval, query, top_k)
+                
+                # 策略2: 关键词精确匹配
+                keyword_results = self._run_strategy("keyword", self._keyword_retrieval, query, top_k)
+                
+                # 策略3: 错误码匹配
+                error_code_results = self._run_strategy("error_code", self._error_code_retrieval, query, top_k)
+                
+                # 合并和去重结果
+                with observe_stage("retrieval.rank"):
+                    all_results = semantic_results + keyword_results + error_code_results
+                    filtered_results = self._deduplicate_and_rank(all_results, top_k)
+                
+                span.set_attribute("retrieval.candidates", len(all_results))
+                span.set_attribute("retrieval.hits", len(filtered_results))
+                return filtered_results
+            except Exception as e:
+                logger.error(f"日志检索失败: {e}")
+                span.record_exception(e)
+                return []
+
+    def _run_strategy(self, name: str, strategy, query: str, top_k: int) -> List[Dict]:
+        """执行单个检索策略，记录耗时、命中数和子 span"""
+        with start_span(f"retrieval.{name}", top_k=top_k) as span, observe_stage(f"retrieval.{name}"):
+            results = strategy(query, top_k)
+            span.set_attribute("retrieval.hits", len(results))
+        RETRIEVAL_HITS.inc(len(results), strategy=name)
+        return results
 
     def _semantic_retrieval(self, query: str, top_k: int) -> List[Dict]:
         """语义相似度检索"""
@@ -182,9 +338,11 @@ class TopKLogSystem:
             formatted_results = []
             for result in results:
                 formatted_results.append({
+                    "id": result.node_id,
                     "content": result.text,
                     "score": result.score,
-                    "retrieval_method": "semantic"
+                    "retrieval_method": "semantic",
+                    **self._result_metadata(result),
                 })
             return formatted_results
         except Exception as e:
@@ -210,9 +368,11 @@ class TopKLogSystem:
                 keyword_score = self._calculate_keyword_score(result.text, keywords)
                 if keyword_score > 0.3:  # 关键词匹配阈值
                     formatted_results.append({
+                        "id": result.node_id,
                         "content": result.text,
                         "score": keyword_score,
-                        "retrieval_method": "keyword"
+                        "retrieval_method": "keyword",
+                        **self._result_metadata(result),
                     })
             return formatted_results
         except Exception as e:
@@ -237,51 +397,70 @@ class TopKLogSystem:
                 # 检查是否包含错误码
                 if any(code in result.text for code in error_codes):
                     formatted_results.append({
+                        "id": result.node_id,
                         "content": result.text,
                         "score": 1.0,  # 精确匹配给最高分
-                        "retrieval_method": "error_code"
+                        "retrieval_method": "error_code",
+                        **self._result_metadata(result),
                     })
             return formatted_results
         except Exception as e:
             logger.error(f"错误码检索失败: {e}")
             return []
 
-    def _extract_keywords(self, query: str) -> List[str]:
-        """提取查询关键词"""
-        import re
-        # 提取中文和英文关键词
-        keywords = []
-        
-        # 提取中文词汇（2-4个字符）
-        chinese_words = re.findall(r'[\u4e00-\u9fff]{2,4}', query)
-        keywords.extend(chinese_words)
-        
-        # 提取英文词汇（3个字符以上）
-        english_words = re.findall(r'\b[A-Za-z]{3,}\b', query)
-        keywords.extend(english_words)
-        
-        # 提取技术术语
-        tech_terms = ['数据库', '连接池', '认证', '支付', '库存', '订单', '用户', '服务']
-        for term in tech_terms:
-            if term in query:
-                keywords.append(term)
-        
-        return list(set(keywords))  # 去重
-
-    def _calculate_keyword_score(self, text: str, keywords: List[str]) -> float:
-        """计算关键词匹配分数"""
-        if not keywords:
-            return 0.0
-        
-        matches = 0
-        for keyword in keywords:
-            if keyword.lower() in text.lower():
-                matches += 1
-        
-        return matches / len(keywords)
+    @staticmethod
+    def _result_metadata(result) -> Dict:
+        """检索结果中入库时写入的日志特征和模板统计"""
+        fields = {**log_analysis.features_from_metadata(result.metadata), **template_info(result.metadata)}
+        if result.metadata and "minhash" in result.metadata:
+            fields["minhash"] = result.metadata["minhash"]
+        return fields
+
+    def _reuse_retrieval(self, query: str, previous: Dict, top_k: int) -> List[Dict]:
+        """
+        跟进问题的检索：沿用上一轮的检索结果，只对本轮新出现的错误码、服务名做增量检索
+        previous 为上一轮的检索状态（见 _retrieval_state）
+        """
+        with start_span("TopKLogSystem.reuse_retrieval", top_k=top_k) as span:
+            new_codes = sorted(set(self._extract_error_codes(query)) - set(previous["error_codes"]))
+            new_services = sorted(set(self._extract_services(query)) - set(previous["services"]))
+            span.set_attribute("retrieval.delta", bool(new_codes or new_services))
+            if not new_codes and not new_services:
+                RETRIEVAL_REUSE.inc(outcome="reused")
+                return list(previous["logs"])
+
+            delta = []
+            if new_codes:
+                delta += self._run_strategy("error_code", self._error_code_retrieval, " ".join(new_codes), top_k)
+            if new_services:
+                delta += self._run_strategy("semantic", self._semantic_retrieval, " ".join(new_services), top_k)
+            RETRIEVAL_REUSE.inc(outcome="delta")
+            with observe_stage("retrieval.rank"):
+                return self._deduplicate_and_rank(delta + list(previous["logs"]), top_k)
+
+    def _retrieval_state(self, query: str, logs: List[Dict], previous: Optional[Dict] = None) -> Dict:
+        """
+        本轮的检索状态，由调用方按会话保存，下一轮跟进问题时传回 generate_response
+        包含索引代、检索到的日志及其 ID，以及查询和日志中出现过的错误码、服务名
+        """
+        error_codes = set(previous["error_codes"]) if previous else set()
+        services = set(previous["services"]) if previous else set()
+        error_codes.update(self._extract_error_codes(query))
+        services.update(self._extract_services(query))
+        for log in logs:
+            _, log_error_codes, log_services, _ = log_analysis.log_features(log)
+            error_codes.update(log_error_codes)
+            services.update(log_services)
+        return {
+            "generation": self.index_generation,
+            "log_ids": [log.get("id") for log in logs],
+            "logs": logs,
+            "error_codes": sorted(error_codes),
+            "services": sorted(services),
+        }
 
     def _deduplicate_and_rank(self, all_results: List[Dict], top_k: int) -> List[Dict]:
-        """去重和排序结果"""
+        """去重和排序结果：内容相同的直接去掉，近似重复（MinHash 估计的相似度达到阈值）的只保留分数最高的一条"""
         # 按内容去重
         seen_contents = set()
         unique_results = []
@@ -294,127 +473,193 @@ class TopKLogSystem:
         
         # 按分数排序
         unique_results.sort(key=lambda x: x["score"], reverse=True)
+
+        # 近似重复的结果并入分数更高的一条，出现次数累加，prompt 中能容纳更多不同的日志
+        # 与入库时一样只在级别、错误码、服务都相同的结果之间合并，不同服务的相似日志不会并在一起
+        lsh = minhash.LSHIndex()
+        distinct_results = []
+        for result in unique_results:
+            signature = (minhash.decode(result["minhash"]) if "minhash" in result
+                         else minhash.signature(result["content"]))
+            log_level, error_codes, services, _ = log_analysis.log_features(result)
+            scope = (log_level, tuple(sorted(error_codes)), tuple(sorted(services)))
+            duplicate = lsh.query(signature, scope=scope)
+            if duplicate is not None:
+                kept = distinct_results[duplicate]
+                distinct_results[duplicate] = dict(
+                    kept, occurrences=kept.get("occurrences", 1) + result.get("occurrences", 1))
+                continue
+            lsh.add(len(distinct_results), signature, scope=scope)
+            distinct_results.append(result)
         
         # 返回前top_k个结果
-        return unique_results[:top_k]
+        return distinct_results[:top_k]
+
+    # 轻量分析逻辑实现在 log_analysis 中，这里保留原有的方法名
+    detect_conversation_type = staticmethod(log_analysis.detect_conversation_type)
+    _extract_keywords = staticmethod(log_analysis.extract_keywords)
+    _calculate_keyword_score = staticmethod(log_analysis.calculate_keyword_score)
+    _extract_log_level = staticmethod(log_analysis.extract_log_level)
+    _extract_error_codes = staticmethod(log_analysis.extract_error_codes)
+    _extract_services = staticmethod(log_analysis.extract_services)
+    _calculate_information_value = staticmethod(log_analysis.calculate_information_value)
+
+    def _build_domain_context(self, context) -> str:
+        """领域知识上下文，附带检索到的错误码、服务在全部日志中的统计"""
+        return log_analysis.build_domain_context(context, self.log_statistics)
 
-    def detect_conversation_type(self, query: str, context: str = "") -> ConversationType:
+    @traced("TopKLogSystem.generate_response")
+    def generate_response(self, query: str, context: Dict,
+                          llm_slot: Optional[Callable[[], ContextManager]] = None) -> str:
         """
-        识别对话类型
+        生成响应，支持对话类型识别
         
         Args:
-            query: 用户当前查询
-            context: 对话历史上下文
+            query: 用户查询
+            context: 上下文信息（包含对话历史和可选的上一轮 retrieval_state），
+                生成后写入 logs（检索结果）、retrieval_state（本轮检索状态）和 reasoning（推理过程）
+            llm_slot: 可选，返回上下文管理器的函数（如 LLM_SCHEDULER.slot），只包住大模型调用，
+                检索和构建 Prompt 不占用生成名额；进入时抛出的异常（如 QueueFull）直接交给调用方
             
         Returns:
-            ConversationType: 识别出的对话类型
+            str: LLM响应（不含推理过程）
         """
-        query_lower = query.lower()
-        context_lower = context.lower()
-        
-        # 1. 故障分析类问题（优先级最高，包含错误码的查询）
-        fault_keywords = [
-            "错误", "故障", "异常", "失败", "error", "fatal", "exception", 
-            "报错", "出错", "问题", "bug", "issue", "crash", "down"
-        ]
-        
-        # 检查是否包含错误码模式（如：Alatest97, ERROR, FATAL等）
-        error_code_patterns = [
-            r'[A-Za-z]+\d+',  # 如 Alatest97
-            r'\b(ERROR|FATAL|WARN|INFO|DEBUG)\b',  # 日志级别
-            r'\b[A-Z_]+\b'  # 大写错误码
-        ]
-        
-        has_error_code = any(re.search(pattern, query) for pattern in error_code_patterns)
-        
-        if has_error_code or any(keyword in query_lower for keyword in fault_keywords):
-            # 如果是第一轮对话或上下文很短，认为是故障分析
-            if len(context) < 100 or not context.strip():
-                return ConversationType.FAULT_ANALYSIS
-            else:
-                # 有历史对话，认为是跟进问题
-                return ConversationType.FOLLOW_UP_QUESTION
-        
-        # 2. 预防措施类问题（优先级第二）
-        prevention_keywords = [
-            "预防", "避免", "防止", "如何避免", "怎么预防", "预防措施",
-            "避免", "防范", "预防性", "proactive", "prevention", "avoid"
-        ]
-        
-        if any(keyword in query_lower for keyword in prevention_keywords):
-            return ConversationType.PREVENTION_QUESTION
-        
-        # 3. 解释类问题（优先级第三）
-        explanation_keywords = [
-            "是什么", "为什么", "什么意思", "解释", "说明", "这个", "这个错误"
-        ]
-        
-        # 特殊处理：如果包含"是什么"、"为什么"等，优先判断为解释请求
-        if any(keyword in query_lower for keyword in explanation_keywords):
-            return ConversationType.EXPLANATION_REQUEST
-        
-        # 4. 依赖关系类问题（优先级第四）
-        dependency_keywords = [
-            "依赖", "关系", "调用", "服务", "依赖关系", "调用链", "依赖链",
-            "关联", "连接", "dependencies", "relationship", "call", "service"
-        ]
-        
-        # 特殊处理：避免"数据库连接"被误判为依赖关系
-        if any(keyword in query_lower for keyword in dependency_keywords):
-            # 排除故障相关词汇
-            if not any(keyword in query_lower for keyword in ["失败", "错误", "异常", "故障"]):
-                return ConversationType.DEPENDENCY_QUESTION
-        
-        # 5. 基于上下文的判断
-        if context:
-            # 如果上下文包含故障分析相关内容，可能是跟进问题
-            if any(keyword in context_lower for keyword in fault_keywords):
-                return ConversationType.FOLLOW_UP_QUESTION
-            
-            # 如果上下文包含预防相关内容，可能是预防问题
-            if any(keyword in context_lower for keyword in prevention_keywords):
-                return ConversationType.PREVENTION_QUESTION
-        
-        # 6. 特殊处理：包含"如何"或"怎么"但不是预防措施
-        if any(keyword in query_lower for keyword in ["如何", "怎么"]):
-            # 检查是否包含预防相关词汇
-            if not any(keyword in query_lower for keyword in ["预防", "避免", "防止"]):
-                return ConversationType.EXPLANATION_REQUEST
-        
-        # 7. 默认情况
-        return ConversationType.GENERAL_QUESTION
+        prompt, conversation_type = self.prepare_response(query, context)
+        if prompt is None:
+            return context['answer']
 
-    def generate_response(self, query: str, context: Dict) -> str:
+        with llm_slot() if llm_slot else nullcontext():
+            try:
+                return self.complete_response(prompt, conversation_type, context)
+            except EmptyAnswer:
+                raise  # 空回答交给调用方处理，不能当作回答缓存或写入历史
+            except Exception as e:
+                logger.error(f"LLM调用失败: {e}")
+                return f"生成响应时出错: {str(e)}"
+
+    def prepare_response(self, query: str, context: Dict, top_k: int = 5) -> Tuple[Optional[List], ConversationType]:
         """
-        生成响应，支持对话类型识别
-        
-        Args:
-            query: 用户查询
-            context: 上下文信息（包含对话历史）
-            
+        生成回答前的全部准备（generate_response 与离线批量分析共用）：对话类型识别、精确统计、检索和构建 Prompt
+        只问数量、排名的问题直接用日志表的精确统计回答，写入 context['answer'] 并返回 (None, 对话类型)
+
         Returns:
-            str: LLM响应
+            tuple: (Prompt 消息列表, 对话类型)
         """
         # 识别对话类型
         conversation_type = self.detect_conversation_type(query, context.get('context', ''))
-        
-        # 检索相关日志
+        current_span().set_attribute("conversation_type", conversation_type.value)
+
+        # 只问数量、排名的问题不检索也不调用大模型
+        answer = self.answer_statistics(query)
+        if answer:
+            context['logs'], context['reasoning'], context['answer'] = [], '', answer
+            return None, conversation_type
+        context['statistics'] = self.statistics_for(query)
+        
+        # 检索相关日志：跟进问题沿用同一会话上一轮的检索结果（索引代一致时），其余类型完整检索
+        previous = context.get('retrieval_state')
+        reusable = (conversation_type == ConversationType.FOLLOW_UP_QUESTION and self.index_ready
+                    and previous and previous.get("generation") == self.index_generation)
         try:
-            logs = self.retrieve_logs(query, top_k=5)
+            if reusable:
+                logs = self._reuse_retrieval(query, previous, top_k=top_k)
+            else:
+                logs = self.retrieve_logs(query, top_k=top_k)
+                if self.index_ready:
+                    RETRIEVAL_REUSE.inc(outcome="full")
             context['logs'] = logs
         except Exception as e:
             logger.error(f"日志检索失败: {e}")
             context['logs'] = []
+        if self.index_ready:
+            context['retrieval_state'] = self._retrieval_state(query, context['logs'], previous if reusable else None)
         
         # 根据对话类型构建不同的Prompt
-        prompt = self._build_adaptive_prompt(query, context, conversation_type)
+        with observe_stage("prompt_build"):
+            prompt = self._build_adaptive_prompt(query, context, conversation_type)
+        return prompt, conversation_type
 
-        try:
-            response = self.llm.invoke(prompt)  # 调用LLM
-            return response
-        except Exception as e:
-            logger.error(f"LLM调用失败: {e}")
-            return f"生成响应时出错: {str(e)}"
+    def complete_response(self, prompt: List, conversation_type: ConversationType, context: Dict) -> str:
+        """
+        调用大模型生成回答，推理过程写入 context['reasoning']，回答中不包含 <think> 块
+        调用失败时抛出异常，没有得到回答（推理过程被截断）时抛出 EmptyAnswer
+        """
+        response, context['reasoning'] = self._invoke_llm(prompt, conversation_type)
+        return response
+
+    def statistics_for(self, query: str) -> str:
+        """统计类问题（有多少、最常见、前 N）在日志表上的精确统计，其他问题或没有日志表时返回空字符串"""
+        intent = log_analysis.detect_aggregate_intent(query)
+        if intent is None or self.log_store is None:
+            return ""
+        with observe_stage("aggregate"):
+            return self.log_store.aggregate(query, intent)
+
+    def answer_statistics(self, query: str) -> Optional[str]:
+        """
+        只问数量、排名而不需要分析的问题，返回可直接作为回答的统计结果，否则返回 None
+        问题中必须有可识别的过滤条件或分组维度，其余情况统计结果只放进 prompt（见 statistics_for）
+        """
+        if not log_analysis.is_statistics_only(query) or self.log_store is None:
+            return None
+        if not self.log_store.recognizes(query):
+            return None
+        return self.statistics_for(query) or None
+
+    def _invoke_llm(self, prompt: List,
+                    conversation_type: ConversationType = ConversationType.FAULT_ANALYSIS) -> Tuple[str, str]:
+        """
+        按对话类型路由到对应模型调用，返回 (最终回答, 推理过程)
+        生成过程中逐 token 分离 <think> 推理块，并根据 Ollama 返回的统计信息记录预填充、生成耗时和 token 数
+        限制了生成长度的调用没有得到回答时，不限长度用推理模型重试一次；仍没有回答时抛出 EmptyAnswer
+        """
+        from langchain_core.callbacks import BaseCallbackHandler
+        from langchain_core.prompt_values import ChatPromptValue
+
+        class ReasoningHandler(BaseCallbackHandler):
+            def __init__(self):
+                self.parser = ThinkStreamParser()
+
+            def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+                self.parser.feed(token)
+
+        def call(llm):
+            handler = ReasoningHandler()  # 回退重试时重新解析
+            with start_span("ollama.generate", model=llm.model) as span:
+                result = llm.generate_prompt([ChatPromptValue(messages=prompt)], callbacks=[handler])
+                generation = result.generations[0][0]
+                info = generation.generation_info or {}
+                span.set_attributes({
+                    "llm.prompt_tokens": info.get("prompt_eval_count") or 0,
+                    "llm.completion_tokens": info.get("eval_count") or 0,
+                })
+            parser = handler.parser
+            if parser.started_at is None:
+                parser.feed(generation.text)  # 模型不支持逐 token 回调时整体解析
+            parser.close()
+            return generation, parser, bool(getattr(llm, "num_predict", None))
+
+        with observe_stage("llm"):
+            generation, parser, capped = self.router.invoke(conversation_type.value, prompt, call)
+            if not parser.answer and capped:
+                logger.warning(f"生成长度限制内没有得到回答（推理过程{'被截断' if parser.truncated else '为空'}），"
+                               f"不限长度用 {self.router.default_model} 重试")
+                generation, parser, _ = call(self.router.llm_for({"model": self.router.default_model}))
+        info = generation.generation_info or {}
+
+        # Ollama 的耗时单位为纳秒
+        if info.get("prompt_eval_duration"):
+            STAGE_LATENCY.observe(info["prompt_eval_duration"] / 1e9, stage="llm.prefill")
+        if info.get("eval_duration"):
+            STAGE_LATENCY.observe(info["eval_duration"] / 1e9, stage="llm.generation")
+        LLM_TOKENS.inc(info.get("prompt_eval_count") or 0, kind="prompt")
+        LLM_TOKENS.inc(info.get("eval_count") or 0, kind="completion")
+        LLM_TOKENS.inc(parser.reasoning_tokens, kind="reasoning")
+        if parser.reasoning_seconds is not None:
+            STAGE_LATENCY.observe(parser.reasoning_seconds, stage="llm.reasoning")
+        if not parser.answer:
+            raise EmptyAnswer(parser.truncated)
+        return parser.answer, parser.reasoning
 
     def _build_adaptive_prompt(self, query: str, context: Dict, conversation_type: ConversationType) -> List[Dict]:
         """
@@ -443,6 +688,8 @@ class TopKLogSystem:
 
     def _build_fault_analysis_prompt(self, query: str, context: Dict) -> List[Dict]:
         """构建故障分析Prompt（返回Markdown格式）"""
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
         # 构建领域知识上下文
         domain_context = self._build_domain_context(context)
         
@@ -496,7 +743,7 @@ class TopKLogSystem:
         """)
 
         user_message = HumanMessagePromptTemplate.from_template("""
-## 相关日志信息
+{history}## 相关日志信息
 {log_context}
 
 ## 分析任务
@@ -511,10 +758,30 @@ class TopKLogSystem:
         ])
 
         return prompt.format_prompt(
+            history=self._build_history_section(context) + self._build_statistics_section(context),
             log_context=log_context,
             query=query
         ).to_messages()
 
+    @staticmethod
+    def _build_statistics_section(context: Dict) -> str:
+        """日志表上的精确统计（见 statistics_for），放在检索到的日志之前，数量类结论以此为准"""
+        statistics = context.get('statistics', '') if isinstance(context, dict) else ''
+        if not statistics:
+            return ''
+        return f"{statistics.strip()}\n（以上统计覆盖全部日志，涉及数量和排名时以此为准，不要根据下面的样例日志估算）\n\n"
+
+    @staticmethod
+    def _build_history_section(context: Dict) -> str:
+        """
+        对话历史段落：调用方在 context['history'] 中给出的最近轮次和与当前问题相关的早期轮次
+        条数和长度由调用方限定，prompt 大小不随会话增长
+        """
+        history = context.get('history', '') if isinstance(context, dict) else ''
+        if not history:
+            return ''
+        return f"## 对话历史（最近轮次及与当前问题相关的早期轮次）\n{history.strip()}\n\n"
+
     def _build_structured_context(self, context) -> str:
         """
         构建智能化的日志上下文，提高信息利用效率
@@ -572,20 +839,14 @@ class TopKLogSystem:
         filtered_logs = []
         
         for log in context:
-            content = log.get('content', '')
             score = log.get('score', 0)
             
             # 过滤条件
             if score < 0.1:  # 相关性太低
                 continue
             
-            # 提取关键信息
-            log_level = self._extract_log_level(content)
-            error_codes = self._extract_error_codes(content)
-            services = self._extract_services(content)
-            
-            # 计算信息价值分数
-            value_score = self._calculate_information_value(content, log_level, error_codes, services)
+            # 关键信息和信息价值分数：入库时已提取的直接使用，旧索引的结果再从内容中提取
+            log_level, error_codes, services, value_score = log_analysis.log_features(log)
             
             if value_score > 0.3:  # 信息价值阈值
                 log['value_score'] = value_score
@@ -599,31 +860,6 @@ class TopKLogSystem:
         
         return filtered_logs[:8]  # 限制最多8条
 
-    def _calculate_information_value(self, content: str, log_level: str, error_codes: List[str], services: List[str]) -> float:
-        """
-        计算日志信息价值分数
-        """
-        value_score = 0.0
-        
-        # 日志级别权重
-        level_weights = {'FATAL': 1.0, 'ERROR': 0.8, 'WARN': 0.6, 'INFO': 0.4, 'DEBUG': 0.2}
-        value_score += level_weights.get(log_level, 0.1)
-        
-        # 错误码权重
-        if error_codes:
-            value_score += 0.3
-        
-        # 服务名称权重
-        if services:
-            value_score += 0.2
-        
-        # 内容长度权重（避免过短或过长的日志）
-        content_length = len(content)
-        if 50 <= content_length <= 500:
-            value_score += 0.1
-        
-        return min(value_score, 1.0)  # 限制最大值为1.0
-
     def _format_log_entry(self, log: Dict, index: int, match_type: str) -> str:
         """
         格式化日志条目
@@ -641,124 +877,18 @@ class TopKLogSystem:
             formatted_entry += f"**错误码**: {', '.join(error_codes)}\n"
         if services:
             formatted_entry += f"**涉及服务**: {', '.join(services)}\n"
+        if log.get('occurrences', 1) > 1:
+            # 检索时合并的近似重复结果可能没有模板信息（旧索引），此时只给出次数
+            span = (f"（首次 {log['first_seen']}，末次 {log['last_seen']}）"
+                    if log.get('first_seen') and log.get('last_seen') else "")
+            formatted_entry += f"**出现次数**: {log['occurrences']}{span}\n"
+            if log.get('sample_params'):
+                formatted_entry += f"**参数示例**: {log['sample_params']}\n"
         
         formatted_entry += f"**内容**: {content}\n\n"
         
         return formatted_entry
 
-    def _build_domain_context(self, context) -> str:
-        """
-        构建领域知识上下文，为AI提供专业的故障诊断知识
-        """
-        # 处理不同类型的context
-        if isinstance(context, str):
-            # 如果是字符串，直接返回基础领域知识
-            return "## 领域知识\n基于系统故障诊断的专业知识。"
-        
-        if not context or not isinstance(context, (list, dict)):
-            return "## 领域知识\n暂无相关日志信息。"
-        
-        # 如果是字典，尝试获取logs
-        if isinstance(context, dict):
-            logs = context.get('logs', [])
-            if not logs:
-                return "## 领域知识\n基于系统故障诊断的专业知识。"
-        else:
-            logs = context
-        
-        # 提取所有错误码和服务
-        error_codes = set()
-        services = set()
-        
-        for log in logs:
-            if isinstance(log, dict):
-                content = log.get('content', '')
-            else:
-                content = str(log)
-            error_codes.update(self._extract_error_codes(content))
-            services.update(self._extract_services(content))
-        
-        # 构建领域知识上下文
-        domain_context = "## 相关错误码的专业知识\n"
-        
-        for error_code in list(error_codes)[:10]:  # 限制最多10个错误码
-            meaning = get_error_code_meaning(error_code)
-            category = get_fault_category(error_code)
-            severity = get_severity_level(error_code)
-            
-            domain_context += f"- **{error_code}**: {meaning}\n"
-            domain_context += f"  - 分类: {category}\n"
-            domain_context += f"  - 严重程度: {severity}\n"
-        
-        # 添加服务依赖关系
-        if services:
-            domain_context += "\n## 服务依赖关系\n"
-            for service in list(services)[:5]:  # 限制最多5个服务
-                dependencies = get_service_dependencies(service)
-                if dependencies:
-                    domain_context += f"- **{service}** 依赖: {', '.join(dependencies)}\n"
-        
-        # 添加常见故障模式
-        domain_context += "\n## 常见故障模式\n"
-        for pattern_name, pattern_info in list(COMMON_PATTERNS.items())[:3]:  # 限制最多3个模式
-            domain_context += f"- **{pattern_name}**:\n"
-            domain_context += f"  - 症状: {', '.join(pattern_info.get('symptoms', [])[:3])}\n"
-            domain_context += f"  - 常见原因: {', '.join(pattern_info.get('root_causes', [])[:3])}\n"
-            domain_context += f"  - 立即行动: {', '.join(pattern_info.get('immediate_actions', [])[:2])}\n"
-        
-        # 添加专家洞察和行业标准
-        domain_context += "\n## 专家洞察和行业标准\n"
-        expert_patterns = ["数据库连接池耗尽", "认证失败", "支付异常"]
-        for pattern in expert_patterns[:2]:  # 限制最多2个模式
-            insights = get_expert_insights(pattern)
-            standards = get_industry_standards(pattern)
-            
-            if insights:
-                domain_context += f"- **{pattern}专家洞察**:\n"
-                for insight in insights[:2]:  # 限制最多2条洞察
-                    domain_context += f"  - {insight}\n"
-            
-            if standards:
-                domain_context += f"- **{pattern}行业标准**:\n"
-                for standard in standards[:2]:  # 限制最多2条标准
-                    domain_context += f"  - {standard}\n"
-        
-        # 添加行业最佳实践
-        domain_context += "\n## 行业最佳实践\n"
-        best_practices = get_best_practices("微服务架构")
-        if best_practices:
-            domain_context += "- **微服务架构最佳实践**:\n"
-            for category, practices in list(best_practices.items())[:2]:  # 限制最多2个类别
-                domain_context += f"  - {category}: {', '.join(practices[:2])}\n"
-        
-        return domain_context
-
-    def _extract_log_level(self, content: str) -> str:
-        """提取日志级别"""
-        import re
-        levels = ['FATAL', 'ERROR', 'WARN', 'WARNING', 'INFO', 'INFORMATION', 'DEBUG']
-        for level in levels:
-            if re.search(r'\b' + level + r'\b', content, re.IGNORECASE):
-                return level
-        return "UNKNOWN"
-
-    def _extract_error_codes(self, content: str) -> List[str]:
-        """提取错误码"""
-        import re
-        # 匹配大写字母+数字+下划线的模式
-        pattern = r'\b[A-Z][A-Z0-9_]{2,}\b'
-        matches = re.findall(pattern, content)
-        # 过滤掉常见的非错误码词汇
-        exclude_words = {'HTTP', 'URL', 'API', 'JSON', 'XML', 'SQL', 'TCP', 'UDP', 'IP', 'DNS'}
-        return [match for match in matches if match not in exclude_words]
-
-    def _extract_services(self, content: str) -> List[str]:
-        """提取服务名称"""
-        import re
-        # 匹配以Service结尾的词汇
-        pattern = r'\b[A-Za-z][A-Za-z0-9]*Service\b'
-        return re.findall(pattern, content)
-
         # 执行查询
 
     def query(self, query: str) -> Dict:
@@ -772,6 +902,8 @@ class TopKLogSystem:
 
     def _build_follow_up_prompt(self, query: str, context: Dict) -> List[Dict]:
         """构建跟进问题Prompt（返回Markdown格式）"""
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
         # 构建领域知识上下文
         domain_context = self._build_domain_context(context)
         
@@ -796,7 +928,7 @@ class TopKLogSystem:
         """)
 
         user_message = HumanMessagePromptTemplate.from_template("""
-## 相关日志信息
+{history}## 相关日志信息
 {log_context}
 
 ## 用户问题
@@ -811,12 +943,15 @@ class TopKLogSystem:
         ])
 
         return prompt.format_prompt(
+            history=self._build_history_section(context) + self._build_statistics_section(context),
             log_context=log_context,
             query=query
         ).to_messages()
 
     def _build_prevention_prompt(self, query: str, context: Dict) -> List[Dict]:
         """构建预防措施Prompt（返回Markdown格式）"""
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
         # 构建领域知识上下文
         domain_context = self._build_domain_context(context)
         
@@ -862,7 +997,7 @@ class TopKLogSystem:
         """)
 
         user_message = HumanMessagePromptTemplate.from_template("""
-## 相关日志信息
+{history}## 相关日志信息
 {log_context}
 
 ## 用户问题
@@ -877,12 +1012,15 @@ class TopKLogSystem:
         ])
 
         return prompt.format_prompt(
+            history=self._build_history_section(context) + self._build_statistics_section(context),
             log_context=log_context,
             query=query
         ).to_messages()
 
     def _build_dependency_prompt(self, query: str, context: Dict) -> List[Dict]:
         """构建依赖关系Prompt（返回Markdown格式）"""
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
         # 构建领域知识上下文
         domain_context = self._build_domain_context(context)
         
@@ -928,7 +1066,7 @@ class TopKLogSystem:
         """)
 
         user_message = HumanMessagePromptTemplate.from_template("""
-## 相关日志信息
+{history}## 相关日志信息
 {log_context}
 
 ## 用户问题
@@ -943,12 +1081,15 @@ class TopKLogSystem:
         ])
 
         return prompt.format_prompt(
+            history=self._build_history_section(context) + self._build_statistics_section(context),
             log_context=log_context,
             query=query
         ).to_messages()
 
     def _build_explanation_prompt(self, query: str, context: Dict) -> List[Dict]:
         """构建解释请求Prompt（返回Markdown格式）"""
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
         # 构建领域知识上下文
         domain_context = self._build_domain_context(context)
         
@@ -995,7 +1136,7 @@ class TopKLogSystem:
         """)
 
         user_message = HumanMessagePromptTemplate.from_template("""
-## 相关日志信息
+{history}## 相关日志信息
 {log_context}
 
 ## 用户问题
@@ -1010,12 +1151,15 @@ class TopKLogSystem:
         ])
 
         return prompt.format_prompt(
+            history=self._build_history_section(context) + self._build_statistics_section(context),
             log_context=log_context,
             query=query
         ).to_messages()
 
     def _build_general_prompt(self, query: str, context: Dict) -> List[Dict]:
         """构建一般问题Prompt（返回Markdown格式）"""
+        from langchain.prompts import ChatPromptTemplate, HumanMessagePromptTemplate, SystemMessagePromptTemplate
+
         # 构建领域知识上下文
         domain_context = self._build_domain_context(context)
         
@@ -1060,7 +1204,7 @@ class TopKLogSystem:
         """)
 
         user_message = HumanMessagePromptTemplate.from_template("""
-## 相关日志信息
+{history}## 相关日志信息
 {log_context}
 
 ## 用户问题
@@ -1075,6 +1219,7 @@ class TopKLogSystem:
         ])
 
         return prompt.format_prompt(
+            history=self._build_history_section(context) + self._build_statistics_section(context),
             log_context=log_context,
             query=query
         ).to_messages()
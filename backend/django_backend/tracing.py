@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+OpenTelemetry 链路追踪
+通过环境变量配置，未启用时不导入 OpenTelemetry，开销接近于零：
+
+- IDA_TRACING_EXPORTER: none（默认）| console | file | otlp
+- IDA_TRACING_FILE: file 导出器写入的 JSONL 文件路径
+- IDA_TRACING_SAMPLE_RATE: 根 span 采样率（0~1），子 span 跟随父 span 的采样决定
+- OTLP 导出器的地址等沿用 OpenTelemetry 标准环境变量（OTEL_EXPORTER_OTLP_ENDPOINT 等）
+"""
+
+import functools
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.environ.get("IDA_TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.environ.get("IDA_TRACING_FILE", "./data/traces/spans.jsonl")
+TRACING_SAMPLE_RATE = float(os.environ.get("IDA_TRACING_SAMPLE_RATE", "0.1"))
+SERVICE_NAME = "ida-log-analysis"
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+class _NoopSpan:
+    """未启用追踪时使用的空 span"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _create_file_exporter(path: str):
+    """把 span 以 JSON Lines 形式追加写入本地文件，便于离线分析"""
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonLinesFileExporter(SpanExporter):
+        def __init__(self):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._file = open(path, "a", encoding="utf-8")
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            with self._lock:
+                for span in spans:
+                    self._file.write(span.to_json(indent=None) + "\n")
+                self._file.flush()
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self):
+            with self._lock:
+                self._file.close()
+
+    return JsonLinesFileExporter()
+
+
+def _init_tracer():
+    """按配置初始化 TracerProvider，OpenTelemetry 未安装或配置为 none 时返回 None"""
+    if TRACING_EXPORTER in ("", "none"):
+        return None
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError:
+        logger.warning("未安装 opentelemetry-sdk，链路追踪已禁用")
+        return None
+
+    if TRACING_EXPORTER == "console":
+        exporter = ConsoleSpanExporter()
+    elif TRACING_EXPORTER == "file":
+        exporter = _create_file_exporter(TRACING_FILE)
+    elif TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        logger.warning(f"未知的追踪导出器: {TRACING_EXPORTER}，链路追踪已禁用")
+        return None
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATE)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+    logger.info(f"链路追踪已启用: exporter={TRACING_EXPORTER}, sample_rate={TRACING_SAMPLE_RATE}")
+    return trace.get_tracer(SERVICE_NAME)
+
+
+def get_tracer():
+    """获取进程内共享的 tracer，未启用追踪时返回 None"""
+    global _tracer
+    if _tracer is None and TRACING_EXPORTER not in ("", "none"):
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = _init_tracer() or False
+    return _tracer or None
+
+
+@contextmanager
+def start_span(name: str, **attributes) -> Iterator[Any]:
+    """开启一个 span（自动挂到当前 span 之下），未启用追踪时返回空 span"""
+    tracer = get_tracer()
+    if tracer is None:
+        yield _NOOP_SPAN
+        return
+    with tracer.start_as_current_span(name) as span:
+        if attributes:
+            span.set_attributes({k: v for k, v in attributes.items() if v is not None})
+        yield span
+
+
+def current_span() -> Any:
+    """获取当前 span，用于在调用链内部补充属性"""
+    if get_tracer() is None:
+        return _NOOP_SPAN
+    from opentelemetry import trace
+    return trace.get_current_span()
+
+
+def traced(name: Optional[str] = None):
+    """函数装饰器：在 span 中执行被装饰的函数"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator